@@ -0,0 +1,308 @@
+"""
+Замеры основных запросов utils/db.py на базе реального масштаба.
+
+Запуск из корня проекта:
+    python benchmarks/bench_db.py --channels 100000 --permissions 1000000 --json results.json
+    python benchmarks/bench_db.py --json new.json --compare results.json
+
+Создает временную базу и наполняет ее каналами, пользователями и правами.
+Админы распределены неравномерно: у большинства пользователей пара каналов,
+у единиц — тысячи (агентства, сетки каналов). На таких пользователях схема
+и упирается в масштаб первой.
+
+Каждая операция замеряется через настоящий асинхронный API Database
+(с переходом в поток) в двух режимах:
+    * cold — перед каждым замером база открывается заново (пустой кэш страниц
+      SQLite), а файлы базы по возможности вытесняются из кэша ОС (posix_fadvise);
+    * warm — повторные вызовы на прогретых соединениях.
+
+--json сохраняет результаты для сравнения между коммитами, --compare печатает
+разницу с ранее сохраненным файлом.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from functools import partial
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TMP_DIR = tempfile.mkdtemp(prefix="bench_db_")
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ["DATABASE_PATH"] = os.path.join(TMP_DIR, "bench.db")
+
+from utils.db import db, Database  # noqa: E402
+
+DB_FILE = os.environ["DATABASE_PATH"]
+CHANNEL_BASE = -1001000000000
+
+
+def channel_id(index):
+    return str(CHANNEL_BASE - index)
+
+
+# --- НАПОЛНЕНИЕ ---
+
+def fill(channels, users, permissions, batch, rnd):
+    """
+    Каналы, пользователи и права. У каждого канала один владелец и несколько админов;
+    номер админа берется логарифмически-равномерно, поэтому первые пользователи
+    оказываются админами в тысячах каналов.
+    """
+    per_channel = max(1, permissions // channels)
+    conn = db.conn
+    started = time.perf_counter()
+
+    conn.execute("BEGIN")
+    for start in range(0, users, batch):
+        conn.executemany("INSERT INTO users (user_id, username) VALUES (?, ?)",
+                         [(uid, f"user{uid}") for uid in range(start + 1, min(users, start + batch) + 1)])
+    conn.execute("COMMIT")
+
+    total = 0
+    for start in range(0, channels, batch):
+        channel_rows, permission_rows = [], []
+        for index in range(start, min(channels, start + batch)):
+            cid = channel_id(index)
+            channel_rows.append((cid, f"Канал {index}"))
+            owner = rnd.randint(1, users)
+            admins = {int(users ** rnd.random()) for _ in range(per_channel - 1)} - {owner}
+            permission_rows.append((owner, cid, 1))
+            permission_rows += [(uid, cid, 0) for uid in admins]
+        conn.execute("BEGIN")
+        conn.executemany("INSERT INTO channels (channel_id, title) VALUES (?, ?)", channel_rows)
+        conn.executemany("INSERT INTO permissions (user_id, channel_id, is_owner) VALUES (?, ?, ?)",
+                         permission_rows)
+        conn.execute("COMMIT")
+        total += len(permission_rows)
+
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return total, time.perf_counter() - started
+
+
+def pick_users():
+    """Типичный пользователь (медиана по числу каналов) и самый "тяжелый" админ"""
+    rows = db.conn.execute("""
+        SELECT user_id, COUNT(*) AS n FROM permissions WHERE is_owner = 0
+        GROUP BY user_id ORDER BY n
+    """).fetchall()
+    typical, heavy = rows[len(rows) // 2], rows[-1]
+    return typical, heavy
+
+
+# --- КЭШ ---
+
+def evict_os_cache():
+    """Вытеснение файлов базы из кэша страниц ОС (без root, только чистые страницы)"""
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    for suffix in ("", "-wal", "-shm"):
+        path = DB_FILE + suffix
+        if not os.path.exists(path):
+            continue
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+    return True
+
+
+async def timed(call):
+    started = time.perf_counter()
+    await call()
+    return (time.perf_counter() - started) * 1000
+
+
+async def measure_cold(make_call, repeats):
+    """Каждый замер — на только что открытой базе"""
+    timings = []
+    for _ in range(repeats):
+        database = Database(DB_FILE)
+        database.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        evict_os_cache()
+        try:
+            timings.append(await timed(make_call(database)))
+        finally:
+            database.close()
+    return timings
+
+
+async def measure_warm(make_call, repeats, warmup):
+    database = Database(DB_FILE)
+    try:
+        for _ in range(warmup):
+            await make_call(database)()
+        return [await timed(make_call(database)) for _ in range(repeats)]
+    finally:
+        database.close()
+
+
+def summarize(name, cache, timings):
+    ordered = sorted(timings)
+
+    def pct(q):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+    return {
+        'op': name,
+        'cache': cache,
+        'n': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered), 4),
+        'p50_ms': round(statistics.median(ordered), 4),
+        'p95_ms': round(pct(0.95), 4),
+        'p99_ms': round(pct(0.99), 4),
+        'max_ms': round(ordered[-1], 4),
+    }
+
+
+# --- ОПЕРАЦИИ ---
+
+def build_cases(args, rnd, typical, heavy):
+    """
+    Список (название, фабрика): фабрика получает открытую Database и возвращает
+    корутинную функцию для одного замера. У каждой операции свой счетчик замеров,
+    так что запись (правка админов, удаление) никогда не повторяется на том же канале.
+    """
+    samples = args.cold_repeats + args.warmup + args.repeats
+    random_channels = [rnd.randrange(args.channels) for _ in range(samples)]
+    doomed = [channel_id(i) for i in rnd.sample(range(args.channels), samples)]
+
+    def owner_of(index):
+        return db.conn.execute("SELECT user_id FROM permissions WHERE channel_id = ? AND is_owner = 1",
+                               (channel_id(index),)).fetchone()[0]
+
+    def admins_of(index):
+        return [{'id': uid, 'username': f"user{uid}", 'is_owner': bool(is_owner)}
+                for uid, is_owner in db.conn.execute(
+                    "SELECT user_id, is_owner FROM permissions WHERE channel_id = ?", (channel_id(index),))]
+
+    # Входные данные готовим заранее, чтобы не замерять их сборку
+    owners = [owner_of(index) for index in random_channels]
+    sync_same = [admins_of(index) for index in random_channels]
+    sync_changed = [
+        [a for a in admins if a['is_owner']] + [a for a in admins if not a['is_owner']][1:]
+        + [{'id': args.users + 1 + i, 'username': "new", 'is_owner': False}]
+        for i, admins in enumerate(sync_same)
+    ]
+
+    def case(make):
+        counter = itertools.count()
+        return lambda database: make(database, next(counter))
+
+    def sync(admins):
+        return lambda d, i: partial(d.sync_channel_admins, channel_id(random_channels[i]),
+                                    f"Канал {random_channels[i]}", admins[i])
+
+    return [
+        ("get_user_channels (типичный админ)",
+         case(lambda d, i: partial(d.get_user_channels, typical[0], "admin"))),
+        ("get_user_channels (тяжелый админ)",
+         case(lambda d, i: partial(d.get_user_channels, heavy[0], "admin"))),
+        ("get_user_channels (владелец)",
+         case(lambda d, i: partial(d.get_user_channels, owners[i], "owner"))),
+        ("is_user_owner",
+         case(lambda d, i: partial(d.is_user_owner, owners[i], channel_id(random_channels[i])))),
+        ("get_channel_owner_id",
+         case(lambda d, i: partial(d.get_channel_owner_id, channel_id(random_channels[i])))),
+        ("sync_channel_admins (без изменений)", case(sync(sync_same))),
+        ("sync_channel_admins (+1/-1 админ)", case(sync(sync_changed))),
+        ("delete_channel (с каскадом)",
+         case(lambda d, i: partial(d.delete_channel, doomed[i]))),
+    ]
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_comparison(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r['op'], r['cache']): r for r in json.load(f)['results']}
+    print(f"\nСравнение p50 с {baseline_path}:")
+    for r in results:
+        old = baseline.get((r['op'], r['cache']))
+        if not old:
+            continue
+        delta = (r['p50_ms'] - old['p50_ms']) / old['p50_ms'] * 100 if old['p50_ms'] else 0.0
+        print(f"{r['op']:<44}{r['cache']:>6}{old['p50_ms']:>10.3f}{r['p50_ms']:>10.3f}{delta:>+9.1f}%")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--channels", type=int, default=100000)
+    parser.add_argument("--users", type=int, default=200000)
+    parser.add_argument("--permissions", type=int, default=1000000, help="примерное число строк прав")
+    parser.add_argument("--batch", type=int, default=10000)
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--cold-repeats", type=int, default=15)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="куда сохранить результаты")
+    parser.add_argument("--compare", help="файл --json прошлого прогона для сравнения")
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    try:
+        rows, elapsed = fill(args.channels, args.users, args.permissions, args.batch, rnd)
+        size_mb = os.path.getsize(DB_FILE) / 1024 / 1024
+        print(f"Каналов: {args.channels}, пользователей: {args.users}, прав: {rows}; "
+              f"наполнение {elapsed:.1f} с, база {size_mb:.0f} МБ")
+        typical, heavy = pick_users()
+        print(f"Типичный админ: {typical[1]} кан., самый тяжелый: {heavy[1]} кан.")
+        cases = build_cases(args, rnd, typical, heavy)
+        db.close()
+
+        print(f"\n{'Операция':<44}{'кэш':>6}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+        results = []
+        for name, make_call in cases:
+            for cache, timings in (("cold", await measure_cold(make_call, args.cold_repeats)),
+                                   ("warm", await measure_warm(make_call, args.repeats, args.warmup))):
+                r = summarize(name, cache, timings)
+                results.append(r)
+                print(f"{name:<44}{cache:>6}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}{r['p99_ms']:>10.3f}")
+
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump({
+                    'meta': {
+                        'revision': git_revision(),
+                        'created_at': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        'python': platform.python_version(),
+                        'sqlite': sqlite3.sqlite_version,
+                        'os_cache_evicted': hasattr(os, "posix_fadvise"),
+                        'channels': args.channels,
+                        'users': args.users,
+                        'permissions': rows,
+                        'typical_admin_channels': typical[1],
+                        'heavy_admin_channels': heavy[1],
+                        'db_size_mb': round(size_mb, 1),
+                    },
+                    'results': results,
+                }, f, ensure_ascii=False, indent=2)
+            print(f"\nРезультаты сохранены в {args.json}")
+
+        if args.compare:
+            print_comparison(results, args.compare)
+    finally:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,127 @@
+"""
+Нагрузочная проверка поиска /find (FTS5) на большой истории постов.
+
+Запуск из корня проекта:
+    python benchmarks/bench_search.py --posts 300000
+
+Создает временную базу, наполняет ее постами (индекс обновляется триггерами
+при вставке, как в работе бота) и замеряет время db.search для разных запросов.
+Слова в постах распределены неравномерно (закон Ципфа), как в живых текстах,
+а у пользователя права только в части каналов — поиск фильтрует чужие посты.
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TMP_DIR = tempfile.mkdtemp(prefix="bench_search_")
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ["DATABASE_PATH"] = os.path.join(TMP_DIR, "bench.db")
+
+from utils.db import db  # noqa: E402
+
+SYLLABLES = ["ка", "ло", "ми", "ре", "ту", "са", "но", "ви", "да", "пе", "ру", "зо", "ба", "ги", "ле", "ко"]
+COMMON = ["новости", "акция", "скидка", "сегодня", "канал", "обзор", "видео", "релиз"]
+
+
+def make_vocabulary(size, rnd):
+    words = set()
+    while len(words) < size:
+        words.add("".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))))
+    return sorted(words)
+
+
+def make_post(rnd, vocabulary):
+    # Частые слова встречаются почти везде, остальные — по закону Ципфа
+    words = [rnd.choice(COMMON)] + [vocabulary[min(int(rnd.paretovariate(1.1)) - 1, len(vocabulary) - 1)]
+                                    if rnd.random() < 0.5 else rnd.choice(vocabulary)
+                                    for _ in range(rnd.randint(15, 60))]
+    text = " ".join(words)
+    if rnd.random() < 0.3:
+        return f"<b>{words[0]}</b>\n{text}", 1
+    return text, 0
+
+
+def fill(posts, channels, user_channels, batch, seed):
+    rnd = random.Random(seed)
+    vocabulary = make_vocabulary(5000, rnd)
+    conn = db.conn
+
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO channels (channel_id, title) VALUES (?, ?)",
+                     [(str(-1000 - i), f"Канал {i}") for i in range(channels)])
+    conn.execute("INSERT INTO users (user_id, username) VALUES (1, 'bench')")
+    conn.executemany("INSERT INTO permissions (user_id, channel_id, is_owner) VALUES (1, ?, 1)",
+                     [(str(-1000 - i),) for i in range(user_channels)])
+    conn.executemany("INSERT INTO templates (user_id, name, body, updated_at) VALUES (1, ?, ?, ?)",
+                     [(f"Шаблон {i}", make_post(rnd, vocabulary)[0], time.time()) for i in range(30)])
+    conn.execute("COMMIT")
+
+    started = time.perf_counter()
+    now = time.time()
+    for start in range(0, posts, batch):
+        rows = []
+        for i in range(start, min(posts, start + batch)):
+            text, is_html = make_post(rnd, vocabulary)
+            rows.append((1, str(-1000 - rnd.randrange(channels)), text, is_html, now - i))
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO posts (user_id, channel_id, post_text, is_html, published_at) VALUES (?, ?, ?, ?, ?)", rows
+        )
+        conn.execute("COMMIT")
+    elapsed = time.perf_counter() - started
+    return vocabulary, elapsed
+
+
+async def measure(query, offset, repeats):
+    timings = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        await db.search(1, query, offset)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.95) - 1]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=300000)
+    parser.add_argument("--channels", type=int, default=200)
+    parser.add_argument("--user-channels", type=int, default=20, help="в скольких каналах у пользователя есть права")
+    parser.add_argument("--batch", type=int, default=5000)
+    parser.add_argument("--repeats", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    vocabulary, elapsed = fill(args.posts, args.channels, args.user_channels, args.batch, args.seed)
+    size_mb = os.path.getsize(os.environ["DATABASE_PATH"]) / 1024 / 1024
+    print(f"Постов: {args.posts}, вставка с индексацией: {elapsed:.1f} с "
+          f"({args.posts / elapsed:.0f} постов/с), база: {size_mb:.0f} МБ\n")
+
+    cases = [
+        ("редкое слово", vocabulary[-1], 0),
+        ("частое слово (топ по рангу)", COMMON[0], 0),
+        ("частое слово, 10-я страница", COMMON[0], 45),
+        ("два слова", f"{COMMON[1]} {vocabulary[-2]}", 0),
+        ("два частых слова (хуже всего)", f"{COMMON[1]} {vocabulary[0]}", 0),
+        ("префикс", vocabulary[len(vocabulary) // 2][:3], 0),
+        ("нет совпадений", "несуществующееслово", 0),
+    ]
+    print(f"{'Запрос':<32}{'p50, мс':>10}{'p95, мс':>10}")
+    for title, query, offset in cases:
+        p50, p95 = await measure(query, offset, args.repeats)
+        print(f"{title:<32}{p50:>10.2f}{p95:>10.2f}")
+
+    db.close()
+    shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,194 @@
+"""
+Публикация файлов с сервера (utils/uploads.py) против заглушки Bot API.
+
+Запуск из корня проекта:
+    python benchmarks/bench_uploads.py --size-mb 200 --channels 10
+
+Заглушка принимает multipart-загрузки кусками (тело в памяти не копится), считает
+полученные байты и отвечает сообщениями с file_id; она же раздает файлы по HTTP.
+Фазы:
+    1. новый файл с диска сразу в --channels каналов — одна загрузка на всех, остальные по file_id;
+    2. тот же файл еще раз — без загрузки;
+    3. тот же файл по URL — скачивание, но без загрузки в Telegram;
+    4. альбом из трех новых видео и он же повторно.
+
+Отчет по фазам: время, загружено в «Telegram» (МБ), загрузок / отправок по file_id
+и прирост пикового RSS процесса — при потоковой отправке он не зависит от размера файла.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TMP_DIR = tempfile.mkdtemp(prefix="bench_uploads_")
+os.environ.setdefault("BOT_TOKEN", "42:UPLOADS")
+os.environ["DATABASE_PATH"] = os.path.join(TMP_DIR, "uploads.db")
+os.environ["UPLOAD_DIR"] = os.path.join(TMP_DIR, "files")
+
+from aiohttp import web  # noqa: E402
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+
+from utils.db import db  # noqa: E402
+from utils.publisher import send_to_tg  # noqa: E402
+from utils.uploads import upload_cache  # noqa: E402
+
+BOT_ID = 42
+CHANNEL_BASE = -1001000000000
+# Поле ответа с файлом для каждого метода
+SEND_METHODS = {"sendphoto": "photo", "sendvideo": "video", "sendaudio": "audio"}
+
+
+# --- ЗАГЛУШКА BOT API ---
+
+class StubBotAPI:
+    """Bot API с потоковым приемом файлов и раздачей файлов по /files/<имя>"""
+
+    def __init__(self, files_dir):
+        self.files_dir = files_dir
+        self.calls = Counter()
+        self.received_bytes = 0
+        self.uploads = 0    # Частей multipart с файлом
+        self.by_file_id = 0  # Файлов, отправленных по file_id
+        self._file_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._runner = None
+
+    async def start(self):
+        app = web.Application(client_max_size=1 << 40)
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/files/{name}", self.serve_file)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", 0).start()
+        return f"http://127.0.0.1:{self._runner.addresses[0][1]}"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def serve_file(self, request):
+        return web.FileResponse(os.path.join(self.files_dir, request.match_info["name"]))
+
+    async def handle(self, request):
+        method = request.match_info["method"].lower()
+        self.calls[method] += 1
+        if method == "getme":
+            return web.json_response({"ok": True, "result": {"id": BOT_ID, "is_bot": True, "first_name": "bench"}})
+
+        fields = {}
+        if request.content_type == "multipart/form-data":
+            reader = await request.multipart()
+            while (part := await reader.next()) is not None:
+                if part.filename:
+                    # Файл читается кусками и отбрасывается
+                    while chunk := await part.read_chunk():
+                        self.received_bytes += len(chunk)
+                    self.uploads += 1
+                else:
+                    fields[part.name] = await part.text()
+        else:
+            fields = dict(await request.post())
+        chat_id = int(fields["chat_id"])
+
+        if method == "sendmediagroup":
+            media = json.loads(fields["media"])
+            self.by_file_id += sum(1 for m in media if not m["media"].startswith("attach://"))
+            return web.json_response({"ok": True, "result": [self.message(chat_id, m["type"]) for m in media]})
+        if method in SEND_METHODS:
+            kind = SEND_METHODS[method]
+            if not fields.get(kind, "attach://").startswith("attach://"):
+                self.by_file_id += 1
+            return web.json_response({"ok": True, "result": self.message(chat_id, kind)})
+        return web.json_response({"ok": True, "result": True})
+
+    def message(self, chat_id, kind):
+        file_id = f"stub{next(self._file_ids)}"
+        file = {"file_id": file_id, "file_unique_id": file_id, "file_size": 1}
+        if kind == "photo":
+            file = [{**file, "width": 1, "height": 1}]
+        elif kind in ("video", "audio"):
+            file.update({"duration": 1, "width": 1, "height": 1} if kind == "video" else {"duration": 1})
+        return {"message_id": next(self._message_ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "channel"}, kind: file}
+
+
+# --- ПРОГОН ---
+
+def make_file(path, size_mb):
+    """Файл нужного размера, записанный кусками по 1 МБ (каждый кусок свой — хэши разные)"""
+    block = os.urandom(1 << 20)
+    with open(path, "wb") as f:
+        for i in range(size_mb):
+            f.write(i.to_bytes(8, "big") + block[8:])
+
+
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def phase(name, stub, coro_factory):
+    bytes_before, uploads_before, by_id_before = stub.received_bytes, stub.uploads, stub.by_file_id
+    rss_before = peak_rss_mb()
+    started = time.perf_counter()
+    results = await coro_factory()
+    elapsed = time.perf_counter() - started
+    failed = [r for r in results if isinstance(r, Exception)]
+    print(f"{name:<34}{elapsed:>8.2f}{(stub.received_bytes - bytes_before) / 1048576:>10.1f}"
+          f"{stub.uploads - uploads_before:>10}{stub.by_file_id - by_id_before:>10}"
+          f"{peak_rss_mb() - rss_before:>12.1f}")
+    for error in failed[:3]:
+        print(f"    ошибка: {error!r}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=100, help="размер основного файла")
+    parser.add_argument("--channels", type=int, default=10, help="каналов в фазе рассылки")
+    args = parser.parse_args()
+
+    files_dir = os.environ["UPLOAD_DIR"]
+    os.makedirs(files_dir)
+    make_file(os.path.join(files_dir, "big.mp4"), args.size_mb)
+    for i in range(3):
+        make_file(os.path.join(files_dir, f"clip{i}.mp4"), max(1, args.size_mb // 10))
+
+    stub = StubBotAPI(files_dir)
+    api_url = await stub.start()
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)))
+    big = [{'type': "video", 'path': "big.mp4"}]
+    clips = [{'type': "video", 'path': f"clip{i}.mp4"} for i in range(3)]
+
+    def send(media_list, channels=1):
+        return lambda: asyncio.gather(*(send_to_tg(bot, CHANNEL_BASE - i, media_list, "bench")
+                                        for i in range(channels)), return_exceptions=True)
+
+    print(f"Файл: {args.size_mb} МБ, каналов в рассылке: {args.channels}\n")
+    print(f"{'фаза':<34}{'сек':>8}{'МБ в API':>10}{'загрузок':>10}{'file_id':>10}{'ΔRSS, МБ':>12}")
+    try:
+        with db.bot_scope(BOT_ID):
+            await phase(f"1. с диска, {args.channels} каналов", stub, send(big, args.channels))
+            await phase("2. тот же файл повторно", stub, send(big))
+            await phase("3. тот же файл по URL", stub, send([{'type': "video", 'url': f"{api_url}/files/big.mp4"}]))
+            await phase("4. альбом из 3 новых видео", stub, send(clips))
+            await phase("4. тот же альбом повторно", stub, send(clips))
+        print(f"\nИтого: {upload_cache.stats()}")
+    finally:
+        await upload_cache.close()
+        await bot.session.close()
+        await stub.stop()
+        db.close()
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,298 @@
+"""
+Масштабирование по процессам: пропускная способность вебхука при WORKERS = 1, 2, 4...
+
+Запуск из корня проекта:
+    python benchmarks/bench_workers.py --workers 1,2,4 --users 2000
+    python benchmarks/bench_workers.py --workers 1,4 --redis-url redis://localhost:6379/15
+
+Для каждого значения WORKERS запускается настоящий main.py в режиме вебхука
+(при WORKERS > 1 — вход кластера и обработчики, utils/cluster.py) против заглушки
+Bot API (BOT_API_URL). Синтетические пользователи присылают команды /start и /find
+(сессия FSM, запрос к SQLite, ответ в чат) как настоящие: следующее обновление —
+только после ответа бота на предыдущее. Одновременно активны --concurrency пользователей.
+
+Отчет: обновлений в секунду, ускорение относительно первой строки и p50/p99
+времени от POST вебхука до ответа бота в Bot API. Ускорение ограничено числом
+ядер (os.cpu_count() печатается в шапке): заглушка и генератор нагрузки
+работают в этом же процессе и тоже занимают ядро.
+
+Поэтому отдельно печатается процессорное время на одно обновление (Linux, /proc):
+у входа кластера и у обработчиков. Потолок кластера на машине с достаточным числом
+ядер — 1000 / (мс входа) обновлений в секунду, а каждый обработчик добавляет
+до 1000 / (мс обработчика); на одном ядре оба делят одно и то же время.
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import shutil
+import signal
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import aiohttp
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_TOKEN = "42:BENCH"
+WEBHOOK_PATH = "/webhook"
+
+
+# --- ЗАГЛУШКА BOT API ---
+
+class StubBotAPI:
+    """Отвечает на любой метод; на sendMessage — сообщением и сигналом ожидающему пользователю"""
+
+    def __init__(self):
+        self.calls = defaultdict(int)
+        self._waiters = defaultdict(list)  # chat_id -> [future, ...]
+        self._message_ids = itertools.count(1)
+        self._runner = None
+
+    async def start(self, port=0):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", port).start()
+        return f"http://127.0.0.1:{self._runner.addresses[0][1]}"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    def expect_reply(self, chat_id):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id].append(future)
+        return future
+
+    async def handle(self, request):
+        method = request.match_info["method"].lower()
+        self.calls[method] += 1
+        if method == "getme":
+            return web.json_response({"ok": True, "result": {"id": 42, "is_bot": True, "first_name": "bench"}})
+        if method != "sendmessage":
+            return web.json_response({"ok": True, "result": True})
+
+        data = await request.post()
+        chat_id = int(data["chat_id"])
+        waiters = self._waiters.get(chat_id)
+        # Отмененные ожидания (обработчик еще не поднялся) пропускаем
+        while waiters:
+            future = waiters.pop(0)
+            if not future.done():
+                future.set_result(time.perf_counter())
+                break
+        return web.json_response({"ok": True, "result": {
+            "message_id": next(self._message_ids), "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": data.get("text", ""),
+        }})
+
+
+# --- ОБНОВЛЕНИЯ ---
+
+_update_ids = itertools.count(1)
+
+
+def command_update(user_id, text):
+    return {
+        "update_id": next(_update_ids),
+        "message": {
+            "message_id": next(_update_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "u"},
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}],
+        },
+    }
+
+
+def user_script(user_id, updates):
+    texts = ("/start", "/find кофе акция")
+    return [command_update(user_id, texts[i % len(texts)]) for i in range(updates)]
+
+
+# --- ПРОГОН ---
+
+class Cluster:
+    """main.py с нужным числом обработчиков в отдельном процессе"""
+
+    def __init__(self, workers, port, base_port, api_url, db_dir, redis_url):
+        self.workers = workers
+        self.port = port
+        env = dict(os.environ)
+        env.update({
+            "BOT_TOKEN": BOT_TOKEN,
+            "BOT_TOKENS": "",
+            "BOT_MODE": "webhook",
+            "BOT_API_URL": api_url,
+            "WORKERS": str(workers),
+            "WORKER_BASE_PORT": str(base_port),
+            "WEBHOOK_HOST": "127.0.0.1",
+            "WEBHOOK_PORT": str(port),
+            "WEBHOOK_PATH": WEBHOOK_PATH,
+            "WEBHOOK_BASE_URL": "",
+            "WEBHOOK_SECRET": "",
+            "DATABASE_PATH": os.path.join(db_dir, f"workers{workers}.db"),
+            "METRICS_PORT": "0",
+            "RECONCILE_INTERVAL": "0",
+            "LOG_LEVEL": "ERROR",
+            # Замеряем код бота, а не лимиты Telegram
+            "GOVERNOR_GLOBAL_RATE": "1000000",
+            "LANE_CONCURRENCY": "1000",
+            "FSM_STORAGE": "redis" if redis_url else "sqlite",
+            "REDIS_URL": redis_url or "",
+        })
+        self.env = env
+        self.proc = None
+
+    async def start(self):
+        self.proc = await asyncio.create_subprocess_exec(sys.executable, os.path.join(ROOT, "main.py"),
+                                                         env=self.env, cwd=ROOT,
+                                                         stdout=asyncio.subprocess.DEVNULL)
+
+    async def stop(self):
+        if self.proc and self.proc.returncode is None:
+            # Вход останавливает обработчики сам (SIGTERM -> аккуратное завершение)
+            self.proc.send_signal(signal.SIGTERM)
+            try:
+                await asyncio.wait_for(self.proc.wait(), timeout=30)
+            except asyncio.TimeoutError:
+                self.proc.kill()
+
+
+def cpu_seconds(pid):
+    """Процессорное время процесса (user + system) по /proc; None — недоступно"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+def child_pids(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def cluster_cpu(cluster):
+    """(секунды входа, секунды всех обработчиков); при WORKERS=1 весь бот — «обработчик»"""
+    main = cpu_seconds(cluster.proc.pid)
+    if main is None:
+        return None
+    if cluster.workers == 1:
+        return 0.0, main
+    return main, sum(cpu_seconds(child) or 0.0 for child in child_pids(cluster.proc.pid))
+
+
+async def post_update(session, url, update):
+    async with session.post(url, json=update) as response:
+        return response.status
+
+
+async def wait_ready(session, url, stub, workers, timeout=60):
+    """Каждый обработчик (user_id % workers) должен ответить хотя бы на одно обновление"""
+    deadline = time.monotonic() + timeout
+    pending = set(range(workers))
+    while pending:
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"Обработчики {sorted(pending)} не запустились за {timeout} с")
+        for index in list(pending):
+            user_id = 10 ** 9 + index
+            reply = stub.expect_reply(user_id)
+            try:
+                if await post_update(session, url, command_update(user_id, "/start")) == 200:
+                    await asyncio.wait_for(reply, timeout=5)
+                    pending.discard(index)
+                    continue
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                pass
+            reply.cancel()
+        if pending:
+            await asyncio.sleep(0.5)
+
+
+async def run_load(session, url, stub, args):
+    """Все пользователи проходят свой сценарий; возвращает (секунды, задержки в мс)"""
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies = []
+
+    async def one_user(user_id):
+        async with semaphore:
+            for update in user_script(user_id, args.updates_per_user):
+                reply = stub.expect_reply(user_id)
+                started = time.perf_counter()
+                status = await post_update(session, url, update)
+                if status != 200:
+                    reply.cancel()
+                    raise RuntimeError(f"Вебхук ответил {status}")
+                replied_at = await asyncio.wait_for(reply, timeout=60)
+                latencies.append((replied_at - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one_user(1000 + i) for i in range(args.users)))
+    return time.perf_counter() - started, latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", default="1,2,4", help="значения WORKERS через запятую")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--updates-per-user", type=int, default=2)
+    parser.add_argument("--concurrency", type=int, default=200, help="одновременно активных пользователей")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--worker-base-port", type=int, default=18100)
+    parser.add_argument("--redis-url", help="хранить сессии FSM в Redis (FSM_STORAGE=redis)")
+    args = parser.parse_args()
+
+    redis_url = args.redis_url
+    stub = StubBotAPI()
+    api_url = await stub.start()
+    db_dir = tempfile.mkdtemp(prefix="bench_workers_")
+    url = f"http://127.0.0.1:{args.port}{WEBHOOK_PATH}"
+    total = args.users * args.updates_per_user
+
+    print(f"Ядер: {os.cpu_count()}, пользователей: {args.users}, обновлений: {total}, "
+          f"одновременно: {args.concurrency}, FSM: {'redis' if redis_url else 'sqlite'}")
+    print(f"\n{'WORKERS':>8}{'обн./с':>10}{'ускорение':>11}{'p50, мс':>10}{'p99, мс':>10}"
+          f"{'CPU входа':>11}{'CPU обраб.':>12}  (мс на обновление)")
+
+    baseline = None
+    try:
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=0)) as session:
+            for workers in [int(w) for w in args.workers.split(",")]:
+                cluster = Cluster(workers, args.port, args.worker_base_port, api_url, db_dir, redis_url)
+                await cluster.start()
+                try:
+                    await wait_ready(session, url, stub, workers)
+                    cpu_before = cluster_cpu(cluster)
+                    elapsed, latencies = await run_load(session, url, stub, args)
+                    cpu_after = cluster_cpu(cluster)
+                finally:
+                    await cluster.stop()
+
+                rate = total / elapsed
+                baseline = baseline or rate
+                ordered = sorted(latencies)
+                p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+                cpu = ""
+                if cpu_before and cpu_after:
+                    router_ms, workers_ms = ((after - before) * 1000 / total
+                                             for before, after in zip(cpu_before, cpu_after))
+                    cpu = f"{router_ms:>11.3f}{workers_ms:>12.3f}"
+                print(f"{workers:>8}{rate:>10.0f}{rate / baseline:>10.2f}x"
+                      f"{statistics.median(ordered):>10.1f}{p99:>10.1f}{cpu}")
+    finally:
+        await stub.stop()
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
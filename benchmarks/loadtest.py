@@ -0,0 +1,352 @@
+"""
+Сквозной нагрузочный тест: настоящий Dispatcher с роутерами бота против
+заглушки Bot API на aiohttp.
+
+Запуск из корня проекта:
+    python benchmarks/loadtest.py --users 200 --posts-per-user 5
+    python benchmarks/loadtest.py --latency 80 --jitter 30 --rate-429 0.01 --governor
+
+Заглушка поднимается на локальном порту, бот ходит в нее через
+TelegramAPIServer (как в Local Bot API Server). Она записывает каждый вызов,
+добавляет задержку и с заданной вероятностью отвечает 429 или 500.
+Синтетические пользователи проходят сценарии целиком через dp.feed_update:
+    1. публикация: "Контент" → роль → канал → текст → "Опубликовать";
+    2. конструктор шаблона: 7 шагов → "Сохранить" → название.
+
+Отчет по каждой фазе: обновлений в секунду, p50/p99 обработки по шагам
+и число запросов к API на один опубликованный пост (по методам) —
+лишний запрос в сценарии публикации сразу виден в цифрах.
+
+По умолчанию регулятор лимитов (utils/governor.py) не подключается:
+он намеренно ограничивает личку ~1 сообщением в секунду, и замер показал бы
+лимиты Telegram, а не скорость кода. С --governor проверяется и он
+(ответы 429 без него просто превращаются в ошибки хендлеров).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TMP_DIR = tempfile.mkdtemp(prefix="loadtest_")
+os.environ.setdefault("BOT_TOKEN", "42:LOADTEST")
+os.environ["DATABASE_PATH"] = os.path.join(TMP_DIR, "loadtest.db")
+
+from aiohttp import web  # noqa: E402
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.client.default import DefaultBotProperties  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.enums import ParseMode  # noqa: E402
+from aiogram.types import Update, Message, CallbackQuery, Chat, User  # noqa: E402
+
+from handlers import common, content, templates, search  # noqa: E402
+from utils.db import db  # noqa: E402
+from utils.fsm_storage import storage  # noqa: E402
+from utils.governor import governor  # noqa: E402
+from utils.lanes import update_lanes  # noqa: E402
+from utils.multibot import bot_scope  # noqa: E402
+from utils.post_archive import post_archive  # noqa: E402
+
+BOT_ID = 42
+CHANNEL_BASE = -1001000000000
+
+
+# --- ЗАГЛУШКА BOT API ---
+
+class StubBotAPI:
+    """
+    Поддельный Bot API: /bot<token>/<method>.
+    Отвечает правдоподобными объектами, записывает вызовы и вносит задержку и ошибки.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_429=0.0, error_rate=0.0, retry_after=1, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.rnd = random.Random(seed)
+        self.calls = Counter()       # метод -> число вызовов
+        self.channel_posts = 0       # Сообщений, отправленных в каналы
+        self.injected = Counter()    # 429 / 500
+        self._message_ids = itertools.count(1000)
+        self._runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = self._runner.addresses[0][1]
+        return f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+
+    def snapshot(self):
+        return Counter(self.calls), self.channel_posts
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls[method] += 1
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(max(0.0, self.rnd.gauss(self.latency, self.jitter)))
+
+        roll = self.rnd.random()
+        if roll < self.rate_429:
+            self.injected["429"] += 1
+            return web.json_response({"ok": False, "error_code": 429,
+                                      "description": f"Too Many Requests: retry after {self.retry_after}",
+                                      "parameters": {"retry_after": self.retry_after}})
+        if roll < self.rate_429 + self.error_rate:
+            self.injected["500"] += 1
+            return web.json_response({"ok": False, "error_code": 500, "description": "Internal Server Error"})
+
+        return web.json_response({"ok": True, "result": self.result(method, params)})
+
+    def _message(self, params, chat_id=None):
+        chat_id = int(chat_id if chat_id is not None else params.get("chat_id", 0))
+        if chat_id < 0:
+            self.channel_posts += 1
+        return {
+            "message_id": int(params.get("message_id") or next(self._message_ids)),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "channel" if chat_id < 0 else "private", "title": "Load"},
+            "text": params.get("text") or None,
+        }
+
+    def result(self, method, params):
+        name = method.lower()
+        if name == "sendmediagroup":
+            return [self._message({"chat_id": params["chat_id"]}) for _ in json.loads(params["media"])]
+        if name.startswith(("send", "copy", "forward")):
+            return self._message(params)
+        if name in ("editmessagetext", "editmessagecaption"):
+            return self._message(params)
+        if name == "getchatmember":
+            return {"status": "creator", "is_anonymous": False,
+                    "user": {"id": int(params["user_id"]), "is_bot": False, "first_name": "u"}}
+        if name == "getchatadministrators":
+            return []
+        if name == "getme":
+            return {"id": BOT_ID, "is_bot": True, "first_name": "loadtest", "username": "loadtest_bot"}
+        return True
+
+
+# --- СИНТЕТИЧЕСКИЕ ОБНОВЛЕНИЯ ---
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def user_of(user_id):
+    return User(id=user_id, is_bot=False, first_name=f"user{user_id}", username=f"user{user_id}")
+
+
+def text_update(user_id, text):
+    return Update(update_id=next(_update_ids), message=Message(
+        message_id=next(_message_ids), date=int(time.time()),
+        chat=Chat(id=user_id, type="private"), from_user=user_of(user_id), text=text,
+    ))
+
+
+def callback_update(user_id, data):
+    bot_message = Message(
+        message_id=next(_message_ids), date=int(time.time()), chat=Chat(id=user_id, type="private"),
+        from_user=User(id=BOT_ID, is_bot=True, first_name="loadtest"), text="menu",
+    )
+    return Update(update_id=next(_update_ids), callback_query=CallbackQuery(
+        id=str(next(_update_ids)), from_user=user_of(user_id), chat_instance="loadtest",
+        data=data, message=bot_message,
+    ))
+
+
+def post_text(rnd):
+    words = " ".join(rnd.choice(["новости", "акция", "скидка", "обзор", "релиз", "кофе", "чай"])
+                     for _ in range(rnd.randint(10, 60)))
+    return f"<b>Пост {rnd.randint(1, 10 ** 6)}</b>\n{words}" if rnd.random() < 0.5 else words
+
+
+def publish_flow(user_id, channel_id, rnd):
+    """Шаги сценария публикации: (название шага, обновление)"""
+    return [
+        ("Контент", text_update(user_id, "Контент")),
+        ("role", callback_update(user_id, "role:owner")),
+        ("chan", callback_update(user_id, f"chan:{channel_id}")),
+        ("action_text", callback_update(user_id, "action_text")),
+        ("text", text_update(user_id, post_text(rnd))),
+        ("publish", callback_update(user_id, "publish")),
+    ]
+
+
+def template_flow(user_id, number, rnd):
+    steps = [("Шаблоны", text_update(user_id, "Шаблоны")), ("tpl_start", callback_update(user_id, "tpl_start"))]
+    for field in ("title", "subtitle", "body", "note", "conclusion", "hashtags", "links"):
+        if rnd.random() < 0.2:
+            steps.append(("tpl_skip", callback_update(user_id, "tpl_skip")))
+        else:
+            steps.append((f"tpl_{field}", text_update(user_id, f"{field} {{{{цена}}}} {post_text(rnd)[:80]}")))
+    steps.append(("tpl_save", callback_update(user_id, "tpl_save")))
+    steps.append(("tpl_name", text_update(user_id, f"Шаблон {number}")))
+    return steps
+
+
+# --- ПРОГОН ---
+
+class Phase:
+    """Результаты одной фазы: задержки по шагам и ошибки"""
+
+    def __init__(self, title):
+        self.title = title
+        self.timings = defaultdict(list)  # шаг -> [секунды]
+        self.errors = Counter()
+        self.updates = 0
+        self.elapsed = 0.0
+
+
+async def run_user(dp, bot, steps, phase):
+    for step, update in steps:
+        started = time.perf_counter()
+        try:
+            await dp.feed_update(bot, update)
+        except Exception as e:
+            phase.errors[f"{step}: {type(e).__name__}"] += 1
+        phase.timings[step].append(time.perf_counter() - started)
+        phase.updates += 1
+
+
+async def run_phase(dp, bot, title, flows):
+    phase = Phase(title)
+    started = time.perf_counter()
+    await asyncio.gather(*(run_user(dp, bot, steps, phase) for steps in flows))
+    phase.elapsed = time.perf_counter() - started
+    return phase
+
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def report(phase, calls, per_unit, unit):
+    all_timings = [t for values in phase.timings.values() for t in values]
+    print(f"\n=== {phase.title} ===")
+    print(f"Обновлений: {phase.updates} за {phase.elapsed:.2f} с — {phase.updates / phase.elapsed:.0f} обн/с")
+    print(f"Обработка обновления: p50 {percentile(all_timings, 0.5) * 1000:.2f} мс, "
+          f"p99 {percentile(all_timings, 0.99) * 1000:.2f} мс")
+
+    print(f"\n{'Шаг':<16}{'кол-во':>8}{'p50, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+    for step, values in phase.timings.items():
+        print(f"{step:<16}{len(values):>8}{statistics.median(values) * 1000:>10.2f}"
+              f"{percentile(values, 0.99) * 1000:>10.2f}{max(values) * 1000:>10.2f}")
+
+    total = sum(calls.values())
+    if per_unit:
+        print(f"\nЗапросов к API: {total}, на {unit}: {total / per_unit:.2f}")
+        for method, count in calls.most_common():
+            print(f"  {method:<24}{count / per_unit:>8.2f}")
+    if phase.errors:
+        print("\nОшибки хендлеров:")
+        for error, count in phase.errors.most_common():
+            print(f"  {error}: {count}")
+
+
+def seed_channels(users):
+    """Каждому пользователю — свой канал, где он владелец (права уже в БД, как после подключения бота)"""
+    conn = db.conn
+    conn.execute("BEGIN")
+    conn.executemany("INSERT INTO channels (channel_id, title) VALUES (?, ?)",
+                     [(str(CHANNEL_BASE - i), f"Канал {i}") for i in range(users)])
+    conn.executemany("INSERT INTO users (user_id, username) VALUES (?, ?)",
+                     [(100 + i, f"user{100 + i}") for i in range(users)])
+    conn.executemany("INSERT INTO permissions (user_id, channel_id, is_owner) VALUES (?, ?, 1)",
+                     [(100 + i, str(CHANNEL_BASE - i)) for i in range(users)])
+    conn.execute("COMMIT")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="одновременных пользователей")
+    parser.add_argument("--posts-per-user", type=int, default=5)
+    parser.add_argument("--templates-per-user", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0, help="задержка ответа API, мс")
+    parser.add_argument("--jitter", type=float, default=0, help="разброс задержки, мс")
+    parser.add_argument("--rate-429", type=float, default=0, help="доля ответов 429")
+    parser.add_argument("--error-rate", type=float, default=0, help="доля ответов 500")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, с")
+    parser.add_argument("--governor", action="store_true", help="подключить регулятор лимитов отправки")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    stub = StubBotAPI(args.latency / 1000, args.jitter / 1000, args.rate_429, args.error_rate,
+                      args.retry_after, args.seed)
+    base_url = await stub.start()
+
+    # Бот и диспетчер собираются так же, как в main.py, но API — заглушка
+    session = AiohttpSession(api=TelegramAPIServer.from_base(base_url))
+    bot = Bot(token=os.environ["BOT_TOKEN"], session=session,
+              default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    if args.governor:
+        bot.session.middleware(governor)
+
+    dp = Dispatcher(storage=storage)
+    await storage.start()
+    dp.update.outer_middleware(bot_scope)
+    dp.update.outer_middleware(update_lanes)
+    dp.include_router(common.router)
+    dp.include_router(search.router)
+    dp.include_router(content.router)
+    dp.include_router(templates.router)
+    await post_archive.start()
+
+    seed_channels(args.users)
+    await db.claim_legacy_rows(bot.id)
+    users = [(100 + i, CHANNEL_BASE - i) for i in range(args.users)]
+
+    try:
+        # 1. Публикация: у каждого пользователя posts_per_user постов подряд
+        before, posts_before = stub.snapshot()
+        flows = [[step for _ in range(args.posts_per_user) for step in publish_flow(uid, cid, rnd)]
+                 for uid, cid in users]
+        phase = await run_phase(dp, bot, "Публикация поста", flows)
+        calls, posts = stub.snapshot()
+        report(phase, calls - before, posts - posts_before, "опубликованный пост")
+
+        # 2. Конструктор шаблонов
+        if args.templates_per_user:
+            before, _ = stub.snapshot()
+            flows = [[step for n in range(args.templates_per_user) for step in template_flow(uid, n, rnd)]
+                     for uid, _ in users]
+            phase = await run_phase(dp, bot, "Конструктор шаблона", flows)
+            calls, _ = stub.snapshot()
+            report(phase, calls - before, args.users * args.templates_per_user, "шаблон")
+
+        if stub.injected:
+            print(f"\nВнесено ошибок заглушкой: {dict(stub.injected)}")
+    finally:
+        await post_archive.stop()
+        await storage.close()
+        await bot.session.close()
+        await stub.stop()
+        db.close()
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -7,6 +7,12 @@ load_dotenv()
 # Токен бота (обязательно)
 TOKEN = os.getenv("BOT_TOKEN")
 
+# Несколько ботов в одном процессе: токены через запятую (вместо BOT_TOKEN).
+# Обработчики и база общие, каналы, права и сессии у каждого бота свои
+TOKENS = [t.strip() for t in os.getenv("BOT_TOKENS", "").split(",") if t.strip()] or ([TOKEN] if TOKEN else [])
+TOKENS = list(dict.fromkeys(TOKENS))  # Повторы токена убираем
+TOKEN = TOKENS[0] if TOKENS else None
+
 # ID главного администратора/разработчика (для доступа к спец. функциям или логам)
 ADMIN_ID = int(os.getenv("ADMIN_ID", 0))
 
@@ -18,9 +24,131 @@ TG_EMOJI = os.getenv("TG_EMOJI", "📱")
 # По умолчанию создается в папке data
 DB_PATH = os.getenv("DATABASE_PATH", "data/bot_data.db")
 
+# Сколько каналов показывать на одной странице списка
+CHANNELS_PAGE_SIZE = int(os.getenv("CHANNELS_PAGE_SIZE", 8))
+
+# Библиотека шаблонов: сколько шаблонов у одного пользователя
+# и сколько скомпилированных шаблонов держать в памяти (LRU)
+TEMPLATES_PER_USER = int(os.getenv("TEMPLATES_PER_USER", 30))
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", 256))
+
+# Медиатека: сколько файлов хранить у одного пользователя (лишние — давно не использованные)
+# и сколько показывать при выборе
+MEDIA_LIBRARY_PER_USER = int(os.getenv("MEDIA_LIBRARY_PER_USER", 200))
+MEDIA_LIBRARY_PAGE_SIZE = int(os.getenv("MEDIA_LIBRARY_PAGE_SIZE", 20))
+
+# Архив публикаций: как часто (секунды) и какими пачками записывать посты на диск
+ARCHIVE_FLUSH_INTERVAL = float(os.getenv("ARCHIVE_FLUSH_INTERVAL", 2))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", 100))
+
+# Очередь уведомлений (outbox): сколько отправок параллельно, сколько попыток,
+# начальная пауза перед повтором (удваивается) и окно склейки повторных событий канала (секунды)
+OUTBOX_CONCURRENCY = int(os.getenv("OUTBOX_CONCURRENCY", 5))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 5))
+OUTBOX_RETRY_DELAY = float(os.getenv("OUTBOX_RETRY_DELAY", 5))
+OUTBOX_DEDUPE_WINDOW = float(os.getenv("OUTBOX_DEDUPE_WINDOW", 3))
+
+# Сколько результатов /find показывать на одной странице
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", 5))
+
+# Публикация файлов с сервера (путь или URL вместо file_id в media_list)
+# Относительные пути считаются от UPLOAD_DIR, файлы вне этой папки не отправляются;
+# файлы читаются и скачиваются кусками по UPLOAD_CHUNK_SIZE байт, загрузка по URL — не дольше UPLOAD_URL_TIMEOUT секунд
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "data/uploads")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 262144))
+UPLOAD_URL_TIMEOUT = float(os.getenv("UPLOAD_URL_TIMEOUT", 120))
+
+# Сколько секунд ждать остальные файлы альбома после последнего пришедшего
+ALBUM_DEBOUNCE = float(os.getenv("ALBUM_DEBOUNCE", 0.6))
+
+# Хранение сессий FSM (диалогов) в SQLite
+# Через сколько секунд бездействия сессия удаляется (по умолчанию сутки)
+FSM_TTL = int(os.getenv("FSM_TTL", 86400))
+# Как часто накопленные изменения сессий сбрасываются на диск (секунды)
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", 2))
+
+# Количество соединений на чтение (пул потоков SQLite)
+# Запись всегда идет через одно соединение, чтение — параллельно (режим WAL)
+DB_READ_POOL_SIZE = int(os.getenv("DB_READ_POOL_SIZE", 4))
+
+# Сколько каналов публикуются одновременно в режиме рассылки
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 5))
+
+# Планировщик: как часто (секунды) подхватывать посты, добавленные в БД другими процессами
+# (импорт из командной строки, обработчики кластера)
+SCHEDULER_POLL_INTERVAL = float(os.getenv("SCHEDULER_POLL_INTERVAL", 10))
+# Через сколько секунд захваченный, но не опубликованный пост (процесс упал посреди публикации)
+# возвращается в очередь. Должно быть больше самой долгой публикации — иначе пост уйдет дважды
+SCHEDULER_CLAIM_TIMEOUT = float(os.getenv("SCHEDULER_CLAIM_TIMEOUT", 900))
+
+# Массовый импорт постов (JSONL/CSV): строк в одной вставке и сколько ошибок показывать в отчете
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", 500))
+IMPORT_ERROR_SAMPLE = int(os.getenv("IMPORT_ERROR_SAMPLE", 20))
+
+# Смещение часового пояса пользователей относительно UTC (в часах)
+# Используется при вводе времени отложенной публикации (например, 3 для Москвы)
+TIMEZONE_OFFSET = float(os.getenv("TIMEZONE_OFFSET", 0))
+
+# Кэш живой проверки прав (get_chat_member) при выборе канала, в секундах
+# Отрицательный ответ (прав нет) хранится отдельно и обычно меньше
+PERMISSION_CACHE_TTL = int(os.getenv("PERMISSION_CACHE_TTL", 300))
+PERMISSION_CACHE_NEGATIVE_TTL = int(os.getenv("PERMISSION_CACHE_NEGATIVE_TTL", 60))
+
+# Фоновая сверка прав во всех каналах
+# За сколько секунд обходятся все каналы (0 — отключить) и сколько проверок идет параллельно
+RECONCILE_INTERVAL = int(os.getenv("RECONCILE_INTERVAL", 21600))
+RECONCILE_CONCURRENCY = int(os.getenv("RECONCILE_CONCURRENCY", 3))
+
+# Лимиты исходящих запросов к Telegram (регулятор отправки)
+# Глобально на бота (запросов в секунду) и на один канал/группу (сообщений в минуту)
+GOVERNOR_GLOBAL_RATE = float(os.getenv("GOVERNOR_GLOBAL_RATE", 30))
+GOVERNOR_CHANNEL_RATE = float(os.getenv("GOVERNOR_CHANNEL_RATE", 20))
+# Сколько раз повторять запрос после ответа 429 (Flood control)
+GOVERNOR_MAX_RETRIES = int(os.getenv("GOVERNOR_MAX_RETRIES", 3))
+
+# Очереди обновлений по пользователям
+# Сколько обновлений одного пользователя может ждать обработки и сколько хендлеров работает одновременно
+LANE_MAX_QUEUE = int(os.getenv("LANE_MAX_QUEUE", 20))
+LANE_CONCURRENCY = int(os.getenv("LANE_CONCURRENCY", 100))
+
+# Режим получения обновлений: polling (по умолчанию) или webhook
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+
+# Настройки вебхука (используются только при BOT_MODE=webhook)
+# Публичный адрес, на который Telegram будет слать обновления (https://example.com)
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+# Секрет, который Telegram передает в заголовке X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+
+# Свой сервер Bot API (telegram-bot-api --local или заглушка нагрузочного теста), пусто — api.telegram.org
+BOT_API_URL = os.getenv("BOT_API_URL", "")
+
+# Горизонтальное масштабирование (только BOT_MODE=webhook)
+# Сколько процессов-обработчиков запускать за общим входом (1 — обычный режим, один процесс).
+# Вход принимает вебхуки на WEBHOOK_PORT и раздает обновления по id пользователя
+# обработчикам на 127.0.0.1:WORKER_BASE_PORT, WORKER_BASE_PORT+1, ...
+WORKERS = int(os.getenv("WORKERS", 1))
+WORKER_BASE_PORT = int(os.getenv("WORKER_BASE_PORT", 8100))
+# Номер процесса-обработчика (задает вход кластера, вручную не указывать; -1 — обычный процесс)
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", -1))
+
+# Хранилище сессий FSM: sqlite (по умолчанию) или redis (общее для всех процессов, нужен пакет redis).
+# С redis очереди пользователей (utils/lanes.py) тоже блокируются через Redis — между процессами
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+# Сколько секунд живет блокировка пользователя в Redis, если процесс упал, не сняв ее
+USER_LOCK_TTL = float(os.getenv("USER_LOCK_TTL", 30))
+
+# Метрики Prometheus: адрес HTTP-эндпоинта /metrics (порт 0 — не поднимать сервер)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9100))
+
 # Уровень логирования (DEBUG, INFO, WARNING, ERROR)
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 
 # Проверка на наличие токена при запуске
 if not TOKEN:
-    exit("Ошибка: Переменная BOT_TOKEN не найдена в файле .env")
\ No newline at end of file
+    exit("Ошибка: Переменная BOT_TOKEN (или BOT_TOKENS) не найдена в файле .env")
\ No newline at end of file
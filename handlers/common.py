@@ -2,9 +2,19 @@ from aiogram import Router, types, Bot, F
 from aiogram.filters import Command, ChatMemberUpdatedFilter, IS_NOT_MEMBER, ADMINISTRATOR, MEMBER
 from keyboards.reply import main_menu
 from utils.db import db
+from utils.multibot import governor_for
+from utils.reconciler import reconciler
+from utils.fsm_storage import storage
+from utils.permission_cache import permission_cache
+from utils.lanes import update_lanes
+from utils.template_engine import render_stats
+from utils.post_archive import post_archive
+from utils.outbox import outbox
+from utils.uploads import upload_cache
+from utils.admins import fetch_channel_admins
 from config import ADMIN_ID
-import asyncio
 import html
+import logging
 
 router = Router()
 
@@ -32,100 +42,80 @@ async def cmd_start(message: types.Message):
     )
 
 
+def channel_notification_key(bot: Bot, chat_id, user_id):
+    """Ключ дедупликации: одно ожидающее уведомление о канале на получателя (у каждого бота свое)"""
+    return f"channel:{bot.id}:{chat_id}:{user_id}"
+
+
 @router.my_chat_member(ChatMemberUpdatedFilter(member_status_changed=(IS_NOT_MEMBER | MEMBER) >> ADMINISTRATOR))
 async def bot_added_as_admin(event: types.ChatMemberUpdated, bot: Bot):
-    await asyncio.sleep(1)
     """Срабатывает при добавлении бота в админы"""
     chat_id = event.chat.id
+    permission_cache.invalidate_channel(chat_id)
     chat_title = html.escape(event.chat.title)
     chat_url = get_channel_link(chat_id, event.chat.username)
 
     actor = event.from_user  # Тот, кто добавил бота
 
     try:
-        admins = await bot.get_chat_administrators(chat_id)
-        admins_to_sync = []
-        owner_id = None
-
-        for admin in admins:
-            is_creator = admin.status == "creator"
-            if is_creator: owner_id = admin.user.id
-
-            can_post = is_creator or getattr(admin, 'can_post_messages', False)
-            if can_post:
-                admins_to_sync.append({
-                    'id': admin.user.id,
-                    'username': admin.user.username or admin.user.first_name or "User",
-                    'is_owner': is_creator
-                })
+        admins_to_sync = await fetch_channel_admins(bot, chat_id)
+        owner_id = next((a['id'] for a in admins_to_sync if a['is_owner']), None)
 
         # Синхронизируем базу
-        db.sync_channel_admins(chat_id, chat_title, admins_to_sync)
-
-        # ФОРМИРУЕМ УВЕДОМЛЕНИЯ
-        msg_for_owner = f"➕ <b>Бот подключен к вашему каналу!</b>\nКанал: <a href='{chat_url}'>{chat_title}</a>"
-        if actor.id != owner_id:
-            msg_for_owner += f"\nДобавил: @{actor.username or actor.id}"
-
-        # Отправляем владельцу канала
-        if owner_id:
-            try:
-                await bot.send_message(owner_id, msg_for_owner, disable_web_page_preview=True)
-            except:
-                pass
-
-        # Отправляем тому, кто добавил (если это не владелец)
-        if actor.id != owner_id:
-            try:
-                await bot.send_message(
-                    actor.id,
-                    f"✅ Вы успешно подключили боту канал <a href='{chat_url}'>{chat_title}</a>.",
-                    disable_web_page_preview=True
-                )
-            except:
-                pass
-
+        await db.sync_channel_admins(chat_id, chat_title, admins_to_sync)
     except Exception as e:
-        print(f"Error in bot_added: {e}")
+        # Права канала подтянет фоновая сверка (канал в ее очереди первым)
+        reconciler.touch(chat_id)
+        logging.exception(f"Ошибка при подключении канала {chat_id}: {e}")
+        return
+
+    # ФОРМИРУЕМ УВЕДОМЛЕНИЯ
+    # Отправляет их очередь (utils/outbox.py): хендлер не ждет Telegram
+    msg_for_owner = f"➕ <b>Бот подключен к вашему каналу!</b>\nКанал: <a href='{chat_url}'>{chat_title}</a>"
+    if actor.id != owner_id:
+        msg_for_owner += f"\nДобавил: @{actor.username or actor.id}"
+
+    notifications = []
+    # Владельцу канала
+    if owner_id:
+        notifications.append((channel_notification_key(bot, chat_id, owner_id), owner_id, msg_for_owner))
+    # Тому, кто добавил (если это не владелец)
+    if actor.id != owner_id:
+        notifications.append((channel_notification_key(bot, chat_id, actor.id), actor.id,
+                              f"✅ Вы успешно подключили боту канал <a href='{chat_url}'>{chat_title}</a>."))
+    await outbox.notify(notifications)
 
 
 @router.my_chat_member(ChatMemberUpdatedFilter(member_status_changed=ADMINISTRATOR >> (IS_NOT_MEMBER | MEMBER)))
 async def bot_removed_from_admin(event: types.ChatMemberUpdated, bot: Bot):
     """Срабатывает при удалении бота"""
     chat_id = event.chat.id
+    permission_cache.invalidate_channel(chat_id)
     chat_title = html.escape(event.chat.title)
     chat_url = get_channel_link(chat_id, event.chat.username)
 
     actor = event.from_user  # Тот, кто удалил
 
     # 1. Сначала узнаем из БД, кто был владельцем, пока данные не стерты
-    owner_id = db.get_channel_owner_id(chat_id)
+    owner_id = await db.get_channel_owner_id(chat_id)
 
     # 2. Удаляем канал из БД
-    db.delete_channel(chat_id)
+    await db.delete_channel(chat_id)
 
-    # 3. Отправляем уведомления
+    # 3. Ставим уведомления в очередь
     msg_for_owner = f"❌ <b>Бот удален из вашего канала!</b>\nКанал: <a href='{chat_url}'>{chat_title}</a>"
     if owner_id and actor.id != owner_id:
         msg_for_owner += f"\nДействие совершил: @{actor.username or actor.id}"
 
+    notifications = []
     # Сообщение владельцу канала
     if owner_id:
-        try:
-            await bot.send_message(owner_id, msg_for_owner, disable_web_page_preview=True)
-        except:
-            pass
-
+        notifications.append((channel_notification_key(bot, chat_id, owner_id), owner_id, msg_for_owner))
     # Сообщение тому, кто удалил (если это не владелец)
     if actor.id != owner_id:
-        try:
-            await bot.send_message(
-                actor.id,
-                f"❌ Вы удалили бота из канала <a href='{chat_url}'>{chat_title}</a>.",
-                disable_web_page_preview=True
-            )
-        except:
-            pass
+        notifications.append((channel_notification_key(bot, chat_id, actor.id), actor.id,
+                              f"❌ Вы удалили бота из канала <a href='{chat_url}'>{chat_title}</a>."))
+    await outbox.notify(notifications)
 
 
 @router.message(Command("info"))
@@ -139,7 +129,8 @@ async def cmd_info(message: types.Message):
         "• Выберите канал из списка (бот проверит ваши права в реальном времени).\n"
         "• Отправьте текст поста (можно использовать HTML-теги).\n"
         "• Добавьте медиафайлы (Фото, Видео, Аудио) — по 1му до 10 штук.\n"
-        "• Нажмите <b>'Опубликовать'</b>.\n\n"
+        "• Нажмите <b>'Опубликовать'</b> или <b>'Опубликовать позже'</b> и укажите время.\n"
+        "• Для одного поста сразу в несколько каналов выберите <b>'Рассылка'</b>.\n\n"
 
         "2️⃣ <b>Конструктор шаблонов:</b>\n"
         "Этот раздел поможет создать идеально оформленный текст. "
@@ -152,9 +143,64 @@ async def cmd_info(message: types.Message):
         "6. Хештеги\n"
         "7. Ссылки\n\n"
 
-        "💡 <b>Совет:</b> После завершения шаблона вы получите готовый код. "
-        "Просто нажмите на него, чтобы скопировать, и вставьте в разделе 'Контент'.\n\n"
+        "💡 <b>Совет:</b> Сохраните готовый шаблон в библиотеку — он появится в разделе 'Контент' "
+        "под кнопкой <b>'📋 Шаблон'</b>. Поля вида <code>{{цена}}</code> бот попросит заполнить при публикации.\n\n"
+
+        "3️⃣ <b>Поиск:</b>\n"
+        "<code>/find запрос</code> — поиск по вашим шаблонам и по опубликованным постам в ваших каналах.\n\n"
 
         "⚠️ <b>Премиум-эмодзи:</b> Будут отображаться в канале только при наличии <b>Boost 2-го уровня</b>."
     )
-    await message.answer(info_text, parse_mode="HTML")
\ No newline at end of file
+    await message.answer(info_text, parse_mode="HTML")
+
+
+@router.message(Command("stats"), F.from_user.id == ADMIN_ID)
+async def cmd_stats(message: types.Message, bot: Bot):
+    """Служебная статистика для главного администратора"""
+    g = governor_for(bot).stats()
+    f = storage.stats()
+    p = permission_cache.stats()
+    r = reconciler.stats()
+    q = update_lanes.stats()
+    t = render_stats()
+    a = post_archive.stats()
+    o = outbox.stats()
+    u = upload_cache.stats()
+    o_pending = await db.count_pending_notifications()
+    if f['backend'] == "sqlite":
+        fsm_line = f"• В памяти: {f['sessions']} (~{f['approx_bytes'] / 1024:.1f} КБ), ждут записи: {f['dirty']}"
+    else:
+        fsm_line = "• Хранятся в Redis (общие для всех процессов)"
+    await message.answer(
+        "📊 <b>Статистика бота</b>\n\n"
+        "<b>Очередь отправки:</b>\n"
+        f"• В очереди: {g['queued']} (польз.: {g['queued_high']}, каналы: {g['queued_normal']}, "
+        f"рассылки: {g['queued_bulk']})\n"
+        f"• В полете: {g['in_flight']}\n"
+        f"• Отправлено: {g['sent']}, ждали лимита: {g['delayed']}\n"
+        f"• Повторы после 429: {g['retries']}, не доставлено: {g['failed_429']}\n"
+        f"• Отслеживается чатов: {g['chats_tracked']}\n\n"
+        "<b>Очереди пользователей:</b>\n"
+        f"• Активных: {q['lanes']}, ждут: {q['queued']} (макс. в одной: {q['deepest']}), в работе: {q['in_flight']}\n"
+        f"• Обработано: {q['processed']}, отброшено: {q['dropped']}, пиковая глубина: {q['max_depth']}\n"
+        f"• Ожидание: в среднем {q['wait_avg'] * 1000:.0f} мс, максимум {q['wait_max'] * 1000:.0f} мс\n\n"
+        "<b>Сессии FSM:</b>\n"
+        f"{fsm_line}\n\n"
+        "<b>Кэш прав:</b>\n"
+        f"• Записей: {p['entries']}, попаданий: {p['hits']}, промахов: {p['misses']} "
+        f"({p['hit_rate']:.0%} запросов к API сэкономлено)\n\n"
+        "<b>Архив публикаций:</b>\n"
+        f"• Ждут записи: {a['pending']}, записано: {a['flushed']} (пачек: {a['batches']})\n\n"
+        "<b>Очередь уведомлений:</b>\n"
+        f"• Ждут отправки: {o_pending}, отправляются: {o['in_flight']}\n"
+        f"• Отправлено: {o['sent']}, повторов: {o['retries']}, не доставлено: {o['failed']}\n\n"
+        "<b>Файлы с сервера:</b>\n"
+        f"• Загружено: {u['uploaded']} ({u['uploaded_bytes'] / 1048576:.1f} МБ), по file_id из кэша: {u['cached']}\n\n"
+        "<b>Шаблоны:</b>\n"
+        f"• Рендеров: {t['renders']}, в среднем {t['avg_us']:.1f} мкс\n"
+        f"• Скомпилировано: {t['compiled']}, кэш: {t['cache_hits']} попаданий / {t['cache_misses']} промахов\n\n"
+        "<b>Фоновая сверка прав:</b>\n"
+        f"• Проверено каналов: {r['checked']}, с изменениями: {r['changed']}, удалено: {r['pruned']}, "
+        f"ошибок: {r['failed']}",
+        parse_mode="HTML"
+    )
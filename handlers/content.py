@@ -1,13 +1,24 @@
 from aiogram import Router, F, types, Bot
 from aiogram.fsm.context import FSMContext
-from aiogram.utils.media_group import MediaGroupBuilder
 from aiogram.filters import StateFilter
 from states.post_states import PostCreator
 from keyboards import inline, reply
 from utils.db import db
-from config import TG_EMOJI
+from utils.permission_cache import permission_cache
+from utils.admins import fetch_channel_admins, is_chat_gone_error
+from utils.reconciler import reconciler
+from utils.albums import album_collector
+from utils.lanes import update_lanes
+from utils.template_engine import render_template, template_fields
+from utils.scheduler import scheduler, parse_publish_time, format_publish_time
+from utils.publisher import (publish_post, broadcast_post, edit_post, delete_post, get_post_link,
+                             STATUS_OK, STATUS_FALLBACK, STATUS_FAILED)
+from utils.post_archive import post_archive
+from config import BROADCAST_CONCURRENCY
+import asyncio
 import html
 import logging
+import time
 
 router = Router()
 
@@ -35,22 +46,61 @@ async def back_to_roles_handler(callback: types.CallbackQuery, state: FSMContext
 
 # --- 2. ВЫБОР КАНАЛА ---
 
+# Заголовки списка каналов по ролям
+ROLE_TITLES = {
+    "owner": "👑 <b>Ваши собственные каналы!</b>",
+    "admin": "👨‍💻 <b>Каналы, где вы Администратор:</b>",
+}
+
+
+async def show_channels_page(target: types.Message, state: FSMContext, user_id, edit=True):
+    """
+    Вывод текущей страницы каналов по данным FSM:
+    channel_role, channel_filter (поиск по началу названия) и channel_pages —
+    стек курсоров (title, channel_id), с которых начинаются открытые страницы.
+    Возвращает количество каналов на странице.
+    """
+    data = await state.get_data()
+    role = data.get("channel_role", "admin")
+    prefix = data.get("channel_filter")
+    pages = data.get("channel_pages") or [None]
+
+    rows, has_next = await db.get_user_channels_page(user_id, role=role, after=pages[-1], prefix=prefix)
+    # Курсор для кнопки "Дальше" — последний канал на странице
+    await state.update_data(channel_next=list(rows[-1]) if rows else None)
+
+    text = f"{ROLE_TITLES.get(role, ROLE_TITLES['admin'])}\n"
+    if prefix:
+        text += f"🔎 Поиск: <b>{html.escape(prefix)}</b>\n"
+        if not rows:
+            text += "Ничего не найдено.\n"
+    text += "Выберите канал для работы:"
+    if has_next or len(pages) > 1 or prefix:
+        text += "\n<i>Чтобы найти канал, отправьте начало его названия.</i>"
+
+    markup = inline.channels_keyboard(rows, has_prev=len(pages) > 1, has_next=has_next, filtered=bool(prefix))
+    if edit:
+        await target.edit_text(text, reply_markup=markup, parse_mode="HTML")
+    else:
+        await target.answer(text, reply_markup=markup, parse_mode="HTML")
+    return len(rows)
+
+
 @router.callback_query(PostCreator.selecting_role, F.data.startswith("role:"))
 async def role_selected(callback: types.CallbackQuery, state: FSMContext):
     role = callback.data.split(":")[1]  # Получаем "owner" или "admin"
     user_id = callback.from_user.id
 
-    # СТРОГАЯ ФИЛЬТРАЦИЯ: теперь метод вернет только подходящие каналы
-    user_channels = db.get_user_channels(user_id, role=role)
-
     if role == "owner":
-        text_prefix = "👑 <b>Ваши собственные каналы!</b>"
         empty_msg = "У вас нет каналов, где вы являетесь Владельцем."
     else:
-        text_prefix = "👨‍💻 <b>Каналы, где вы Администратор:</b>"
         empty_msg = "Список каналов, где вы назначены админом, пуст."
 
-    if not user_channels:
+    # СТРОГАЯ ФИЛЬТРАЦИЯ: выводим только подходящие каналы, постранично
+    await state.update_data(channel_role=role, channel_filter=None, channel_pages=[None])
+    has_channels, _ = await db.get_user_channels_page(user_id, role=role, limit=1)
+
+    if not has_channels:
         await callback.message.edit_text(
             f"❌ <b>{empty_msg}</b>\n\n"
             "Если вы владелец — добавьте бота в канал.\n"
@@ -61,11 +111,60 @@ async def role_selected(callback: types.CallbackQuery, state: FSMContext):
         return
 
     await state.set_state(PostCreator.selecting_channel)
-    await callback.message.edit_text(
-        f"{text_prefix}\nВыберите канал для работы:",
-        reply_markup=inline.channels_keyboard(user_channels),
-        parse_mode="HTML"
+    await show_channels_page(callback.message, state, user_id)
+
+
+@router.callback_query(PostCreator.selecting_channel, F.data.startswith("chpage:"))
+async def channels_page(callback: types.CallbackQuery, state: FSMContext):
+    action = callback.data.split(":")[1]  # next / prev / reset
+    data = await state.get_data()
+    pages = data.get("channel_pages") or [None]
+
+    if action == "next" and data.get("channel_next"):
+        pages.append(data["channel_next"])
+    elif action == "prev" and len(pages) > 1:
+        pages.pop()
+    elif action == "reset":
+        pages = [None]
+        await state.update_data(channel_filter=None)
+
+    await state.update_data(channel_pages=pages)
+    await show_channels_page(callback.message, state, callback.from_user.id)
+
+
+@router.message(PostCreator.selecting_channel, F.text)
+async def channels_search(message: types.Message, state: FSMContext):
+    """Поиск канала по началу названия (пишется прямо в чат на шаге выбора канала)"""
+    await state.update_data(channel_filter=message.text.strip()[:64], channel_pages=[None])
+    await show_channels_page(message, state, message.from_user.id, edit=False)
+
+
+async def check_post_rights(bot: Bot, channel_id, user_id):
+    """
+    Проверка прав пользователя на публикацию в канале в реальном времени.
+    Возвращает "allowed", "revoked" (права отозваны) или "gone" (канал удален / бота выгнали).
+    Прочие ошибки API пробрасываются наружу.
+    Ответы "allowed"/"revoked" кэшируются (см. utils/permission_cache.py).
+    """
+    cached = permission_cache.get(user_id, channel_id)
+    if cached is not None:
+        return cached
+
+    try:
+        member = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
+    except Exception as e:
+        # ЕСЛИ КАНАЛ УДАЛЕН ИЛИ БОТА ВЫГНАЛИ (Chat not found / Forbidden)
+        if is_chat_gone_error(e):
+            return "gone"
+        raise
+
+    # Проверяем, разрешено ли пользователю публиковать
+    is_allowed = (member.status == "creator") or (
+            member.status == "administrator" and member.can_post_messages
     )
+    verdict = "allowed" if is_allowed else "revoked"
+    permission_cache.set(user_id, channel_id, verdict)
+    return verdict
 
 
 @router.callback_query(PostCreator.selecting_channel, F.data.startswith("chan:"))
@@ -75,50 +174,39 @@ async def channel_selected(callback: types.CallbackQuery, state: FSMContext, bot
 
     # 1. Проверка прав и существования канала в реальном времени
     try:
-        member = await bot.get_chat_member(chat_id=channel_id, user_id=user_id)
-
-        # Проверяем, разрешено ли пользователю публиковать
-        is_allowed = (member.status == "creator") or (
-                member.status == "administrator" and member.can_post_messages
-        )
-
-        if not is_allowed:
-            # Если пользователь больше не админ — удаляем только ЕГО право в БД
-            db.remove_user_permission(user_id, channel_id)
-            await callback.answer("❌ Ваши права в этом канале были отозваны.", show_alert=True)
-            # Возвращаем пользователя к выбору роли, чтобы список обновился
-            await back_to_roles_handler(callback, state)
-            return
-
+        rights = await check_post_rights(bot, channel_id, user_id)
     except Exception as e:
-        err_msg = str(e).lower()
-        # ЕСЛИ КАНАЛ УДАЛЕН ИЛИ БОТА ВЫГНАЛИ (Chat not found / Forbidden)
-        if "chat not found" in err_msg or "forbidden" in err_msg or "chat_id_invalid" in err_msg:
-            db.delete_channel(channel_id)  # УДАЛЯЕМ КАНАЛ ИЗ БАЗЫ
-            await callback.answer("❌ Канал больше не существует или бот был удален.\nСписок каналов обновлен.",
-                                  show_alert=True)
-            # Возвращаем пользователя в самое начало (выбор роли)
-            await back_to_roles_handler(callback, state)
-            return
-
         # Если произошла какая-то другая техническая ошибка
         await callback.answer(f"⚠️ Ошибка доступа: {e}", show_alert=True)
         return
 
+    if rights == "revoked":
+        # Если пользователь больше не админ — удаляем только ЕГО право в БД
+        await db.remove_user_permission(user_id, channel_id)
+        await callback.answer("❌ Ваши права в этом канале были отозваны.", show_alert=True)
+        # Возвращаем пользователя к выбору роли, чтобы список обновился
+        await back_to_roles_handler(callback, state)
+        return
+
+    if rights == "gone":
+        await db.delete_channel(channel_id)  # УДАЛЯЕМ КАНАЛ ИЗ БАЗЫ
+        await callback.answer("❌ Канал больше не существует или бот был удален.\nСписок каналов обновлен.",
+                              show_alert=True)
+        # Возвращаем пользователя в самое начало (выбор роли)
+        await back_to_roles_handler(callback, state)
+        return
+
     # 2. Формируем ссылку на канал (Публичный или Приватный)
-    if str(channel_id).startswith("@"):
-        channel_link = f"https://t.me/{channel_id[1:]}"
-    else:
-        clean_id = str(channel_id).replace("-100", "")
-        channel_link = f"https://t.me/c/{clean_id}/1"
+    channel_link = get_post_link(channel_id)
 
     # 3. Сохраняем данные в FSM
-    await state.update_data(selected_channel=channel_id, media_list=[], post_mode=None)
+    reconciler.touch(channel_id)  # Активные каналы фоновая сверка проверяет первыми
+    await state.update_data(selected_channel=channel_id, broadcast_channels=None, media_list=[], post_mode=None)
     await state.set_state(PostCreator.choosing_action)
 
-    # 4. Получаем данные из БД для интерфейса
-    is_owner = db.is_user_owner(user_id, channel_id)
-    title = html.escape(db.get_channel_title(channel_id))  # Экранируем название
+    # 4. Получаем данные из БД для интерфейса (одним запросом)
+    title, is_owner = await db.get_user_channel(user_id, channel_id)
+    title = html.escape(title)  # Экранируем название
 
     # 5. Выводим меню действий
     await callback.message.edit_text(
@@ -130,6 +218,152 @@ async def channel_selected(callback: types.CallbackQuery, state: FSMContext, bot
     )
 
 
+# --- 2.1 РАССЫЛКА (ОДИН ПОСТ В НЕСКОЛЬКО КАНАЛОВ) ---
+
+BROADCAST_TITLE = "📢 <b>Рассылка</b>\nОтметьте каналы, в которые нужно опубликовать пост:"
+
+
+async def show_broadcast_page(callback: types.CallbackQuery, state: FSMContext):
+    """
+    Загрузка и вывод страницы каналов рассылки (каналы с любой ролью) по данным FSM:
+    broadcast_pages — стек курсоров открытых страниц, как channel_pages в выборе канала.
+    Строки страницы запоминаются в broadcast_page — отметка канала перерисовывает их без запроса к БД.
+    Возвращает количество каналов на странице.
+    """
+    data = await state.get_data()
+    pages = data.get("broadcast_pages") or [None]
+    rows, has_next = await db.get_user_channels_page(callback.from_user.id, role=None, after=pages[-1])
+    rows = [list(row) for row in rows]
+    await state.update_data(broadcast_page=rows, broadcast_has_next=has_next)
+    if rows:
+        await callback.message.edit_text(
+            BROADCAST_TITLE,
+            reply_markup=inline.broadcast_channels_keyboard(rows, data.get("broadcast_selected", []),
+                                                            has_prev=len(pages) > 1, has_next=has_next),
+            parse_mode="HTML"
+        )
+    return len(rows)
+
+
+async def redraw_broadcast_page(callback: types.CallbackQuery, state: FSMContext, selected):
+    """Сохранение отметок и перерисовка текущей страницы (из FSM, без запроса к БД)"""
+    await state.update_data(broadcast_selected=selected)
+    data = await state.get_data()
+    await callback.message.edit_reply_markup(
+        reply_markup=inline.broadcast_channels_keyboard(
+            data.get("broadcast_page", []), selected,
+            has_prev=len(data.get("broadcast_pages") or [None]) > 1, has_next=data.get("broadcast_has_next", False)
+        )
+    )
+
+
+@router.callback_query(PostCreator.selecting_role, F.data == "broadcast")
+async def broadcast_start(callback: types.CallbackQuery, state: FSMContext):
+    await state.update_data(broadcast_selected=[], broadcast_pages=[None])
+    await state.set_state(PostCreator.selecting_broadcast)
+
+    if not await show_broadcast_page(callback, state):
+        await state.set_state(PostCreator.selecting_role)
+        await callback.message.edit_text(
+            "❌ <b>У вас нет подключенных каналов.</b>",
+            reply_markup=inline.back_to_roles_keyboard(),
+            parse_mode="HTML"
+        )
+
+
+@router.callback_query(PostCreator.selecting_broadcast, F.data.startswith("bcpage:"))
+async def broadcast_page(callback: types.CallbackQuery, state: FSMContext):
+    action = callback.data.split(":")[1]  # next / prev
+    data = await state.get_data()
+    pages = data.get("broadcast_pages") or [None]
+    rows = data.get("broadcast_page") or []
+
+    if action == "next" and data.get("broadcast_has_next") and rows:
+        # Курсор следующей страницы — последний канал текущей
+        pages.append(rows[-1])
+    elif action == "prev" and len(pages) > 1:
+        pages.pop()
+
+    await state.update_data(broadcast_pages=pages)
+    await show_broadcast_page(callback, state)
+
+
+@router.callback_query(PostCreator.selecting_broadcast, F.data.startswith("bc:"))
+async def broadcast_toggle(callback: types.CallbackQuery, state: FSMContext):
+    channel_id = callback.data.split(":", 1)[1]
+    data = await state.get_data()
+    selected = data.get("broadcast_selected", [])
+
+    if channel_id in selected:
+        selected.remove(channel_id)
+    else:
+        selected.append(channel_id)
+
+    await redraw_broadcast_page(callback, state, selected)
+
+
+@router.callback_query(PostCreator.selecting_broadcast, F.data.in_({"bc_all", "bc_none"}))
+async def broadcast_select_all(callback: types.CallbackQuery, state: FSMContext):
+    """Отметка всех каналов пользователя (на всех страницах) или сброс всех отметок"""
+    data = await state.get_data()
+    selected = await db.get_user_channel_ids(callback.from_user.id) if callback.data == "bc_all" else []
+
+    if set(selected) == set(data.get("broadcast_selected", [])):
+        # Клавиатура не изменится — Telegram не дает отредактировать сообщение тем же содержимым
+        await callback.answer()
+        return
+    await redraw_broadcast_page(callback, state, selected)
+
+
+@router.callback_query(PostCreator.selecting_broadcast, F.data == "bc_done")
+async def broadcast_done(callback: types.CallbackQuery, state: FSMContext, bot: Bot):
+    data = await state.get_data()
+    selected = data.get("broadcast_selected", [])
+    user_id = callback.from_user.id
+
+    if not selected:
+        await callback.answer("⚠️ Отметьте хотя бы один канал.", show_alert=True)
+        return
+
+    # Проверяем права во всех отмеченных каналах параллельно (с ограничением)
+    semaphore = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+
+    async def _check(cid):
+        async with semaphore:
+            try:
+                return await check_post_rights(bot, cid, user_id)
+            except Exception:
+                return "error"
+
+    verdicts = await asyncio.gather(*(_check(cid) for cid in selected))
+
+    allowed = []
+    for cid, rights in zip(selected, verdicts):
+        if rights == "allowed":
+            allowed.append(cid)
+        elif rights == "revoked":
+            await db.remove_user_permission(user_id, cid)
+        elif rights == "gone":
+            await db.delete_channel(cid)
+
+    if not allowed:
+        await callback.answer("❌ Ни в одном из отмеченных каналов у вас нет прав на публикацию.", show_alert=True)
+        await back_to_roles_handler(callback, state)
+        return
+
+    await state.update_data(selected_channel=None, broadcast_channels=allowed, media_list=[], post_mode=None)
+    await state.set_state(PostCreator.choosing_action)
+
+    skipped = len(selected) - len(allowed)
+    await callback.message.edit_text(
+        f"📢 Каналов в рассылке: <b>{len(allowed)}</b>"
+        f"{f' (пропущено без прав: {skipped})' if skipped else ''}\n"
+        f"Что сделаем?",
+        reply_markup=inline.action_keyboard(is_broadcast=True),
+        parse_mode="HTML"
+    )
+
+
 # --- 3. ОБНОВЛЕНИЕ АДМИНОВ (ТОЛЬКО ДЛЯ ВЛАДЕЛЬЦЕВ) ---
 
 @router.callback_query(F.data == "refresh_admins")
@@ -138,26 +372,25 @@ async def refresh_admins(callback: types.CallbackQuery, state: FSMContext, bot:
     cid = data.get("selected_channel")
     user_id = callback.from_user.id
 
-    if not db.is_user_owner(user_id, cid):
+    if not await db.is_user_owner(user_id, cid):
         await callback.answer("⛔️ Только владелец может обновлять список админов.", show_alert=True)
         return
 
     try:
-        admins = await bot.get_chat_administrators(cid)
+        admins_to_sync = await fetch_channel_admins(bot, cid)
         chat = await bot.get_chat(cid)
 
-        admins_to_sync = []
-        for a in admins:
-            is_creator = a.status == "creator"
-            if is_creator or getattr(a, 'can_post_messages', False):
-                admins_to_sync.append({
-                    'id': a.user.id,
-                    'username': a.user.username or a.user.first_name,
-                    'is_owner': is_creator
-                })
+        summary = await db.sync_channel_admins(cid, chat.title, admins_to_sync)
+        # Состав админов мог измениться — живые проверки прав нужно сделать заново
+        permission_cache.invalidate_channel(cid)
 
-        db.sync_channel_admins(cid, chat.title, admins_to_sync)
-        await callback.answer("✅ Список администраторов синхронизирован!", show_alert=True)
+        if summary['added'] or summary['removed'] or summary['role_changed']:
+            changes = (f"Добавлено: {len(summary['added'])}\n"
+                       f"Удалено: {len(summary['removed'])}\n"
+                       f"Сменили роль: {len(summary['role_changed'])}")
+        else:
+            changes = "Изменений нет."
+        await callback.answer(f"✅ Список администраторов синхронизирован!\n\n{changes}", show_alert=True)
 
     except Exception as e:
         await callback.answer(f"❌ Ошибка: {e}", show_alert=True)
@@ -172,16 +405,24 @@ async def ask_text(callback: types.CallbackQuery, state: FSMContext):
                                      parse_mode="HTML")
 
 
-@router.message(PostCreator.waiting_for_text)
-async def receive_text(message: types.Message, state: FSMContext):
+def detect_post_text(message: types.Message):
+    """Текст поста и режим: (post_text, is_html)"""
     # Логика определения HTML (оставляем как есть)
     if "<" in message.text and ">" in message.text:
-        post_text, is_html = message.text, True
+        return message.text, True
     elif message.html_text != message.text:
-        post_text, is_html = message.html_text, True
-    else:
-        post_text, is_html = message.text, False
+        return message.html_text, True
+    return message.text, False
 
+
+@router.message(PostCreator.waiting_for_text)
+async def receive_text(message: types.Message, state: FSMContext):
+    post_text, is_html = detect_post_text(message)
+    await save_draft_text(message, state, post_text, is_html)
+
+
+async def save_draft_text(message: types.Message, state: FSMContext, post_text, is_html):
+    """Текст черновика готов: сохраняем и показываем меню публикации"""
     # Отправляем сообщение с кнопками
     msg = await message.answer(
         f"{'✅ Шаблон/HTML принят.' if is_html else '📝 Текст принят.'}\n\n"
@@ -195,6 +436,89 @@ async def receive_text(message: types.Message, state: FSMContext):
     await state.set_state(PostCreator.confirmation)
 
 
+# --- 4.1 ТЕКСТ ИЗ БИБЛИОТЕКИ ШАБЛОНОВ ---
+
+async def show_templates(callback: types.CallbackQuery):
+    templates = await db.get_user_templates(callback.from_user.id)
+    if not templates:
+        return False
+    await callback.message.edit_text(
+        "📋 <b>Ваши шаблоны</b>\nВыберите шаблон для поста:",
+        reply_markup=inline.templates_keyboard(templates),
+        parse_mode="HTML"
+    )
+    return True
+
+
+@router.callback_query(PostCreator.choosing_action, F.data == "action_template")
+async def pick_template(callback: types.CallbackQuery, state: FSMContext):
+    if not await show_templates(callback):
+        await callback.answer("📭 Сохраненных шаблонов нет.\nСоберите шаблон в разделе «Шаблоны».", show_alert=True)
+
+
+@router.callback_query(PostCreator.choosing_action, F.data == "tpl_back")
+async def templates_back(callback: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await callback.message.edit_text(
+        "Что сделаем?",
+        reply_markup=inline.action_keyboard(is_broadcast=bool(data.get("broadcast_channels")))
+    )
+
+
+@router.callback_query(PostCreator.choosing_action, F.data.startswith("tpldel:"))
+async def template_delete(callback: types.CallbackQuery, state: FSMContext):
+    await db.delete_template(callback.from_user.id, int(callback.data.split(":")[1]))
+    await callback.answer("🗑 Шаблон удален.")
+    if not await show_templates(callback):
+        await templates_back(callback, state)
+
+
+@router.callback_query(PostCreator.choosing_action, F.data.startswith("tplpick:"))
+async def template_selected(callback: types.CallbackQuery, state: FSMContext):
+    row = await db.get_template(callback.from_user.id, int(callback.data.split(":")[1]))
+    if not row:
+        await callback.answer("⚠️ Шаблон не найден.", show_alert=True)
+        return
+
+    name, body = row
+    fields = template_fields(body)
+    await callback.message.delete()
+
+    if not fields:
+        await save_draft_text(callback.message, state, render_template(body, {}), True)
+        return
+
+    # Поля заполняются по одному, значения копятся в FSM
+    await state.update_data(tpl_name=name, tpl_body=body, tpl_values={})
+    await state.set_state(PostCreator.filling_template)
+    await ask_template_field(callback.message, name, fields, 0)
+
+
+async def ask_template_field(message: types.Message, name, fields, index):
+    await message.answer(
+        f"📋 <b>{html.escape(name)}</b> — поле {index + 1} из {len(fields)}\n"
+        f"Введите значение для <code>{html.escape(fields[index])}</code>:",
+        parse_mode="HTML"
+    )
+
+
+@router.message(PostCreator.filling_template, F.text)
+async def receive_template_field(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    body = data.get("tpl_body", "")
+    values = data.get("tpl_values", {})
+    fields = template_fields(body)
+
+    values[fields[len(values)]] = message.html_text
+    if len(values) < len(fields):
+        await state.update_data(tpl_values=values)
+        await ask_template_field(message, data.get("tpl_name", ""), fields, len(values))
+        return
+
+    await state.update_data(tpl_name=None, tpl_body=None, tpl_values=None)
+    await save_draft_text(message, state, render_template(body, values), True)
+
+
 @router.callback_query(F.data.in_(["add_media", "add_audio"]))
 async def add_files_mode(callback: types.CallbackQuery, state: FSMContext):
     mode = "media" if callback.data == "add_media" else "audio"
@@ -202,39 +526,195 @@ async def add_files_mode(callback: types.CallbackQuery, state: FSMContext):
     await state.set_state(PostCreator.waiting_for_media)
 
     text = "🖼 Присылайте <b>фото или видео</b> (по 1му до 10 шт):" if mode == "media" else "🎵 Присылайте <b>MP3-файлы</b> (по 1му до 10 шт):"
-    await callback.message.edit_text(text, parse_mode="HTML")
+    text += "\nили возьмите уже присланные раньше из медиатеки."
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=inline.media_library_entry_keyboard())
+
+
+def extract_media(message: types.Message):
+    """
+    Файл из сообщения для черновика и медиатеки или None:
+    {'uid', 'id', 'type', 'size', 'duration', 'title'}
+    """
+    if message.photo:
+        file, ftype = message.photo[-1], "photo"
+    elif message.video:
+        file, ftype = message.video, "video"
+    elif message.animation:
+        file, ftype = message.animation, "video"
+    elif message.audio:
+        file, ftype = message.audio, "audio"
+    else:
+        return None
+    return {
+        'uid': file.file_unique_id,
+        'id': file.file_id,
+        'type': ftype,
+        'size': file.file_size,
+        'duration': getattr(file, "duration", None),
+        'title': getattr(file, "title", None) or getattr(file, "file_name", None),
+    }
 
 
 @router.message(PostCreator.waiting_for_media, F.photo | F.video | F.audio | F.animation)
 async def collect_media(message: types.Message, state: FSMContext):
+    if message.media_group_id:
+        # Альбом: файлы приходят пачкой отдельных обновлений.
+        # Собираем их и записываем в черновик одним изменением состояния
+        album_collector.add(
+            (message.chat.id, message.media_group_id),
+            message,
+            lambda messages: add_album_to_draft(messages, state)
+        )
+        return
+
+    await add_media_to_draft([message], state)
+
+
+async def add_album_to_draft(messages, state: FSMContext):
+    """Альбом собирается уже после ответа хендлера, поэтому встаем в очередь пользователя сами"""
+    async with update_lanes.lane(messages[0].from_user.id):
+        await add_media_to_draft(messages, state)
+
+
+async def add_media_to_draft(messages, state: FSMContext):
+    """Добавление файлов в черновик: одно чтение и одна запись FSM, один ответ пользователю"""
     data = await state.get_data()
     media_list = data.get("media_list", [])
     mode = data.get("post_mode")
+    reply_to = messages[0]
+
+    # Один и тот же файл (file_unique_id) дважды в пост не добавляется
+    in_draft = {m.get('uid') for m in media_list}
+    files = []
+    added, wrong_type, over_limit, duplicates = 0, 0, 0, 0
+    for message in messages:
+        if len(media_list) >= 10:
+            over_limit += 1
+            continue
+
+        # Валидация типов
+        if (mode == "audio" and not message.audio) or (mode == "media" and message.audio):
+            wrong_type += 1
+            continue
+
+        file = extract_media(message)
+        if file['uid'] in in_draft:
+            duplicates += 1
+            continue
+        in_draft.add(file['uid'])
+        media_list.append({"id": file['id'], "type": file['type'], "uid": file['uid']})
+        files.append(file)
+        added += 1
+
+    if added:
+        await state.update_data(media_list=media_list)
+        # Файл запоминается в медиатеке: в следующий пост его можно взять без повторной отправки
+        await db.save_media(reply_to.from_user.id, files)
+
+    # Одиночный файл — прежние короткие ответы
+    if len(messages) == 1:
+        if over_limit:
+            await reply_to.answer("⚠️ Лимит 10 файлов исчерпан!")
+        elif wrong_type:
+            if mode == "audio":
+                await reply_to.answer("❌ В этом режиме принимаются только аудио.")
+            else:
+                await reply_to.answer("❌ В этом режиме принимаются только фото/видео.")
+        elif duplicates:
+            await reply_to.answer("ℹ️ Этот файл уже добавлен в пост.",
+                                  reply_markup=inline.media_received_keyboard())
+        else:
+            await reply_to.answer(f"✅ Файл {len(media_list)}/10 добавлен.",
+                                  reply_markup=inline.media_received_keyboard())
+        return
+
+    # Альбом — один сводный ответ
+    text = f"✅ Добавлено файлов: {added} (всего {len(media_list)}/10)."
+    if wrong_type:
+        text += f"\n❌ Пропущено {wrong_type}: в этом режиме принимаются только " \
+                f"{'аудио' if mode == 'audio' else 'фото/видео'}."
+    if duplicates:
+        text += f"\nℹ️ Пропущено {duplicates}: эти файлы уже в посте."
+    if over_limit:
+        text += f"\n⚠️ Не поместилось {over_limit}: лимит 10 файлов."
+    await reply_to.answer(text, reply_markup=inline.media_received_keyboard())
+
+
+# --- 4.2 ФАЙЛЫ ИЗ МЕДИАТЕКИ ---
+
+# Какие файлы медиатеки подходят режиму черновика
+LIBRARY_TYPES = {
+    "media": ("photo", "video"),
+    "audio": ("audio",),
+}
+
+
+async def show_media_library(callback: types.CallbackQuery, state: FSMContext):
+    """Файлы медиатеки для текущего режима; уже добавленные в пост отмечены. False — подходящих нет"""
+    data = await state.get_data()
+    mode = data.get("post_mode") or "media"
+    items = await db.get_user_media(callback.from_user.id, LIBRARY_TYPES[mode])
+    if not items:
+        return False
+
+    media_list = data.get("media_list", [])
+    await callback.message.edit_text(
+        f"📚 <b>Медиатека</b> — в посте {len(media_list)}/10\n"
+        "Нажмите на файл, чтобы добавить его в пост (без повторной загрузки):",
+        reply_markup=inline.media_library_keyboard(items, {m.get('uid') for m in media_list}),
+        parse_mode="HTML"
+    )
+    return True
+
+
+@router.callback_query(PostCreator.waiting_for_media, F.data == "media_lib")
+async def open_media_library(callback: types.CallbackQuery, state: FSMContext):
+    if not await show_media_library(callback, state):
+        await callback.answer("📭 В медиатеке пока нет подходящих файлов.\n"
+                              "Присланные боту файлы сохраняются в ней автоматически.", show_alert=True)
 
+
+@router.callback_query(PostCreator.waiting_for_media, F.data.startswith("mlpick:"))
+async def media_library_pick(callback: types.CallbackQuery, state: FSMContext):
+    uid = callback.data.split(":", 1)[1]
+    data = await state.get_data()
+    media_list = data.get("media_list", [])
+
+    if any(m.get('uid') == uid for m in media_list):
+        await callback.answer("ℹ️ Этот файл уже в посте.")
+        return
     if len(media_list) >= 10:
-        await message.answer("⚠️ Лимит 10 файлов исчерпан!")
+        await callback.answer("⚠️ Лимит 10 файлов исчерпан!", show_alert=True)
+        return
+    row = await db.get_media(callback.from_user.id, uid)
+    if not row:
+        await callback.answer("⚠️ Файл не найден в медиатеке.", show_alert=True)
         return
 
-    # Валидация типов
-    if mode == "audio" and not message.audio:
-        return await message.answer("❌ В этом режиме принимаются только аудио.")
-    if mode == "media" and message.audio:
-        return await message.answer("❌ В этом режиме принимаются только фото/видео.")
+    # Сохраненный file_id: Telegram отправит файл со своих серверов, без повторной загрузки
+    file_id, ftype = row
+    media_list.append({"id": file_id, "type": ftype, "uid": uid})
+    await state.update_data(media_list=media_list)
+    await db.touch_media(callback.from_user.id, uid)
+    await callback.answer(f"✅ Файл {len(media_list)}/10 добавлен.")
+    await show_media_library(callback, state)
+
 
-    # Получаем file_id
-    if message.photo:
-        fid, ftype = message.photo[-1].file_id, "photo"
-    elif message.video:
-        fid, ftype = message.video.file_id, "video"
-    elif message.animation:
-        fid, ftype = message.animation.file_id, "video"
-    elif message.audio:
-        fid, ftype = message.audio.file_id, "audio"
+@router.callback_query(PostCreator.waiting_for_media, F.data.startswith("mldel:"))
+async def media_library_delete(callback: types.CallbackQuery, state: FSMContext):
+    await db.delete_media(callback.from_user.id, callback.data.split(":", 1)[1])
+    await callback.answer("🗑 Файл удален из медиатеки.")
+    if not await show_media_library(callback, state):
+        await media_library_done(callback, state)
 
-    media_list.append({"id": fid, "type": ftype})
-    await state.update_data(media_list=media_list)
 
-    await message.answer(f"✅ Файл {len(media_list)}/10 добавлен.", reply_markup=inline.media_received_keyboard())
+@router.callback_query(PostCreator.waiting_for_media, F.data == "ml_done")
+async def media_library_done(callback: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await callback.message.edit_text(
+        f"✅ Файлов в посте: {len(data.get('media_list', []))}/10.\nМожно прислать еще или опубликовать.",
+        reply_markup=inline.media_received_keyboard()
+    )
 
 
 # --- 5. ФИНАЛЬНАЯ ПУБЛИКАЦИЯ ---
@@ -243,9 +723,10 @@ async def collect_media(message: types.Message, state: FSMContext):
 async def publish_handler(callback: types.CallbackQuery, state: FSMContext, bot: Bot):
     data = await state.get_data()
     cid = data.get("selected_channel")
+    broadcast_channels = data.get("broadcast_channels")
 
     # 1. Проверка сессии
-    if not cid:
+    if not cid and not broadcast_channels:
         await callback.answer("⚠️ Сессия истекла или пост уже опубликован.")
         try:
             await callback.message.delete()
@@ -258,89 +739,191 @@ async def publish_handler(callback: types.CallbackQuery, state: FSMContext, bot:
     is_html = data.get("is_html", False)
     media_list = data.get("media_list", [])
 
-    # Экранируем название канала, чтобы знаки вроде & или < в названии не ломали HTML-ссылку
-    title = html.escape(db.get_channel_title(cid))
-
-    # Формируем ссылки для футера
-    clean_id = str(cid).replace("-100", "")
-    link = f"https://t.me/{cid[1:]}" if str(cid).startswith("@") else f"https://t.me/c/{clean_id}/1"
-
-    # Варианты футеров
-    footer_rich = f"\n\n{TG_EMOJI} <a href='{link}'>{title}</a>"
-    footer_plain = f"\n\n⛺️ <a href='{link}'>{title}</a>"
-
-    # 3. Внутренняя функция отправки (с поддержкой альбомов и parse_mode)
-    async def send_to_tg(caption, parse_mode="HTML"):
-        if not media_list:
-            await bot.send_message(cid, text=caption, parse_mode=parse_mode)
-        elif len(media_list) == 1:
-            m = media_list[0]
-            if m['type'] == "photo":
-                await bot.send_photo(cid, m['id'], caption=caption, parse_mode=parse_mode)
-            elif m['type'] == "video":
-                await bot.send_video(cid, m['id'], caption=caption, parse_mode=parse_mode)
-            elif m['type'] == "audio":
-                await bot.send_audio(cid, m['id'], caption=caption, parse_mode=parse_mode)
-        else:
-            album_builder = MediaGroupBuilder(caption=caption)
-            for m in media_list:
-                if m['type'] == "photo":
-                    album_builder.add_photo(media=m['id'])
-                elif m['type'] == "video":
-                    album_builder.add_video(media=m['id'])
-                elif m['type'] == "audio":
-                    album_builder.add_audio(media=m['id'])
-
-            media_group = album_builder.build()
-            if media_group:
-                # Принудительно ставим режим парсинга первому элементу альбома
-                media_group[0].parse_mode = parse_mode
-
-            await bot.send_media_group(cid, media=media_group)
-
-    # 4. Основная логика публикации
+    # 3. Публикация
     try:
-        if is_html:
-            # СЦЕНАРИЙ: ШАБЛОН (без футера)
-            try:
-                await send_to_tg(text, parse_mode="HTML")
-                await callback.message.edit_text("🚀 <b>Опубликовано!</b> (Шаблон)", parse_mode="HTML")
-            except Exception:
-                # Если в шаблоне критическая ошибка синтаксиса, шлем как голый текст
-                await send_to_tg(text, parse_mode=None)
-                await callback.message.edit_text("⚠️ <b>Опубликовано без оформления</b> (ошибка в тегах).",
-                                                 parse_mode="HTML")
+        if broadcast_channels:
+            # РАССЫЛКА: параллельно во все каналы + отчет по каждому
+            await callback.message.edit_text(f"⏳ Публикую в {len(broadcast_channels)} кан. ...")
+            results = await broadcast_post(bot, broadcast_channels, text, is_html, media_list,
+                                           user_id=callback.from_user.id)
+            await callback.message.edit_text(await build_broadcast_report(results), parse_mode="HTML",
+                                             disable_web_page_preview=True)
         else:
-            # СЦЕНАРИЙ: ОБЫЧНЫЙ ТЕКСТ (с футером)
-            try:
-                # Попытка 1: Идеальный вариант (HTML + Кастомный эмодзи)
-                await send_to_tg(f"{text}{footer_rich}", parse_mode="HTML")
-                await callback.message.edit_text("🚀 <b>Опубликовано с футером!</b>", parse_mode="HTML")
-            except Exception as e:
-                err_str = str(e).lower()
-                # Если проблема в эмодзи (бусты) или простом HTML
-                if "entities" in err_str or "custom emoji" in err_str or "can't parse" in err_str:
-                    try:
-                        # Попытка 2: Обычный эмодзи, но всё еще HTML
-                        await send_to_tg(f"{text}{footer_plain}", parse_mode="HTML")
-                        await callback.message.edit_text("🚀 <b>Опубликовано!</b> (Заменен эмодзи)", parse_mode="HTML")
-                    except:
-                        # Попытка 3: "Умный Fallback"
-                        # Если в тексте есть знаки < или >, которые ломают HTML,
-                        # мы экранируем ТЕКСТ, но оставляем ФУТЕР кликабельным (в HTML режиме)
-                        safe_text = html.escape(text)
-                        await send_to_tg(f"{safe_text}{footer_plain}", parse_mode="HTML")
-                        await callback.message.edit_text(
-                            "⚠️ <b>Опубликовано</b> (Текст экранирован, ссылка сохранена).", parse_mode="HTML")
-                else:
-                    raise e
-
+            result = await publish_post(bot, cid, text, is_html, media_list, callback.from_user.id)
+            if result['status'] == STATUS_FAILED:
+                await callback.message.answer(f"❌ Критическая ошибка: {result['error']}")
+            else:
+                await callback.message.edit_text(
+                    result['note'], parse_mode="HTML",
+                    reply_markup=inline.published_post_keyboard(cid, result['message_id'])
+                )
     except Exception as e:
         await callback.message.answer(f"❌ Критическая ошибка: {e}")
     finally:
         await state.clear()
 
 
+async def build_broadcast_report(results):
+    """Текст отчета о рассылке: статус по каждому каналу"""
+    done = sum(1 for r in results if r['status'] != STATUS_FAILED)
+    lines = [f"📢 <b>Рассылка завершена:</b> {done} из {len(results)}\n"]
+
+    for r in results:
+        title = html.escape(await db.get_channel_title(r['channel_id']))
+        if r['status'] == STATUS_OK:
+            lines.append(f"✅ {title}")
+        elif r['status'] == STATUS_FALLBACK:
+            lines.append(f"⚠️ {title} — запасное оформление")
+        else:
+            lines.append(f"❌ {title} — {html.escape(r['error'] or '')}")
+
+    return "\n".join(lines)
+
+
+# --- 5.1 ОТЛОЖЕННАЯ ПУБЛИКАЦИЯ ---
+
+@router.callback_query(F.data == "schedule")
+async def ask_publish_time(callback: types.CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    if not data.get("selected_channel") and not data.get("broadcast_channels"):
+        await callback.answer("⚠️ Сессия истекла или пост уже опубликован.")
+        return
+
+    await state.set_state(PostCreator.waiting_for_publish_time)
+    await callback.message.edit_text(
+        "⏰ <b>Когда опубликовать?</b>\n\n"
+        "Отправьте дату и время в формате <code>ДД.ММ.ГГГГ ЧЧ:ММ</code>\n"
+        "или только время <code>ЧЧ:ММ</code> (сегодня, а если уже прошло — завтра).",
+        reply_markup=inline.schedule_cancel_keyboard(),
+        parse_mode="HTML"
+    )
+
+
+@router.message(PostCreator.waiting_for_publish_time, F.text)
+async def receive_publish_time(message: types.Message, state: FSMContext):
+    publish_at = parse_publish_time(message.text)
+
+    if publish_at is None:
+        await message.answer("❌ Не удалось распознать время. Пример: <code>25.12.2025 18:30</code>",
+                             parse_mode="HTML")
+        return
+    if publish_at <= time.time():
+        await message.answer("❌ Это время уже прошло. Укажите время в будущем.")
+        return
+
+    data = await state.get_data()
+    channel_ids = data.get("broadcast_channels") or [data.get("selected_channel")]
+
+    # Сохраняем пост в БД (переживет перезапуск) и ставим в очередь планировщика
+    post_ids = await db.add_scheduled_posts(
+        message.from_user.id, channel_ids,
+        data.get("post_text", ""), data.get("is_html", False), data.get("media_list", []),
+        publish_at
+    )
+    for post_id in post_ids:
+        scheduler.add(post_id, publish_at)
+
+    await state.clear()
+    await message.answer(
+        f"✅ Пост запланирован на <b>{format_publish_time(publish_at)}</b> "
+        f"(каналов: {len(channel_ids)}).",
+        reply_markup=reply.main_menu(),
+        parse_mode="HTML"
+    )
+
+
+# --- 5.2 ОПУБЛИКОВАННЫЕ ПОСТЫ (ПРАВКА И УДАЛЕНИЕ) ---
+
+async def get_published_post(callback: types.CallbackQuery, bot: Bot):
+    """Пост из архива по callback_data вида 'действие:channel_id:message_id' (с проверкой прав) или None"""
+    _, channel_id, message_id = callback.data.split(":")
+    post = await post_archive.get(channel_id, int(message_id))
+    if not post or post['status'] != "published":
+        await callback.answer("⚠️ Пост не найден или уже удален.", show_alert=True)
+        return None
+
+    try:
+        rights = await check_post_rights(bot, channel_id, callback.from_user.id)
+    except Exception as e:
+        await callback.answer(f"⚠️ Ошибка доступа: {e}", show_alert=True)
+        return None
+    if rights != "allowed":
+        await callback.answer("❌ У вас нет прав на публикацию в этом канале.", show_alert=True)
+        return None
+    return post
+
+
+@router.callback_query(F.data.startswith("pedit:"))
+async def ask_post_edit(callback: types.CallbackQuery, state: FSMContext, bot: Bot):
+    post = await get_published_post(callback, bot)
+    if not post:
+        return
+
+    await state.clear()
+    await state.update_data(edit_post=[post['channel_id'], post['message_ids'][0]])
+    await state.set_state(PostCreator.editing_post)
+    await callback.message.answer(
+        "✏️ <b>Отправьте новый текст поста</b>\n"
+        "Текущий текст ниже — его удобно скопировать и поправить.",
+        parse_mode="HTML"
+    )
+    # Текущий текст как есть (HTML-шаблон показываем кодом, чтобы не потерять теги)
+    current = post['post_text'] or "—"
+    await callback.message.answer(f"<code>{html.escape(current)}</code>" if post['is_html'] else html.escape(current),
+                                  parse_mode="HTML")
+    await callback.answer()
+
+
+@router.message(PostCreator.editing_post, F.text)
+async def receive_post_edit(message: types.Message, state: FSMContext, bot: Bot):
+    channel_id, message_id = (await state.get_data()).get("edit_post") or (None, None)
+    await state.clear()
+    post = await post_archive.get(channel_id, message_id) if channel_id else None
+    if not post:
+        await message.answer("⚠️ Пост не найден.", reply_markup=reply.main_menu())
+        return
+
+    post_text, is_html = detect_post_text(message)
+    result = await edit_post(bot, post, post_text, is_html)
+    if result['status'] == STATUS_FAILED:
+        await message.answer(f"❌ Не удалось изменить пост: {html.escape(result['error'])}",
+                             reply_markup=reply.main_menu(), parse_mode="HTML")
+    else:
+        await message.answer(result['note'], parse_mode="HTML",
+                             reply_markup=inline.published_post_keyboard(channel_id, message_id))
+
+
+@router.callback_query(F.data.startswith("pdel:"))
+async def ask_post_delete(callback: types.CallbackQuery, bot: Bot):
+    post = await get_published_post(callback, bot)
+    if not post:
+        return
+    await callback.message.answer(
+        "🗑 <b>Удалить пост из канала?</b>\nСообщений будет удалено: "
+        f"{len(post['message_ids'])}",
+        reply_markup=inline.confirm_delete_keyboard(post['channel_id'], post['message_ids'][0]),
+        parse_mode="HTML"
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("pdel_ok:"))
+async def confirm_post_delete(callback: types.CallbackQuery, bot: Bot):
+    post = await get_published_post(callback, bot)
+    if not post:
+        return
+    error = await delete_post(bot, post)
+    if error:
+        await callback.message.edit_text(f"❌ Не удалось удалить пост: {html.escape(error)}", parse_mode="HTML")
+    else:
+        await callback.message.edit_text("🗑 Пост удален из канала.")
+
+
+@router.callback_query(F.data == "pdel_no")
+async def cancel_post_delete(callback: types.CallbackQuery):
+    await callback.message.delete()
+
+
 # --- 6. ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ---
 
 @router.callback_query(F.data == "reset")
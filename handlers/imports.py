@@ -0,0 +1,73 @@
+import csv
+import html
+import logging
+import os
+import tempfile
+
+from aiogram import Router, F, types, Bot
+from aiogram.filters import Command
+from aiogram.types import FSInputFile
+
+from utils.bulk_import import import_posts, detect_format, format_report
+from utils.scheduler import scheduler
+from config import ADMIN_ID
+
+router = Router()
+
+
+@router.message(Command("import"), F.from_user.id == ADMIN_ID, F.document)
+async def import_document(message: types.Message, bot: Bot):
+    """Массовый импорт: файл .jsonl или .csv с подписью /import (формат — utils/bulk_import.py)"""
+    fmt = detect_format(message.document.file_name)
+    if not fmt:
+        await message.answer("❌ Нужен файл <code>.jsonl</code> или <code>.csv</code>.", parse_mode="HTML")
+        return
+
+    status = await message.answer("⏳ Импортирую посты...")
+    fd, path = tempfile.mkstemp(prefix="import_")
+    os.close(fd)
+    errors_path = f"{path}.errors.csv"
+    try:
+        # Файл скачивается на диск кусками и читается построчно — в памяти только текущая строка
+        await bot.download(message.document, destination=path)
+        with open(path, encoding="utf-8-sig", newline="") as stream, \
+                open(errors_path, "w", encoding="utf-8", newline="") as errors_file:
+            writer = csv.writer(errors_file)
+            writer.writerow(("line", "error"))
+            report = await import_posts(stream, fmt, message.from_user.id,
+                                        lambda line_no, error: writer.writerow((line_no, error)))
+        # Посты уже в БД: планировщик подхватит их сразу, а не через SCHEDULER_POLL_INTERVAL
+        scheduler.refresh()
+
+        await status.edit_text(f"📥 <b>Импорт завершен</b>\n\n<pre>{html.escape(format_report(report))}</pre>",
+                               parse_mode="HTML")
+        if report['errors'] > len(report['error_sample']):
+            await message.answer_document(FSInputFile(errors_path, filename="import_errors.csv"),
+                                          caption=f"Все ошибки импорта: {report['errors']}")
+    except Exception as e:
+        logging.exception(f"Ошибка импорта {message.document.file_name}: {e}")
+        await status.edit_text(f"❌ Импорт прерван: {html.escape(str(e))}", parse_mode="HTML")
+    finally:
+        for file in (path, errors_path):
+            try:
+                os.remove(file)
+            except OSError:
+                pass
+
+
+@router.message(Command("import"), F.from_user.id == ADMIN_ID)
+async def import_help(message: types.Message):
+    await message.answer(
+        "📥 <b>Массовый импорт постов</b>\n\n"
+        "Пришлите файл <code>.jsonl</code> или <code>.csv</code> с подписью <code>/import</code>.\n"
+        "Одна строка — один пост в один канал:\n"
+        "<code>{\"channel\": -100123, \"text\": \"Привет\", \"media\": [\"photo:promo/1.jpg\"], "
+        "\"publish_at\": \"25.12.2025 18:30\"}</code>\n\n"
+        "• <b>channel</b> — id канала, где у вас есть права;\n"
+        "• <b>media</b> — до 10 файлов: путь в папке загрузок, URL или file_id;\n"
+        "• <b>publish_at</b> — пусто, чтобы опубликовать сразу.\n\n"
+        "Строки с ошибками пропускаются, отчет придет после импорта. "
+        "Файлы больше 20 МБ Telegram боту не отдает — их загружайте командой "
+        "<code>python -m utils.bulk_import</code> на сервере.",
+        parse_mode="HTML"
+    )
@@ -0,0 +1,70 @@
+import html
+
+from aiogram import Router, F, types
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
+
+from keyboards import inline
+from utils.db import db
+from utils.scheduler import format_publish_time
+from config import SEARCH_PAGE_SIZE
+
+router = Router()
+
+
+def format_snippet(snippet):
+    """Фрагмент из FTS5: экранируем текст, а маркеры совпадений превращаем в <b>"""
+    return html.escape(snippet or "").replace("\x02", "<b>").replace("\x03", "</b>")
+
+
+async def show_results(target: types.Message, user_id, query, offset, edit):
+    rows, has_more = await db.search(user_id, query, offset)
+
+    if not rows:
+        text = f"🔍 По запросу <b>{html.escape(query)}</b> ничего не найдено."
+        markup = None
+    else:
+        lines = [f"🔍 <b>{html.escape(query)}</b> — результаты {offset + 1}–{offset + len(rows)}\n"]
+        posts = []
+        for number, (kind, _, title, snippet, published_at, channel_id, message_id) in enumerate(rows, offset + 1):
+            if kind == "template":
+                lines.append(f"{number}. 📋 Шаблон <b>{html.escape(title)}</b>\n{format_snippet(snippet)}\n")
+            else:
+                lines.append(f"{number}. 📰 <b>{html.escape(title or '—')}</b> · {format_publish_time(published_at)}\n"
+                             f"{format_snippet(snippet)}\n")
+                # Править можно только посты, сохраненные вместе с id сообщений
+                if message_id:
+                    posts.append((number, channel_id, message_id))
+        text = "\n".join(lines)
+        markup = inline.search_results_keyboard(offset, SEARCH_PAGE_SIZE, has_more, posts)
+
+    if edit:
+        await target.edit_text(text, reply_markup=markup, parse_mode="HTML", disable_web_page_preview=True)
+    else:
+        await target.answer(text, reply_markup=markup, parse_mode="HTML", disable_web_page_preview=True)
+
+
+@router.message(Command("find"))
+async def cmd_find(message: types.Message, command: CommandObject, state: FSMContext):
+    """Поиск по своим шаблонам и по истории постов в своих каналах"""
+    query = (command.args or "").strip()
+    if not query:
+        await message.answer("🔍 Напишите запрос после команды, например: <code>/find акция кофе</code>",
+                             parse_mode="HTML")
+        return
+
+    # Запрос храним в FSM: в callback_data (64 байта) он может не поместиться
+    await state.update_data(find_query=query)
+    await show_results(message, message.from_user.id, query, 0, edit=False)
+
+
+@router.callback_query(F.data.startswith("find:"))
+async def find_page(callback: types.CallbackQuery, state: FSMContext):
+    query = (await state.get_data()).get("find_query")
+    if not query:
+        await callback.answer("⚠️ Запрос устарел, повторите /find.", show_alert=True)
+        return
+
+    offset = max(0, int(callback.data.split(":")[1]))
+    await show_results(callback.message, callback.from_user.id, query, offset, edit=True)
+    await callback.answer()
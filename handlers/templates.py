@@ -6,6 +6,9 @@ from aiogram.fsm.state import State
 from states.template_states import TemplateCreator
 from keyboards import inline_templates as kb_tpl
 from keyboards import reply
+from utils.db import db
+from utils.template_engine import template_fields
+from config import TEMPLATES_PER_USER
 
 router = Router()
 
@@ -19,6 +22,8 @@ async def start_template_info(message: types.Message, state: FSMContext):
         "Я помогу вам собрать структурированный текст для канала.\n\n"
         "⚠️ <b>ВАЖНО:</b> Если вы используете премиум-эмодзи, "
         "они будут видны в канале только при наличии <b>Boost 2 уровня</b>.\n\n"
+        "💡 В любой части можно оставить поле вида <code>{{цена}}</code> — "
+        "сохраненный шаблон появится в разделе «Контент», и при публикации бот спросит значения полей.\n\n"
         "Начать создание?",
         reply_markup=kb_tpl.start_template_kb(),
         parse_mode="HTML"
@@ -133,6 +138,7 @@ async def get_links(message: types.Message, state: FSMContext):
 
 # --- ФИНАЛИЗАЦИЯ И ВЫВОД ---
 async def finalize_template(message: types.Message, state: FSMContext, is_skip=False):
+    final_text = None
     try:
         links = message.html_text if not is_skip else ""
         data = await state.get_data()
@@ -176,8 +182,65 @@ async def finalize_template(message: types.Message, state: FSMContext, is_skip=F
             parse_mode="HTML"
         )
 
+        # Предлагаем сохранить шаблон в библиотеку (для выбора в «Контенте»)
+        fields = template_fields(final_text)
+        fields_txt = f"\nПоля для заполнения: {', '.join(f'<code>{f}</code>' for f in fields)}" if fields else ""
+        await message.answer(
+            f"💾 Сохранить шаблон в библиотеку?{fields_txt}",
+            reply_markup=kb_tpl.save_template_kb(),
+            parse_mode="HTML"
+        )
+
     except Exception as e:
         logging.error(f"Ошибка сборки шаблона: {e}")
         await message.answer(f"❌ Ошибка при сборке: {e}", reply_markup=reply.main_menu())
+        final_text = None
     finally:
-        await state.clear()
\ No newline at end of file
+        await state.clear()
+        if final_text:
+            await state.update_data(tpl_html=final_text)
+            await state.set_state(TemplateCreator.ready_to_save)
+
+
+# --- СОХРАНЕНИЕ В БИБЛИОТЕКУ ---
+@router.callback_query(TemplateCreator.ready_to_save, F.data == "tpl_save")
+async def ask_template_name(callback: types.CallbackQuery, state: FSMContext):
+    await state.set_state(TemplateCreator.waiting_for_name)
+    count = await db.count_user_templates(callback.from_user.id)
+    await callback.message.edit_text("🏷 Введите <b>название шаблона</b> (шаблон с тем же названием будет заменен):\n"
+                                     f"<i>В библиотеке {count} из {TEMPLATES_PER_USER}.</i>",
+                                     reply_markup=kb_tpl.name_controls_kb(),
+                                     parse_mode="HTML")
+
+
+@router.callback_query(F.data == "tpl_done")
+async def skip_template_save(callback: types.CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.message.edit_text("👌 Шаблон не сохранен.")
+
+
+@router.message(TemplateCreator.waiting_for_name, F.text)
+async def save_template(message: types.Message, state: FSMContext):
+    name = " ".join(message.text.split())[:64]
+    data = await state.get_data()
+    body = data.get("tpl_html")
+    if not name or not body:
+        await message.answer("⚠️ Введите название текстом.")
+        return
+
+    # Лимит библиотеки: новое название — только если есть место (перезапись существующего — всегда).
+    # Названия загружаются только для полной библиотеки
+    full = await db.count_user_templates(message.from_user.id) >= TEMPLATES_PER_USER
+    if full and name not in [row[1] for row in await db.get_user_templates(message.from_user.id)]:
+        await message.answer(f"❌ В библиотеке уже {TEMPLATES_PER_USER} шаблонов. "
+                             f"Удалите ненужные в разделе «Контент» или используйте существующее название.")
+        return
+
+    await db.save_template(message.from_user.id, name, body)
+    await state.clear()
+    await message.answer(
+        f"✅ Шаблон <b>{html.escape(name)}</b> сохранен.\n"
+        f"Выберите его в «Контент» → канал → <b>📋 Шаблон</b>.",
+        reply_markup=reply.main_menu(),
+        parse_mode="HTML"
+    )
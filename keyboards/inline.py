@@ -7,37 +7,96 @@ def role_selection_keyboard():
     builder = InlineKeyboardBuilder()
     builder.button(text="👑 Я владелец канала", callback_data="role:owner")
     builder.button(text="👨‍💻 Я админ канала", callback_data="role:admin")
+    builder.button(text="📢 Рассылка в несколько каналов", callback_data="broadcast")
     builder.adjust(1)
     return builder.as_markup()
 
 
-def channels_keyboard(channels_list):
-    """Список каналов, полученный из БД (уже отфильтрованный по роли)"""
+def channels_keyboard(channels_list, has_prev=False, has_next=False, filtered=False):
+    """
+    Страница списка каналов, полученная из БД (уже отфильтрованная по роли).
+    Под каналами — навигация по страницам и сброс поиска.
+    """
     builder = InlineKeyboardBuilder()
 
     for title, cid in channels_list:
-        builder.button(text=str(title), callback_data=f"chan:{cid}")
+        builder.row(InlineKeyboardButton(text=str(title), callback_data=f"chan:{cid}"))
+
+    # Навигация по страницам (в один ряд)
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="◀️ Назад", callback_data="chpage:prev"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="Дальше ▶️", callback_data="chpage:next"))
+    if nav:
+        builder.row(*nav)
+
+    if filtered:
+        builder.row(InlineKeyboardButton(text="✖️ Сбросить поиск", callback_data="chpage:reset"))
 
     # Кнопка возврата к выбору роли
-    builder.button(text="⬅️ Назад", callback_data="back_to_roles")
-    builder.adjust(1)
+    builder.row(InlineKeyboardButton(text="⬅️ К выбору роли", callback_data="back_to_roles"))
+    return builder.as_markup()
+
+
+def broadcast_channels_keyboard(channels_list, selected, has_prev=False, has_next=False):
+    """
+    Страница мультивыбора каналов для рассылки (отмеченные помечаются галочкой).
+    Под каналами — навигация по страницам, отметка всех каналов сразу и сброс отметок.
+    """
+    builder = InlineKeyboardBuilder()
+    selected = set(selected)
+
+    for title, cid in channels_list:
+        mark = "✅" if cid in selected else "▫️"
+        builder.row(InlineKeyboardButton(text=f"{mark} {title}", callback_data=f"bc:{cid}"))
+
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="◀️ Назад", callback_data="bcpage:prev"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="Дальше ▶️", callback_data="bcpage:next"))
+    if nav:
+        builder.row(*nav)
+
+    builder.row(
+        InlineKeyboardButton(text="☑️ Выбрать все", callback_data="bc_all"),
+        InlineKeyboardButton(text="✖️ Снять все", callback_data="bc_none"),
+    )
+    builder.row(InlineKeyboardButton(text=f"🚀 Готово ({len(selected)})", callback_data="bc_done"))
+    builder.row(InlineKeyboardButton(text="⬅️ К выбору роли", callback_data="back_to_roles"))
     return builder.as_markup()
 
 
-def action_keyboard(is_owner: bool = False):
-    """Меню действий после выбора конкретного канала"""
+def action_keyboard(is_owner: bool = False, is_broadcast: bool = False):
+    """Меню действий после выбора конкретного канала (или набора каналов для рассылки)"""
     builder = InlineKeyboardBuilder()
     builder.button(text="✍️ Текст", callback_data="action_text")
+    builder.button(text="📋 Шаблон", callback_data="action_template")
     builder.button(text="🖼 Фото/Видео", callback_data="add_media")
     builder.button(text="🎵 Аудио", callback_data="add_audio")
 
     # Кнопку обновления показываем всем, но в хендлере проверим права
     # Или можно скрыть: if is_owner: builder.button(...)
-    builder.button(text="🔄 Обновить админов", callback_data="refresh_admins")
+    # В режиме рассылки канал не один, поэтому обновлять админов негде
+    if not is_broadcast:
+        builder.button(text="🔄 Обновить админов", callback_data="refresh_admins")
 
     builder.button(text="❌ Сбросить", callback_data="reset")
 
-    builder.adjust(1, 2, 1, 1)  # Сетка: 1 кнопка, потом 2 в ряд, потом по 1
+    builder.adjust(2, 2, 1, 1)  # Сетка: по 2 в ряд, потом по 1
+    return builder.as_markup()
+
+
+def templates_keyboard(templates):
+    """Библиотека шаблонов пользователя: выбор и удаление"""
+    builder = InlineKeyboardBuilder()
+    for template_id, name in templates:
+        builder.row(
+            InlineKeyboardButton(text=f"📋 {name}", callback_data=f"tplpick:{template_id}"),
+            InlineKeyboardButton(text="🗑", callback_data=f"tpldel:{template_id}"),
+        )
+    builder.row(InlineKeyboardButton(text="⬅️ Назад", callback_data="tpl_back"))
     return builder.as_markup()
 
 
@@ -47,22 +106,107 @@ def post_options_keyboard():
     builder.button(text="🖼 Фото/Видео", callback_data="add_media")
     builder.button(text="🎵 Аудио", callback_data="add_audio")
     builder.button(text="🚀 Опубликовать", callback_data="publish")
+    builder.button(text="⏰ Опубликовать позже", callback_data="schedule")
     builder.button(text="❌ Сбросить", callback_data="reset")
-    builder.adjust(2, 1, 1)
+    builder.adjust(2, 1, 1, 1)
     return builder.as_markup()
 
 
 def media_received_keyboard():
     """Клавиатура в процессе загрузки файлов"""
     builder = InlineKeyboardBuilder()
+    builder.button(text="📚 Из медиатеки", callback_data="media_lib")
     builder.button(text="🚀 Опубликовать", callback_data="publish")
+    builder.button(text="⏰ Опубликовать позже", callback_data="schedule")
     builder.button(text="❌ Сбросить", callback_data="reset")
     builder.adjust(1)
     return builder.as_markup()
 
 
+def media_library_entry_keyboard():
+    """Вместо новой загрузки — файлы, присланные раньше"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="📚 Из медиатеки", callback_data="media_lib")
+    return builder.as_markup()
+
+
+# Подписи типов файлов медиатеки
+MEDIA_ICONS = {"photo": "🖼 Фото", "video": "🎬 Видео", "audio": "🎵 Аудио"}
+
+
+def media_label(media_type, size, duration, title):
+    """Кнопка файла медиатеки: тип или название, длительность и размер"""
+    parts = [f"🎵 {title}" if title and media_type == "audio" else MEDIA_ICONS.get(media_type, media_type)]
+    if duration:
+        parts.append(f"{duration // 60}:{duration % 60:02d}")
+    if size:
+        parts.append(f"{size / 1048576:.1f} МБ" if size >= 1048576 else f"{max(1, size // 1024)} КБ")
+    return " · ".join(parts)
+
+
+def media_library_keyboard(items, selected):
+    """
+    Медиатека пользователя: выбор файла в пост и удаление.
+    items — [(file_unique_id, type, size, duration, title)], selected — file_unique_id уже добавленных
+    """
+    builder = InlineKeyboardBuilder()
+    for uid, media_type, size, duration, title in items:
+        mark = "✅ " if uid in selected else ""
+        builder.row(
+            InlineKeyboardButton(text=mark + media_label(media_type, size, duration, title),
+                                 callback_data=f"mlpick:{uid}"),
+            InlineKeyboardButton(text="🗑", callback_data=f"mldel:{uid}"),
+        )
+    builder.row(InlineKeyboardButton(text="✔️ Готово", callback_data="ml_done"))
+    return builder.as_markup()
+
+
+def schedule_cancel_keyboard():
+    """Отмена на шаге ввода времени публикации"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="❌ Сбросить", callback_data="reset")
+    return builder.as_markup()
+
+
 def back_to_roles_keyboard():
     """Простая кнопка назад, если список каналов пуст"""
     builder = InlineKeyboardBuilder()
     builder.button(text="⬅️ Назад к выбору роли", callback_data="back_to_roles")
-    return builder.as_markup()
\ No newline at end of file
+    return builder.as_markup()
+
+
+def search_results_keyboard(offset, page_size, has_more, posts=()):
+    """
+    Листание результатов /find.
+    posts — [(номер в выдаче, channel_id, message_id)] для кнопок правки/удаления найденных постов
+    """
+    rows = [
+        [InlineKeyboardButton(text=f"✏️ {number}", callback_data=f"pedit:{channel_id}:{message_id}"),
+         InlineKeyboardButton(text=f"🗑 {number}", callback_data=f"pdel:{channel_id}:{message_id}")]
+        for number, channel_id, message_id in posts
+    ]
+    buttons = []
+    if offset > 0:
+        buttons.append(InlineKeyboardButton(text="⬅️ Назад", callback_data=f"find:{max(0, offset - page_size)}"))
+    if has_more:
+        buttons.append(InlineKeyboardButton(text="Дальше ➡️", callback_data=f"find:{offset + page_size}"))
+    if buttons:
+        rows.append(buttons)
+    return InlineKeyboardMarkup(inline_keyboard=rows) if rows else None
+
+
+def published_post_keyboard(channel_id, message_id):
+    """Действия с опубликованным постом"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="✏️ Изменить текст", callback_data=f"pedit:{channel_id}:{message_id}")
+    builder.button(text="🗑 Удалить", callback_data=f"pdel:{channel_id}:{message_id}")
+    builder.adjust(2)
+    return builder.as_markup()
+
+
+def confirm_delete_keyboard(channel_id, message_id):
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🗑 Да, удалить", callback_data=f"pdel_ok:{channel_id}:{message_id}")
+    builder.button(text="✖️ Отмена", callback_data="pdel_no")
+    builder.adjust(2)
+    return builder.as_markup()
@@ -15,4 +15,18 @@ def step_controls_kb():
     builder.button(text="⏭ Пропустить", callback_data="tpl_skip")
     builder.button(text="❌ Отмена", callback_data="tpl_cancel")
     builder.adjust(2)
-    return builder.as_markup()
\ No newline at end of file
+    return builder.as_markup()
+
+def save_template_kb():
+    """Сохранение собранного шаблона в библиотеку"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="💾 Сохранить", callback_data="tpl_save")
+    builder.button(text="✖️ Не сохранять", callback_data="tpl_done")
+    builder.adjust(2)
+    return builder.as_markup()
+
+def name_controls_kb():
+    """Клавиатура при вводе названия шаблона"""
+    builder = InlineKeyboardBuilder()
+    builder.button(text="✖️ Не сохранять", callback_data="tpl_done")
+    return builder.as_markup()
@@ -1,23 +1,46 @@
 import asyncio
 import logging
+import signal
 import sys
 
 from aiogram import Bot, Dispatcher
-from aiogram.client.default import DefaultBotProperties
-from aiogram.enums import ParseMode
 from aiogram.types import BotCommand
 
-from config import TOKEN, LOG_LEVEL
-from handlers import common, content, templates
+from config import TOKENS, LOG_LEVEL, BOT_MODE, WORKERS, FSM_STORAGE
+from handlers import common, content, templates, search, imports
+from utils.db import db
+from utils.lanes import update_lanes
+from utils.scheduler import scheduler
+from utils.reconciler import reconciler
+from utils.post_archive import post_archive
+from utils.outbox import outbox
+from utils.uploads import upload_cache
+from utils.fsm_storage import storage
+from utils.webhook import run_webhook
+from utils.metrics import registry, update_metrics, start_metrics_server
+from utils.multibot import bot_scope, create_bots, all_governors
+from utils.cluster import is_worker, is_router, is_leader, run_router, serve_worker, SHARED_POLL_INTERVAL
 
 async def setup_bot_commands(bot: Bot):
     """Создание меню команд (синяя кнопка '/' в Telegram)"""
     commands = [
         BotCommand(command="start", description="Запустить бота / Главное меню"),
         BotCommand(command="info", description="Инструкция по использованию"),
+        BotCommand(command="find", description="Поиск по шаблонам и опубликованным постам"),
     ]
     await bot.set_my_commands(commands)
 
+def register_gauges():
+    """Текущее состояние очередей и буферов для /metrics (считывается при каждом запросе Prometheus)"""
+    registry.gauge("bot_send_queue", "Запросов в очереди регуляторов отправки (всех ботов)",
+                   lambda: sum(g.stats()['queued'] for g in all_governors()))
+    registry.gauge("bot_lane_queue", "Обновлений в очередях пользователей", lambda: update_lanes.stats()['queued'])
+    registry.gauge("bot_lane_in_flight", "Хендлеров в работе", lambda: update_lanes.stats()['in_flight'])
+    registry.gauge("bot_fsm_sessions", "Сессий FSM в памяти процесса", storage.session_count)
+    registry.gauge("bot_fsm_dirty", "Сессий FSM, ждущих записи", storage.dirty_count)
+    registry.gauge("bot_archive_pending", "Постов, ждущих записи в архив", lambda: post_archive.stats()['pending'])
+    registry.gauge("bot_outbox_in_flight", "Уведомлений в процессе отправки", lambda: outbox.stats()['in_flight'])
+
 async def main():
     # 1. Настройка логирования
     # Берем уровень из config.py (по умолчанию INFO)
@@ -27,41 +50,117 @@ async def main():
         stream=sys.stdout
     )
 
-    # 2. Инициализация бота
-    # Используем DefaultBotProperties, чтобы все сообщения бота
-    # по умолчанию поддерживали HTML-разметку
-    bot = Bot(
-        token=TOKEN,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
-    )
+    # 2. Инициализация ботов
+    # Один токен (BOT_TOKEN) или несколько (BOT_TOKENS) — все боты работают в одном процессе
+    # с общими роутерами и базой; у каждого свой регулятор лимитов (utils/multibot.py)
+    bots = create_bots(TOKENS)
+    if is_router() or is_worker():
+        # Процессы кластера останавливают через SIGTERM (вход — оркестратор, обработчики — вход):
+        # завершаемся так же аккуратно, как по Ctrl+C, и вход успевает остановить обработчики
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    if not is_worker():
+        # Данные, созданные до перехода на несколько ботов, достаются первому
+        await db.claim_legacy_rows(bots[0].id)
 
     # 3. Инициализация диспетчера
-    dp = Dispatcher()
+    # Сессии FSM хранятся в SQLite (или в Redis, FSM_STORAGE=redis) и переживают перезапуск бота
+    # (хранилище закрывается и сбрасывает изменения на диск при остановке диспетчера)
+    dp = Dispatcher(storage=storage)
+    # Метрики подключаются первыми: полное время обновления включает ожидание в очереди пользователя
+    update_metrics.setup(dp)
+    # Все запросы к базе внутри обновления — от имени бота, который его получил
+    dp.update.outer_middleware(bot_scope)
+    # Обновления одного пользователя обрабатываются строго по очереди,
+    # разные пользователи — параллельно (с общим лимитом)
+    dp.update.outer_middleware(update_lanes)
+    if FSM_STORAGE == "redis":
+        # Сессии общие для всех процессов — очередь пользователя тоже блокируется через Redis
+        from utils.redis_state import RedisUserLocks
+        update_lanes.remote_locks = RedisUserLocks(storage.redis)
 
-    # Установка меню команд в интерфейсе
-    await setup_bot_commands(bot)
+    # Установка меню команд в интерфейсе (в кластере — один раз, на входе)
+    if not is_worker():
+        for bot in bots:
+            await setup_bot_commands(bot)
 
     # 4. Подключение роутеров
     # Важно: common подключаем первым, чтобы команда /start имела приоритет
     dp.include_router(common.router)
+    # Поиск и импорт — до разделов с вводом текста, чтобы /find и /import не стали текстом поста
+    dp.include_router(search.router)
+    dp.include_router(imports.router)
     dp.include_router(content.router)
     dp.include_router(templates.router)
 
-    # 5. Очистка очереди обновлений
-    # Удаляет все сообщения, которые прислали боту, пока он был выключен,
-    # чтобы он не начал отвечать на них "пачкой" при запуске.
-    await bot.delete_webhook(drop_pending_updates=True)
+    # Получаем только те типы обновлений, на которые есть хендлеры
+    allowed_updates = dp.resolve_used_update_types()
+
+    if is_router():
+        # 5а. Вход кластера: сам обновления не обрабатывает, а раздает их WORKERS процессам
+        # по id пользователя (utils/cluster.py). Каждый обработчик — этот же main.py
+        try:
+            await run_router(bots, allowed_updates)
+        finally:
+            for bot in bots:
+                await bot.session.close()
+            db.close()
+        return
+    if WORKERS > 1 and BOT_MODE != "webhook":
+        logging.warning("WORKERS > 1 работает только с BOT_MODE=webhook: запускается один процесс")
 
-    # 6. Запуск бесконечного цикла опроса (Polling)
-    print("🚀 Бот успешно запущен и готов к работе...")
+    await storage.start()
+
+    # 5. Запуск планировщика отложенных постов
+    # Посты, время которых наступило, пока бот был выключен, уйдут сразу
+    # (в кластере планировщик есть в каждом процессе, пост публикует тот, кто его захватил)
+    await scheduler.start(bots)
+    # Архив публикаций пишется на диск пачками в фоне
+    await post_archive.start()
+    # Общие фоновые задачи в кластере ведет только обработчик №0
+    if is_leader():
+        # Фоновая сверка админов во всех каналах
+        await reconciler.start(bots)
+        # Уведомления о подключении/удалении каналов отправляются из очереди в БД
+        # (в кластере их ставят и другие процессы — проверяем таблицу регулярно)
+        if is_worker():
+            outbox.poll_interval = SHARED_POLL_INTERVAL
+        await outbox.start(bots)
+    # Эндпоинт /metrics для Prometheus
+    register_gauges()
+    metrics_runner = await start_metrics_server()
+
+    print(f"🚀 Бот успешно запущен и готов к работе (ботов: {len(bots)})...")
     try:
-        await dp.start_polling(bot)
+        if is_worker():
+            # 6а. Обработчик кластера: обновления приходят от входа по постоянному соединению
+            await serve_worker(dp, bots)
+        elif BOT_MODE == "webhook":
+            # 6а. Вебхук: Telegram сам присылает обновления на встроенный HTTP-сервер
+            await run_webhook(dp, bots, allowed_updates)
+        else:
+            # 6б. Очистка очереди обновлений
+            # Удаляет все сообщения, которые прислали боту, пока он был выключен,
+            # чтобы он не начал отвечать на них "пачкой" при запуске.
+            for bot in bots:
+                await bot.delete_webhook(drop_pending_updates=True)
+
+            # Запуск бесконечного цикла опроса (Polling) — один цикл на каждого бота
+            await dp.start_polling(*bots, allowed_updates=allowed_updates)
     finally:
-        # Корректное закрытие сессии бота при выключении
-        await bot.session.close()
+        # Корректное закрытие сессии бота и соединений с базой при выключении
+        await scheduler.stop()
+        await reconciler.stop()
+        await post_archive.stop()
+        await outbox.stop()
+        await upload_cache.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+        for bot in bots:
+            await bot.session.close()
+        db.close()
 
 if __name__ == "__main__":
     try:
         asyncio.run(main())
-    except (KeyboardInterrupt, SystemExit):
+    except (KeyboardInterrupt, SystemExit, asyncio.CancelledError):
         logging.info("Бот остановлен!")
\ No newline at end of file
@@ -8,14 +8,26 @@ class PostCreator(StatesGroup):
     # 2. Выбор канала из списка доступных
     selecting_channel = State()
 
+    # 2.1 Мультивыбор каналов для рассылки
+    selecting_broadcast = State()
+
     # 3. Главное меню работы с каналом (Текст, Медиа, Обновить админов)
     choosing_action = State()
 
     # 4. Ожидание ввода текста поста
     waiting_for_text = State()
 
+    # 4.1 Заполнение полей шаблона из библиотеки
+    filling_template = State()
+
     # 5. Ожидание отправки файлов (Фото/Видео/Аудио)
     waiting_for_media = State()
 
     # 6. Состояние подтверждения (меню перед публикацией)
-    confirmation = State()
\ No newline at end of file
+    confirmation = State()
+
+    # 7. Ввод даты и времени отложенной публикации
+    waiting_for_publish_time = State()
+
+    # 8. Ввод нового текста для уже опубликованного поста
+    editing_post = State()
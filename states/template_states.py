@@ -7,4 +7,6 @@ class TemplateCreator(StatesGroup):
     waiting_for_note = State()       # Заметка
     waiting_for_conclusion = State() # Заключение
     waiting_for_hashtags = State()   # Хештеги
-    waiting_for_links = State()      # Ссылки
\ No newline at end of file
+    waiting_for_links = State()      # Ссылки
+    ready_to_save = State()          # Шаблон собран, можно сохранить
+    waiting_for_name = State()       # Название для библиотеки
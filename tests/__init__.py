@@ -0,0 +1,21 @@
+"""
+Тесты: python -m unittest discover -s tests -t .  (или python -m pytest tests)
+
+config.py читается при первом импорте, поэтому окружение задается здесь, до импорта
+модулей бота: временная база и папка загрузок, тестовый токен и секрет вебхука.
+"""
+import os
+import tempfile
+
+TMP_DIR = tempfile.mkdtemp(prefix="tgchannelbot_tests_")
+
+os.environ.update({
+    "BOT_TOKEN": "42:TEST",
+    "BOT_TOKENS": "",
+    "DATABASE_PATH": os.path.join(TMP_DIR, "bot.db"),
+    "UPLOAD_DIR": os.path.join(TMP_DIR, "uploads"),
+    "WEBHOOK_PATH": "/webhook",
+    "WEBHOOK_SECRET": "test-secret",
+    "METRICS_PORT": "0",
+})
+os.makedirs(os.environ["UPLOAD_DIR"], exist_ok=True)
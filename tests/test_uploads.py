@@ -0,0 +1,150 @@
+import asyncio
+import itertools
+import os
+import time
+import unittest
+
+from aiohttp import web
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from config import UPLOAD_DIR
+from tests import TMP_DIR
+from utils.db import db
+from utils.publisher import send_to_tg
+from utils.uploads import upload_cache, resolve_path, UploadError
+
+BOT_ID = 42
+CHANNEL = -1001000000001
+
+
+class StubBotAPI:
+    """
+    Bot API на 127.0.0.1: sendVideo отвечает сообщением с новым file_id и запоминает,
+    пришел файл загрузкой (multipart) или по file_id. Файлы для URL раздаются по /files/<имя>
+    """
+
+    def __init__(self, files_dir):
+        self.files_dir = files_dir
+        self.sends = []  # 'upload' или file_id — по одному на каждый sendVideo
+        self._ids = itertools.count(1)
+        self._runner = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/files/{name}", self.serve_file)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, "127.0.0.1", 0).start()
+        return f"http://127.0.0.1:{self._runner.addresses[0][1]}"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    async def serve_file(self, request):
+        return web.FileResponse(os.path.join(self.files_dir, request.match_info["name"]))
+
+    async def handle(self, request):
+        method = request.match_info["method"].lower()
+        if method != "sendvideo":
+            return web.json_response({"ok": True, "result": True})
+
+        fields, uploaded = {}, False
+        if request.content_type == "multipart/form-data":
+            reader = await request.multipart()
+            while (part := await reader.next()) is not None:
+                if part.filename:
+                    await part.read()
+                    uploaded = True
+                else:
+                    fields[part.name] = await part.text()
+        else:
+            fields = dict(await request.post())
+        self.sends.append("upload" if uploaded else fields["video"])
+
+        file_id = f"stub-video-{next(self._ids)}"
+        return web.json_response({"ok": True, "result": {
+            "message_id": len(self.sends), "date": int(time.time()),
+            "chat": {"id": int(fields["chat_id"]), "type": "channel"},
+            "video": {"file_id": file_id, "file_unique_id": file_id, "file_size": 1,
+                      "width": 1, "height": 1, "duration": 1},
+        }})
+
+
+class UploadCacheTest(unittest.IsolatedAsyncioTestCase):
+    """Файлы с сервера (utils/uploads.py) против заглушки Bot API"""
+
+    async def asyncSetUp(self):
+        self.stub = StubBotAPI(UPLOAD_DIR)
+        self.api_url = await self.stub.start()
+        self.bot = Bot(token="42:TEST", session=AiohttpSession(api=TelegramAPIServer.from_base(self.api_url)))
+        self.scope = db.bot_scope(BOT_ID)
+        self.scope.__enter__()
+
+    async def asyncTearDown(self):
+        self.scope.__exit__(None, None, None)
+        await upload_cache.close()
+        await self.bot.session.close()
+        await self.stub.stop()
+
+    def make_file(self, name, content=None):
+        """Файл в UPLOAD_DIR; без content — уникальное содержимое (кэш других тестов не мешает)"""
+        with open(os.path.join(UPLOAD_DIR, name), "wb") as f:
+            f.write(content if content is not None else os.urandom(64 * 1024))
+        return name
+
+    def send(self, media_item):
+        return send_to_tg(self.bot, CHANNEL, [media_item], "test")
+
+    async def test_repeat_send_goes_by_cached_file_id(self):
+        name = self.make_file("repeat.mp4")
+        first = await self.send({'type': "video", 'path': name})
+        second = await self.send({'type': "video", 'path': name})
+
+        self.assertEqual(self.stub.sends, ["upload", first[0].video.file_id])
+        self.assertEqual(second[0].chat.id, CHANNEL)
+
+    async def test_same_content_under_other_path_or_url_is_not_uploaded(self):
+        content = os.urandom(64 * 1024)
+        first = await self.send({'type': "video", 'path': self.make_file("original.mp4", content)})
+        file_id = first[0].video.file_id
+
+        await self.send({'type': "video", 'path': self.make_file("copy.mp4", content)})
+        await self.send({'type': "video", 'url': f"{self.api_url}/files/original.mp4"})
+
+        self.assertEqual(self.stub.sends, ["upload", file_id, file_id])
+
+    async def test_concurrent_sends_upload_once(self):
+        name = self.make_file("broadcast.mp4")
+        results = await asyncio.gather(*(self.send({'type': "video", 'path': name}) for _ in range(3)))
+
+        self.assertEqual(len(results), 3)
+        self.assertEqual(self.stub.sends.count("upload"), 1)
+        self.assertEqual(len(self.stub.sends), 3)
+
+    async def test_path_outside_upload_dir_rejected(self):
+        secret = os.path.join(TMP_DIR, "secret.txt")
+        with open(secret, "w") as f:
+            f.write("не для публикации")
+        os.symlink(secret, os.path.join(UPLOAD_DIR, "link.mp4"))
+
+        for path in ("../secret.txt", "nested/../../secret.txt", secret, "link.mp4"):
+            with self.subTest(path=path):
+                with self.assertRaises(UploadError):
+                    resolve_path(path)
+                with self.assertRaises(UploadError):
+                    await self.send({'type': "video", 'path': path})
+
+        # Ни один запрос с файлом до Telegram не дошел
+        self.assertEqual(self.stub.sends, [])
+
+    async def test_missing_file_rejected(self):
+        with self.assertRaises(UploadError):
+            await self.send({'type': "video", 'path': "no-such-file.mp4"})
+        self.assertEqual(self.stub.sends, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,81 @@
+import asyncio
+import time
+import unittest
+
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram import Bot, Dispatcher, F
+
+from utils.webhook import create_webhook_app, webhook_path
+
+# Секрет из tests/__init__.py (WEBHOOK_SECRET) и заголовок, в котором его передает Telegram
+SECRET = "test-secret"
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def message_update(update_id, user_id, text):
+    """Обновление с личным сообщением — в том виде, в каком его присылает Telegram"""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "test"},
+            "text": text,
+        },
+    }
+
+
+class WebhookTest(unittest.IsolatedAsyncioTestCase):
+    """Сервер вебхука (utils/webhook.py): проверка секрета и передача обновлений в диспетчер"""
+
+    async def asyncSetUp(self):
+        self.bots = [Bot(token="42:TEST"), Bot(token="43:TEST")]
+        self.received = asyncio.Queue()
+
+        dp = Dispatcher()
+
+        @dp.message(F.text)
+        async def record(message, bot: Bot):
+            await self.received.put((bot.id, message.from_user.id, message.text))
+
+        self.client = TestClient(TestServer(create_webhook_app(dp, self.bots)))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        await self.client.close()
+        for bot in self.bots:
+            await bot.session.close()
+
+    async def post(self, bot, update, secret=SECRET):
+        headers = {SECRET_HEADER: secret} if secret is not None else {}
+        return await self.client.post(webhook_path(bot, self.bots), json=update, headers=headers)
+
+    async def test_update_with_secret_reaches_handler(self):
+        response = await self.post(self.bots[0], message_update(1, 1001, "привет"))
+        self.assertEqual(response.status, 200)
+        received = await asyncio.wait_for(self.received.get(), timeout=5)
+        self.assertEqual(received, (42, 1001, "привет"))
+
+    async def test_each_bot_has_own_path(self):
+        self.assertEqual(webhook_path(self.bots[1], self.bots), "/webhook/43")
+        response = await self.post(self.bots[1], message_update(2, 1002, "второй бот"))
+        self.assertEqual(response.status, 200)
+        received = await asyncio.wait_for(self.received.get(), timeout=5)
+        self.assertEqual(received, (43, 1002, "второй бот"))
+
+    async def test_wrong_secret_rejected(self):
+        response = await self.post(self.bots[0], message_update(3, 1003, "чужой"), secret="wrong")
+        self.assertEqual(response.status, 401)
+        await asyncio.sleep(0.1)
+        self.assertTrue(self.received.empty())
+
+    async def test_missing_secret_rejected(self):
+        response = await self.post(self.bots[0], message_update(4, 1004, "без секрета"), secret=None)
+        self.assertEqual(response.status, 401)
+        await asyncio.sleep(0.1)
+        self.assertTrue(self.received.empty())
+
+
+if __name__ == "__main__":
+    unittest.main()
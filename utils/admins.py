@@ -0,0 +1,26 @@
+from aiogram import Bot
+
+
+def is_chat_gone_error(error) -> bool:
+    """Ошибка API означает, что канала больше нет или бота из него выгнали"""
+    err_msg = str(error).lower()
+    return "chat not found" in err_msg or "forbidden" in err_msg or "chat_id_invalid" in err_msg
+
+
+async def fetch_channel_admins(bot: Bot, chat_id):
+    """
+    Список админов канала, которым разрешено публиковать, в формате для db.sync_channel_admins:
+    [{'id': int, 'username': str, 'is_owner': bool}, ...]
+    """
+    admins = await bot.get_chat_administrators(chat_id)
+
+    admins_to_sync = []
+    for admin in admins:
+        is_creator = admin.status == "creator"
+        if is_creator or getattr(admin, 'can_post_messages', False):
+            admins_to_sync.append({
+                'id': admin.user.id,
+                'username': admin.user.username or admin.user.first_name or "User",
+                'is_owner': is_creator
+            })
+    return admins_to_sync
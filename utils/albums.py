@@ -0,0 +1,65 @@
+import asyncio
+import logging
+import time
+
+from config import ALBUM_DEBOUNCE
+
+
+class AlbumCollector:
+    """
+    Сборка альбомов (media_group) из отдельных обновлений.
+
+    Telegram присылает каждый файл альбома отдельным сообщением почти одновременно.
+    Сообщения копятся в буфере по ключу альбома, и только когда новые перестали
+    приходить delay секунд, вызывается on_flush со всем списком — один раз на альбом.
+    """
+
+    def __init__(self, delay=ALBUM_DEBOUNCE):
+        self.delay = delay
+        self._groups = {}  # key -> {'items': [...], 'deadline': float}
+        # Ссылки на задачи сборки: event loop держит задачи слабо, без них
+        # ожидающая задача может быть собрана сборщиком мусора и альбом потеряется
+        self._tasks = set()
+
+    def add(self, key, item, on_flush):
+        """
+        Добавление элемента в альбом key.
+        on_flush(items) — корутина, которая будет вызвана после паузы в delay секунд.
+        """
+        group = self._groups.get(key)
+        if group is None:
+            group = {'items': [], 'deadline': 0.0}
+            self._groups[key] = group
+            task = asyncio.create_task(self._wait_and_flush(key, on_flush))
+            self._tasks.add(task)
+            task.add_done_callback(lambda done: self._on_done(key, done))
+        group['items'].append(item)
+        # Каждый новый элемент отодвигает сборку (debounce)
+        group['deadline'] = time.monotonic() + self.delay
+
+    async def _wait_and_flush(self, key, on_flush):
+        group = self._groups[key]
+        while True:
+            remaining = group['deadline'] - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+
+        self._groups.pop(key, None)
+        try:
+            await on_flush(group['items'])
+        except Exception as e:
+            logging.exception(f"Ошибка обработки альбома {key}: {e}")
+
+    def _on_done(self, key, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            # on_flush ловит свои ошибки, сюда попадает только сбой самой сборки
+            logging.error(f"Ошибка сборки альбома {key}", exc_info=task.exception())
+
+    def pending(self):
+        """Сколько альбомов сейчас собирается"""
+        return len(self._groups)
+
+
+album_collector = AlbumCollector()
@@ -0,0 +1,267 @@
+"""
+Массовый импорт постов из JSONL или CSV в очередь публикации (таблица scheduled_posts).
+
+Запуск из корня проекта (бот подхватит посты в течение SCHEDULER_POLL_INTERVAL):
+    python -m utils.bulk_import posts.jsonl --user 123456789
+    python -m utils.bulk_import posts.csv --user 123456789 --errors errors.csv
+
+Или документом боту с подписью /import (только ADMIN_ID, handlers/imports.py).
+
+Одна строка — один пост в один канал. Поля:
+    channel     — id канала (-100...), обязательно;
+    text        — текст поста (HTML-разметка Telegram);
+    media       — файлы: JSONL — список, CSV — через " | " или JSON-список.
+                  Элемент — "photo:promo/1.jpg", "video:https://..." (путь внутри UPLOAD_DIR или URL)
+                  или {"type": "audio", "id": "<file_id>"} / {"type": ..., "path"/"url": ...};
+    publish_at  — когда опубликовать: "ДД.ММ.ГГГГ ЧЧ:ММ", ISO 8601 или Unix-время;
+                  пусто — сразу;
+    is_html     — 1: текст публикуется как шаблон, без футера канала (по умолчанию 0).
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+from config import IMPORT_BATCH_SIZE, IMPORT_ERROR_SAMPLE
+from utils.db import db
+from utils.preflight import check_html, TEXT_LIMIT, CAPTION_LIMIT
+from utils.scheduler import parse_publish_time, LOCAL_TZ
+from utils.uploads import resolve_path, UploadError
+
+MEDIA_TYPES = ("photo", "video", "audio")
+MEDIA_LIMIT = 10
+# Сколько вердиктов проверки прав держать за импорт (каналов в файле обычно немного)
+PERMISSION_CACHE_LIMIT = 10000
+
+
+class RowError(Exception):
+    """Строка импорта не прошла проверку: пропускается, импорт продолжается"""
+
+
+def detect_format(file_name):
+    """jsonl или csv по расширению файла (None — не распознан)"""
+    ext = os.path.splitext(file_name or "")[1].lower()
+    if ext in (".jsonl", ".ndjson", ".json"):
+        return "jsonl"
+    if ext == ".csv":
+        return "csv"
+    return None
+
+
+def read_rows(stream, fmt):
+    """
+    Строки файла по одной: (номер строки, словарь полей или RowError).
+    Файл не читается целиком — в памяти только текущая строка.
+    """
+    if fmt == "jsonl":
+        for line_no, line in enumerate(stream, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_no, RowError(f"некорректный JSON: {e}")
+                continue
+            yield line_no, row if isinstance(row, dict) else RowError("строка должна быть JSON-объектом")
+    else:
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+
+
+def parse_media(value):
+    """Поле media -> список {'type', 'id' / 'path' / 'url'}"""
+    if value in (None, "", []):
+        return []
+    if isinstance(value, str):
+        value = value.strip()
+        value = json.loads(value) if value.startswith("[") else [part for part in value.split("|") if part.strip()]
+    if not isinstance(value, list):
+        raise RowError("media должно быть списком")
+    if len(value) > MEDIA_LIMIT:
+        raise RowError(f"больше {MEDIA_LIMIT} файлов")
+
+    media = []
+    for item in value:
+        if isinstance(item, str):
+            media_type, _, ref = item.strip().partition(":")
+            ref = ref.strip()
+            item = {'type': media_type, 'url' if ref.startswith(("http://", "https://")) else 'path': ref}
+        if not isinstance(item, dict) or item.get('type') not in MEDIA_TYPES:
+            raise RowError(f"файл {item!r}: тип должен быть одним из {', '.join(MEDIA_TYPES)}")
+        sources = [key for key in ('id', 'path', 'url') if item.get(key)]
+        if len(sources) != 1:
+            raise RowError(f"файл {item!r}: нужен ровно один из id, path, url")
+        if sources[0] == 'path':
+            try:
+                resolve_path(item['path'])
+            except UploadError as e:
+                raise RowError(str(e)) from e
+        media.append({'type': item['type'], sources[0]: item[sources[0]]})
+
+    # Аудио в Telegram не смешивается в альбоме с фото и видео
+    if len({m['type'] == "audio" for m in media}) > 1:
+        raise RowError("аудио нельзя смешивать с фото/видео в одном посте")
+    return media
+
+
+def parse_time(value, now):
+    """Поле publish_at -> Unix-время (пусто — сейчас)"""
+    if value in (None, ""):
+        return now
+    if isinstance(value, (int, float)):
+        moment = float(value)
+    else:
+        value = value.strip()
+        try:
+            moment = float(value)
+        except ValueError:
+            moment = parse_publish_time(value)
+            if moment is None:
+                try:
+                    parsed = datetime.fromisoformat(value)
+                except ValueError:
+                    raise RowError(f"не распознано время {value!r}")
+                moment = (parsed if parsed.tzinfo else parsed.replace(tzinfo=LOCAL_TZ)).timestamp()
+    if moment < now:
+        raise RowError("время публикации уже прошло")
+    return moment
+
+
+def parse_flag(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in ("1", "true", "yes", "да")
+
+
+def parse_row(row, now):
+    """Словарь полей строки -> (channel_id, text, is_html, media, publish_at); ошибки — RowError"""
+    channel = str(row.get('channel') or "").strip()
+    if not channel:
+        raise RowError("не указан channel")
+    if channel.lstrip("-").isdigit():
+        channel = str(int(channel))
+
+    text = row.get('text') or ""
+    if not isinstance(text, str):
+        raise RowError("text должен быть строкой")
+    media = parse_media(row.get('media'))
+    if not text.strip() and not media:
+        raise RowError("пустой пост: нет ни текста, ни файлов")
+    # Точную длину с футером канала проверит публикация, здесь — заведомо длинные тексты
+    limit = CAPTION_LIMIT if media else TEXT_LIMIT
+    check = check_html(text)
+    if check.length > limit:
+        raise RowError(f"текст длиннее {limit} символов ({check.length})")
+
+    return channel, text, parse_flag(row.get('is_html')), media, parse_time(row.get('publish_at'), now)
+
+
+async def import_posts(stream, fmt, user_id, errors=None, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Импорт постов от имени user_id (права проверяются по таблице permissions текущего бота).
+    Строки разбираются по одной и пишутся в БД пачками по batch_size — память не зависит
+    от размера файла. Ошибочные строки пропускаются; каждая передается в errors(line_no, error), если задан.
+    Возвращает {'rows', 'queued', 'scheduled', 'errors', 'error_sample'}.
+    """
+    report = {'rows': 0, 'queued': 0, 'scheduled': 0, 'errors': 0, 'error_sample': []}
+    allowed = {}  # channel_id -> есть ли у пользователя права
+    batch = []
+    now = time.time()
+
+    def _error(line_no, error):
+        report['errors'] += 1
+        if len(report['error_sample']) < IMPORT_ERROR_SAMPLE:
+            report['error_sample'].append((line_no, str(error)[:200]))
+        if errors:
+            errors(line_no, str(error))
+
+    for line_no, row in read_rows(stream, fmt):
+        report['rows'] += 1
+        if isinstance(row, RowError):
+            _error(line_no, row)
+            continue
+        try:
+            channel, text, is_html, media, publish_at = parse_row(row, now)
+        except RowError as e:
+            _error(line_no, e)
+            continue
+        except Exception as e:
+            # Неожиданный тип значения в поле (число вместо строки и т.п.)
+            _error(line_no, f"некорректная строка: {e}")
+            continue
+
+        if channel not in allowed:
+            if len(allowed) >= PERMISSION_CACHE_LIMIT:
+                allowed.clear()
+            allowed[channel] = await db.has_permission(user_id, channel)
+        if not allowed[channel]:
+            _error(line_no, f"нет прав на публикацию в канале {channel}")
+            continue
+
+        batch.append((user_id, channel, text, is_html, media, publish_at))
+        if publish_at > now:
+            report['scheduled'] += 1
+        if len(batch) >= batch_size:
+            await db.add_imported_posts(batch)
+            report['queued'] += len(batch)
+            batch = []
+
+    if batch:
+        await db.add_imported_posts(batch)
+        report['queued'] += len(batch)
+    return report
+
+
+def format_report(report):
+    """Итог импорта для человека: счетчики и первые ошибки"""
+    lines = [
+        f"Строк: {report['rows']}, в очереди: {report['queued']} "
+        f"(сразу: {report['queued'] - report['scheduled']}, по расписанию: {report['scheduled']}), "
+        f"ошибок: {report['errors']}"
+    ]
+    for line_no, error in report['error_sample']:
+        lines.append(f"  строка {line_no}: {error}")
+    if report['errors'] > len(report['error_sample']):
+        lines.append(f"  ... и еще {report['errors'] - len(report['error_sample'])}")
+    return "\n".join(lines)
+
+
+async def _main():
+    from config import TOKEN
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("file", help="файл .jsonl или .csv")
+    parser.add_argument("--user", type=int, required=True, help="id автора: права проверяются по его ролям")
+    parser.add_argument("--format", choices=("jsonl", "csv"), help="по умолчанию — по расширению файла")
+    parser.add_argument("--bot-id", type=int, help="бот, от имени которого публиковать (по умолчанию — BOT_TOKEN)")
+    parser.add_argument("--errors", help="записать все ошибки в CSV (строка, ошибка)")
+    args = parser.parse_args()
+
+    fmt = args.format or detect_format(args.file)
+    if not fmt:
+        sys.exit("Не удалось определить формат файла, укажите --format jsonl или csv")
+    bot_id = args.bot_id or int(TOKEN.split(":")[0])
+
+    errors_file = open(args.errors, "w", newline="", encoding="utf-8") if args.errors else None
+    on_error = None
+    if errors_file:
+        writer = csv.writer(errors_file)
+        writer.writerow(("line", "error"))
+        on_error = lambda line_no, error: writer.writerow((line_no, error))  # noqa: E731
+    try:
+        with open(args.file, encoding="utf-8-sig", newline="") as stream, db.bot_scope(bot_id):
+            report = await import_posts(stream, fmt, args.user, on_error)
+    finally:
+        if errors_file:
+            errors_file.close()
+        db.close()
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,282 @@
+import asyncio
+import json
+import logging
+import os
+import struct
+import sys
+from typing import List
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+
+from config import (BOT_MODE, WORKERS, WORKER_BASE_PORT, WORKER_INDEX, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET,
+                    METRICS_PORT, GOVERNOR_GLOBAL_RATE, GOVERNOR_CHANNEL_RATE)
+from utils.webhook import webhook_path, register_webhooks
+
+MAIN_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Как часто процессы кластера проверяют общие таблицы (очередь уведомлений), секунды
+SHARED_POLL_INTERVAL = 1.0
+# Пауза перед перезапуском упавшего обработчика
+RESTART_DELAY = 1.0
+# Кадр обновления от входа к обработчику: id бота, длина тела, затем тело (JSON как прислал Telegram)
+FRAME_HEADER = struct.Struct("!qI")
+# Сколько байт может ждать отправки обработчику, прежде чем вход начнет ждать его (backpressure)
+LINK_BUFFER_LIMIT = 1 << 20
+
+
+def is_worker():
+    """Процесс-обработчик кластера (его запустил вход)"""
+    return WORKER_INDEX >= 0
+
+
+def is_router():
+    """Вход кластера: вебхук и больше одного обработчика"""
+    return BOT_MODE == "webhook" and WORKERS > 1 and not is_worker()
+
+
+def is_leader():
+    """Процесс, который ведет общие фоновые задачи: обычный процесс или обработчик №0"""
+    return WORKER_INDEX <= 0
+
+
+def update_user_id(update: dict):
+    """
+    id пользователя из JSON обновления — тот же, по которому строятся очереди (utils/lanes.py)
+    и ключи FSM. Для постов каналов без автора — id чата, иначе None.
+    """
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        sender = event.get("from") or event.get("user")
+        if isinstance(sender, dict) and "id" in sender:
+            return sender["id"]
+        chat = event.get("chat")
+        if isinstance(chat, dict) and "id" in chat:
+            return chat["id"]
+    return None
+
+
+def worker_for(update: dict, workers=WORKERS):
+    """Номер обработчика: все обновления одного пользователя попадают в один процесс"""
+    key = update_user_id(update)
+    if key is None:
+        key = update.get("update_id", 0)
+    return key % workers
+
+
+class WorkerLink:
+    """
+    Постоянное соединение входа с одним обработчиком: обновления идут кадрами FRAME_HEADER
+    одно за другим, без HTTP-запроса и ожидания ответа на каждое. Порядок обновлений
+    сохраняется (соединение одно), разорванное соединение переподключается при следующем обновлении.
+    """
+
+    def __init__(self, index, port):
+        self.index = index
+        self.port = port
+        self._reader = None
+        self._writer = None
+        self._connecting = asyncio.Lock()
+
+    async def send(self, bot_id, body):
+        """Отправка обновления; OSError — обработчик недоступен"""
+        writer = self._writer if self._alive() else await self._connect()
+        writer.write(FRAME_HEADER.pack(bot_id, len(body)) + body)
+        if writer.transport.get_write_buffer_size() > LINK_BUFFER_LIMIT:
+            # Обработчик не успевает читать: придерживаем ответы Telegram, а не копим память
+            await writer.drain()
+
+    def _alive(self):
+        # Обработчик не пишет в соединение, поэтому EOF от него — закрытие (процесс остановился)
+        return self._writer is not None and not self._writer.is_closing() and not self._reader.at_eof()
+
+    async def _connect(self):
+        async with self._connecting:
+            if not self._alive():
+                if self._writer:
+                    self._writer.close()
+                self._reader, self._writer = await asyncio.open_connection("127.0.0.1", self.port)
+            return self._writer
+
+    async def close(self):
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+
+
+class UpdateRouter:
+    """
+    Вход кластера: принимает вебхуки Telegram и передает тело запроса как есть
+    обработчику worker_for(update) через его WorkerLink (127.0.0.1:WORKER_BASE_PORT + номер).
+
+    JSON разбирается только ради id пользователя — обновление целиком
+    (pydantic, хендлеры) разбирает уже обработчик. Telegram получает 200, как только
+    обновление записано в соединение с обработчиком (обработчик и раньше отвечал до
+    выполнения хендлера); если обработчик недоступен (перезапускается) — 503, и Telegram
+    повторит доставку сам.
+    """
+
+    def __init__(self, workers=WORKERS, base_port=WORKER_BASE_PORT, secret=WEBHOOK_SECRET):
+        self.workers = workers
+        self.secret = secret
+        self.links = [WorkerLink(index, base_port + index) for index in range(workers)]
+        self.routed = [0] * workers
+        self.unavailable = 0
+
+    async def close(self):
+        for link in self.links:
+            await link.close()
+
+    def handler(self, bot: Bot):
+        """Обработчик вебхука одного бота"""
+
+        async def handle(request: web.Request):
+            if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+                return web.Response(status=401)
+            body = await request.read()
+            try:
+                update = json.loads(body)
+            except ValueError:
+                return web.Response(status=400)
+            if not isinstance(update, dict):
+                return web.Response(status=400)
+
+            index = worker_for(update, self.workers)
+            try:
+                await self.links[index].send(bot.id, body)
+            except OSError as e:
+                self.unavailable += 1
+                logging.warning(f"Обработчик {index} недоступен: {e}")
+                return web.Response(status=503)
+            self.routed[index] += 1
+            return web.json_response({})
+
+        return handle
+
+    def stats(self):
+        return {'routed': list(self.routed), 'unavailable': self.unavailable}
+
+
+async def serve_worker(dp: Dispatcher, bots: List[Bot], port=WEBHOOK_PORT):
+    """
+    Обработчик кластера: прием кадров от входа на 127.0.0.1:port и передача обновлений
+    в dp.feed_raw_update фоновыми задачами (как вебхук с handle_in_background)
+    """
+    bots_by_id = {bot.id: bot for bot in bots}
+    tasks = set()
+
+    async def feed(bot, body):
+        result = await dp.feed_raw_update(bot, bot.session.json_loads(body))
+        if isinstance(result, TelegramMethod):
+            await dp.silent_call_request(bot, result)
+
+    async def read_frames(reader, writer):
+        try:
+            while True:
+                bot_id, length = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+                body = await reader.readexactly(length)
+                bot = bots_by_id.get(bot_id)
+                if bot is None:
+                    logging.warning(f"Обновление для незнакомого бота {bot_id} пропущено")
+                    continue
+                task = asyncio.create_task(feed(bot, body))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass  # Вход закрыл соединение (остановка или перезапуск)
+        finally:
+            writer.close()
+
+    workflow_data = {"dispatcher": dp, "bots": bots, **dp.workflow_data}
+    await dp.emit_startup(**workflow_data)
+    server = await asyncio.start_server(read_frames, "127.0.0.1", port)
+    logging.info(f"Обработчик принимает обновления от входа на 127.0.0.1:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        server.close()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await dp.emit_shutdown(**workflow_data)
+
+
+class WorkerPool:
+    """
+    Процессы-обработчики: main.py с WORKER_INDEX, своим портом и долей лимитов Telegram.
+    Упавший обработчик перезапускается.
+    """
+
+    def __init__(self, workers=WORKERS, base_port=WORKER_BASE_PORT):
+        self.workers = workers
+        self.base_port = base_port
+        self._procs = {}  # номер -> процесс
+        self._tasks = []
+        self._stopping = False
+
+    def _env(self, index):
+        env = dict(os.environ)
+        env.update({
+            "WORKER_INDEX": str(index),
+            "BOT_MODE": "webhook",
+            "WEBHOOK_PORT": str(self.base_port + index),
+            # Лимиты Telegram общие на бота, поэтому делятся между процессами
+            "GOVERNOR_GLOBAL_RATE": str(GOVERNOR_GLOBAL_RATE / self.workers),
+            "GOVERNOR_CHANNEL_RATE": str(GOVERNOR_CHANNEL_RATE / self.workers),
+            # У каждого процесса свой /metrics: METRICS_PORT + номер
+            "METRICS_PORT": str(METRICS_PORT + index if METRICS_PORT else 0),
+        })
+        return env
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._keep_alive(index)) for index in range(self.workers)]
+
+    async def _keep_alive(self, index):
+        while not self._stopping:
+            proc = await asyncio.create_subprocess_exec(sys.executable, MAIN_SCRIPT, env=self._env(index))
+            self._procs[index] = proc
+            code = await proc.wait()
+            if self._stopping:
+                return
+            logging.warning(f"Обработчик {index} завершился с кодом {code}, перезапуск")
+            await asyncio.sleep(RESTART_DELAY)
+
+    async def stop(self):
+        self._stopping = True
+        for proc in self._procs.values():
+            if proc.returncode is None:
+                proc.terminate()
+        for proc in self._procs.values():
+            try:
+                await asyncio.wait_for(proc.wait(), timeout=10)
+            except asyncio.TimeoutError:
+                proc.kill()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+async def run_router(bots: List[Bot], allowed_updates):
+    """Вход кластера: регистрация вебхуков, запуск обработчиков и HTTP-сервера на WEBHOOK_PORT"""
+    await register_webhooks(bots, allowed_updates)
+
+    pool = WorkerPool()
+    router = UpdateRouter()
+    await pool.start()
+
+    app = web.Application()
+    for bot in bots:
+        app.router.add_post(webhook_path(bot, bots), router.handler(bot))
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT).start()
+    logging.info(f"Вход кластера слушает http://{WEBHOOK_HOST}:{WEBHOOK_PORT}, обработчиков: {WORKERS}")
+
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await pool.stop()
+        await router.close()
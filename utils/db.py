@@ -1,102 +1,581 @@
-import sqlite3
+import asyncio
+import contextvars
+import html
+import json
 import os
-from config import DB_PATH
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+
+from config import (DB_PATH, DB_READ_POOL_SIZE, CHANNELS_PAGE_SIZE, TEMPLATES_PER_USER, SEARCH_PAGE_SIZE,
+                    MEDIA_LIBRARY_PER_USER, MEDIA_LIBRARY_PAGE_SIZE)
+from utils.metrics import DB_DURATION, DB_WAIT
+
+# Версионные миграции схемы: (версия, список SQL).
+# Новые изменения схемы добавляются ТОЛЬКО в конец списка новой версией.
+MIGRATIONS = [
+    # 1. Исходная схема
+    (1, [
+        # Таблица каналов
+        """
+        CREATE TABLE IF NOT EXISTS channels (
+            channel_id TEXT PRIMARY KEY,
+            title TEXT
+        )
+        """,
+        # Таблица пользователей (админов и владельцев)
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT
+        )
+        """,
+        # Промежуточная таблица разрешений (Permissions)
+        # Связывает пользователей и каналы + хранит роль (Владелец/Админ)
+        """
+        CREATE TABLE IF NOT EXISTS permissions (
+            user_id INTEGER,
+            channel_id TEXT,
+            is_owner INTEGER DEFAULT 0,
+            PRIMARY KEY (user_id, channel_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
+            FOREIGN KEY (channel_id) REFERENCES channels (channel_id) ON DELETE CASCADE
+        )
+        """,
+        # Отложенные посты (одна строка = один пост в один канал)
+        # publish_at — время публикации в секундах Unix (UTC)
+        # status: pending -> sending -> sent / failed
+        """
+        CREATE TABLE IF NOT EXISTS scheduled_posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            channel_id TEXT,
+            post_text TEXT,
+            is_html INTEGER DEFAULT 0,
+            media_list TEXT,
+            publish_at REAL,
+            status TEXT DEFAULT 'pending',
+            error TEXT
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_scheduled_status_time ON scheduled_posts (status, publish_at)",
+        # Сессии FSM (состояние и данные диалогов, переживают перезапуск)
+        # updated_at — время последнего сохранения, по нему удаляются старые сессии
+        """
+        CREATE TABLE IF NOT EXISTS fsm_sessions (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT,
+            updated_at REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_fsm_updated ON fsm_sessions (updated_at)",
+    ]),
+    # 2. Покрывающие индексы для прав
+    (2, [
+        # Каналы пользователя по роли (get_user_channels): поиск без обращения к таблице
+        "CREATE INDEX IF NOT EXISTS idx_permissions_user_role ON permissions (user_id, is_owner, channel_id)",
+        # Владелец канала (get_channel_owner_id), сверка админов и каскадное удаление канала
+        "CREATE INDEX IF NOT EXISTS idx_permissions_channel_role ON permissions (channel_id, is_owner, user_id)",
+    ]),
+    # 3. Библиотека шаблонов (HTML с {{полями}}, у каждого пользователя свои)
+    (3, [
+        """
+        CREATE TABLE IF NOT EXISTS templates (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            body TEXT NOT NULL,
+            updated_at REAL,
+            UNIQUE (user_id, name)
+        )
+        """,
+    ]),
+    # 4. История публикаций и полнотекстовый поиск (FTS5) по ней и по шаблонам
+    # Индексы обновляются триггерами при каждой вставке/изменении/удалении,
+    # в индекс попадает текст без HTML-тегов (функция strip_html регистрируется в _connect)
+    (4, [
+        """
+        CREATE TABLE IF NOT EXISTS posts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            channel_id TEXT,
+            post_text TEXT,
+            is_html INTEGER DEFAULT 0,
+            published_at REAL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_posts_channel_time ON posts (channel_id, published_at)",
+        "CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(text, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        """
+        CREATE TRIGGER IF NOT EXISTS posts_fts_insert AFTER INSERT ON posts BEGIN
+            INSERT INTO posts_fts (rowid, text) VALUES (new.id, strip_html(new.post_text, new.is_html));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS posts_fts_update AFTER UPDATE OF post_text, is_html ON posts BEGIN
+            UPDATE posts_fts SET text = strip_html(new.post_text, new.is_html) WHERE rowid = new.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS posts_fts_delete AFTER DELETE ON posts BEGIN
+            DELETE FROM posts_fts WHERE rowid = old.id;
+        END
+        """,
+        "CREATE VIRTUAL TABLE IF NOT EXISTS templates_fts USING fts5(name, body, tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+        """
+        CREATE TRIGGER IF NOT EXISTS templates_fts_insert AFTER INSERT ON templates BEGIN
+            INSERT INTO templates_fts (rowid, name, body) VALUES (new.id, new.name, strip_html(new.body, 1));
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS templates_fts_update AFTER UPDATE OF name, body ON templates BEGIN
+            UPDATE templates_fts SET name = new.name, body = strip_html(new.body, 1) WHERE rowid = new.id;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS templates_fts_delete AFTER DELETE ON templates BEGIN
+            DELETE FROM templates_fts WHERE rowid = old.id;
+        END
+        """,
+        # Шаблоны, сохраненные до появления индекса
+        "INSERT INTO templates_fts (rowid, name, body) SELECT id, name, strip_html(body, 1) FROM templates",
+    ]),
+    # 5. Архив публикаций: id сообщений в канале, файлы и режим — для правки и удаления поста
+    # message_id — первое сообщение поста (по нему пост находится из кнопок),
+    # message_ids — JSON со всеми сообщениями альбома; status: published / deleted
+    (5, [
+        "ALTER TABLE posts ADD COLUMN message_id INTEGER",
+        "ALTER TABLE posts ADD COLUMN message_ids TEXT",
+        "ALTER TABLE posts ADD COLUMN media_list TEXT",
+        "ALTER TABLE posts ADD COLUMN parse_mode TEXT",
+        "ALTER TABLE posts ADD COLUMN status TEXT DEFAULT 'published'",
+        "ALTER TABLE posts ADD COLUMN edited_at REAL",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_posts_message ON posts (channel_id, message_id)",
+    ]),
+    # 6. Очередь исходящих уведомлений (outbox): хендлер только пишет строку, отправляет фоновая задача
+    # dedupe_key — одно ожидающее уведомление на пару (канал, получатель): повторное событие
+    # заменяет текст, а не добавляет второе сообщение; status: pending -> failed (отправленные удаляются)
+    (6, [
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dedupe_key TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            queued_at REAL,
+            next_attempt_at REAL,
+            attempts INTEGER DEFAULT 0,
+            status TEXT DEFAULT 'pending',
+            error TEXT
+        )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_outbox_dedupe ON outbox (dedupe_key) WHERE status = 'pending'",
+        "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)",
+    ]),
+    # 7. Несколько ботов в одном процессе: каналы, права, посты и уведомления принадлежат боту.
+    # Первичный ключ в SQLite не меняется через ALTER, поэтому channels и permissions пересоздаются.
+    # Старые строки получают bot_id = 0 и при запуске достаются первому боту (claim_legacy_rows)
+    (7, [
+        "ALTER TABLE permissions RENAME TO permissions_old",
+        "ALTER TABLE channels RENAME TO channels_old",
+        """
+        CREATE TABLE channels (
+            bot_id INTEGER NOT NULL DEFAULT 0,
+            channel_id TEXT NOT NULL,
+            title TEXT,
+            PRIMARY KEY (bot_id, channel_id)
+        )
+        """,
+        "INSERT INTO channels (bot_id, channel_id, title) SELECT 0, channel_id, title FROM channels_old",
+        """
+        CREATE TABLE permissions (
+            bot_id INTEGER NOT NULL DEFAULT 0,
+            user_id INTEGER,
+            channel_id TEXT,
+            is_owner INTEGER DEFAULT 0,
+            PRIMARY KEY (bot_id, user_id, channel_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
+            FOREIGN KEY (bot_id, channel_id) REFERENCES channels (bot_id, channel_id)
+                ON DELETE CASCADE ON UPDATE CASCADE
+        )
+        """,
+        "INSERT INTO permissions (bot_id, user_id, channel_id, is_owner) "
+        "SELECT 0, user_id, channel_id, is_owner FROM permissions_old",
+        "DROP TABLE permissions_old",
+        "DROP TABLE channels_old",
+        # Те же покрывающие индексы, что в версии 2, с ботом в начале ключа
+        "CREATE INDEX IF NOT EXISTS idx_permissions_user_role ON permissions (bot_id, user_id, is_owner, channel_id)",
+        "CREATE INDEX IF NOT EXISTS idx_permissions_channel_role ON permissions (bot_id, channel_id, is_owner, user_id)",
+        "ALTER TABLE scheduled_posts ADD COLUMN bot_id INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE posts ADD COLUMN bot_id INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE outbox ADD COLUMN bot_id INTEGER NOT NULL DEFAULT 0",
+    ]),
+    # 8. Медиатека: файлы, которые пользователь уже присылал боту.
+    # file_unique_id одинаков у одного и того же файла, сколько его ни присылай, —
+    # по нему повтор находится без второй записи. file_id действует только для бота,
+    # который его получил, поэтому библиотека своя у каждого бота
+    (8, [
+        """
+        CREATE TABLE IF NOT EXISTS media_library (
+            bot_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            file_unique_id TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            media_type TEXT NOT NULL,
+            file_size INTEGER,
+            duration INTEGER,
+            title TEXT,
+            used_at REAL,
+            PRIMARY KEY (bot_id, user_id, file_unique_id)
+        )
+        """,
+        # Выбор из медиатеки: последние использованные файлы пользователя
+        "CREATE INDEX IF NOT EXISTS idx_media_library_recent ON media_library (bot_id, user_id, used_at)",
+    ]),
+    # 9. Кэш загрузок с сервера: sha256 содержимого -> file_id, который вернул Telegram.
+    # Повторная отправка того же файла (с диска или по URL) идет по file_id, без загрузки
+    (9, [
+        """
+        CREATE TABLE IF NOT EXISTS upload_cache (
+            bot_id INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            media_type TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            file_size INTEGER,
+            uploaded_at REAL,
+            PRIMARY KEY (bot_id, sha256, media_type)
+        )
+        """,
+    ]),
+    # 10. Массовый импорт: посты из файла не присылают автору сообщение о каждой публикации
+    (10, [
+        "ALTER TABLE scheduled_posts ADD COLUMN notify INTEGER NOT NULL DEFAULT 1",
+    ]),
+    # 11. Время захвата поста планировщиком: пост, который остался в 'sending' дольше
+    # SCHEDULER_CLAIM_TIMEOUT (процесс упал или перезапущен посреди публикации), возвращается в очередь
+    (11, [
+        "ALTER TABLE scheduled_posts ADD COLUMN claimed_at REAL",
+    ]),
+]
+
+# Бот, от имени которого идут запросы к каналам, правам и постам.
+# Задается на время обработки обновления (utils/multibot.py) и в фоновых задачах;
+# 0 — данные, еще не закрепленные ни за одним ботом (и режим без ботов, например бенчмарки)
+_current_bot = contextvars.ContextVar("db_bot_id", default=0)
+
+# Сколько самых свежих совпадений поиск ранжирует по релевантности
+SEARCH_CANDIDATES = 5000
+
+# Разметка, которую не нужно индексировать: теги и сущности
+_TAG_RE = re.compile(r"<[^>]*>")
+
+
+def _unicode_lower(value):
+    """lower() для SQLite с поддержкой кириллицы (встроенный работает только с ASCII)"""
+    return value.casefold() if isinstance(value, str) else value
+
+
+def _strip_html(text, is_html):
+    """Видимый текст поста для поискового индекса"""
+    if not text:
+        return ""
+    return html.unescape(_TAG_RE.sub("", text)) if is_html else text
+
+
+def _fts_query(text):
+    """
+    Запрос пользователя -> запрос FTS5: все слова обязательны,
+    последнее ищется по префиксу. Кавычки снимают спецсинтаксис FTS (OR, NEAR, * и т.д.)
+    """
+    words = re.findall(r"\w+", text)[:10]
+    if not words:
+        return ""
+    # По префиксу ищется только последнее слово (пользователь мог его не дописать)
+    return " ".join([f'"{w}"' for w in words[:-1]] + [f'"{words[-1]}"*'])
+
+
+def _snippet(text, words, size=12):
+    """
+    Фрагмент текста вокруг первого совпадения: ~size слов,
+    найденные слова обрамлены символами \x02 и \x03 (как в snippet() FTS5)
+    """
+    tokens = text.split()
+    hits = [i for i, token in enumerate(tokens) if any(w in token.casefold() for w in words)]
+    start = max(0, hits[0] - size // 3) if hits else 0
+    window = tokens[start:start + size]
+    hit_set = set(hits)
+    parts = [f"\x02{token}\x03" if start + i in hit_set else token for i, token in enumerate(window)]
+    return ("…" if start > 0 else "") + " ".join(parts) + ("…" if start + size < len(tokens) else "")
+
+
+_TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE)\s+(\w+)", re.IGNORECASE)
+
+
+@lru_cache(maxsize=512)
+def _query_label(query):
+    """Метка запроса для метрик: команда и таблица (SELECT permissions), без параметров"""
+    words = query.split(None, 1)
+    table = _TABLE_RE.search(query)
+    return f"{words[0].upper() if words else '?'} {table.group(1) if table else ''}".strip()
+
+
+def _func_label(func):
+    # Database.search.<locals>._search -> search
+    return func.__qualname__.split(".<locals>")[0].rsplit(".", 1)[-1]
 
 
 class Database:
-    def __init__(self, db_name=DB_PATH):
+    """
+    Асинхронный слой доступа к SQLite.
+
+    Все запросы выполняются в отдельных потоках, поэтому event loop aiogram
+    никогда не блокируется на диске:
+    * одно соединение на запись (отдельный поток-писатель, транзакции по очереди);
+    * небольшой пул соединений на чтение (WAL позволяет читать параллельно с записью).
+    """
+
+    def __init__(self, db_name=DB_PATH, read_pool_size=DB_READ_POOL_SIZE):
         # Создаем папку для базы, если её нет
         if os.path.dirname(db_name):
             os.makedirs(os.path.dirname(db_name), exist_ok=True)
 
-        self.conn = sqlite3.connect(db_name, check_same_thread=False)
-        self.cursor = self.conn.cursor()
+        self.db_name = db_name
+
+        # Поток-писатель: все изменения идут строго по одному
+        self._write_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+        # Пул читателей: у каждого потока свое соединение (threading.local)
+        self._read_executor = ThreadPoolExecutor(max_workers=read_pool_size, thread_name_prefix="db-reader")
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+
+        self.conn = self._connect()
+        # WAL: читатели не блокируют писателя и наоборот
+        self.conn.execute("PRAGMA journal_mode = WAL;")
+        self.create_table()
+
+    def _connect(self):
+        """Открытие соединения с общими настройками"""
+        # isolation_level=None — транзакциями управляем сами (BEGIN/COMMIT)
+        conn = sqlite3.connect(self.db_name, check_same_thread=False, isolation_level=None, timeout=30)
         # Включаем поддержку внешних ключей (Foreign Keys)
         # Это критически важно для корректной работы CASCADE DELETE
-        self.cursor.execute("PRAGMA foreign_keys = ON;")
-        self.create_table()
+        conn.execute("PRAGMA foreign_keys = ON;")
+        # В режиме WAL NORMAL безопасен и избавляет от fsync на каждый коммит
+        conn.execute("PRAGMA synchronous = NORMAL;")
+        conn.create_function("unicode_lower", 1, _unicode_lower, deterministic=True)
+        conn.create_function("strip_html", 2, _strip_html, deterministic=True)
+        return conn
 
-    def create_table(self):
-        """Создание структуры базы данных (Many-to-Many)"""
+    def _reader(self):
+        """Соединение на чтение для текущего потока пула"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._connect()
+            conn.execute("PRAGMA query_only = ON;")
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
 
-        # 1. Таблица каналов
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS channels (
-                channel_id TEXT PRIMARY KEY,
-                title TEXT
-            )
-        """)
+    # --- БАЗОВЫЕ ОПЕРАЦИИ ---
 
-        # 2. Таблица пользователей (админов и владельцев)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT
-            )
-        """)
+    def _run_read(self, func, args):
+        started = time.perf_counter()
+        return func(self._reader(), *args), started
 
-        # 3. Промежуточная таблица разрешений (Permissions)
-        # Связывает пользователей и каналы + хранит роль (Владелец/Админ)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS permissions (
-                user_id INTEGER,
-                channel_id TEXT,
-                is_owner INTEGER DEFAULT 0,
-                PRIMARY KEY (user_id, channel_id),
-                FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE,
-                FOREIGN KEY (channel_id) REFERENCES channels (channel_id) ON DELETE CASCADE
-            )
-        """)
-        self.conn.commit()
+    def _run_write(self, func, args):
+        started = time.perf_counter()
+        # BEGIN IMMEDIATE сразу берет блокировку на запись:
+        # транзакция либо целиком проходит, либо целиком откатывается
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = func(self.conn, *args)
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+        return result, started
 
-    def sync_channel_admins(self, channel_id, title, admins_list):
+    async def _run(self, executor, runner, mode, func, args, label):
+        """
+        Запуск в потоке с замером: ожидание свободного потока и само выполнение.
+        Поток возвращает момент начала работы, а метрики пишутся уже в event loop.
         """
-        Полная синхронизация прав доступа для конкретного канала.
+        queued = time.perf_counter()
+        result, started = await asyncio.get_running_loop().run_in_executor(executor, runner, func, args)
+        finished = time.perf_counter()
+        DB_WAIT.observe(started - queued, mode)
+        DB_DURATION.observe(finished - started, mode, label or _func_label(func))
+        return result
+
+    async def read(self, func, *args, label=None):
+        """Выполнение func(conn, *args) на соединении из пула читателей"""
+        return await self._run(self._read_executor, self._run_read, "read", func, args, label)
+
+    async def transaction(self, func, *args, label=None):
+        """Выполнение func(conn, *args) в одной транзакции на соединении писателя"""
+        return await self._run(self._write_executor, self._run_write, "write", func, args, label)
+
+    async def fetchone(self, query, params=()):
+        return await self.read(lambda conn: conn.execute(query, params).fetchone(), label=_query_label(query))
+
+    async def fetchall(self, query, params=()):
+        return await self.read(lambda conn: conn.execute(query, params).fetchall(), label=_query_label(query))
+
+    async def execute(self, query, params=()):
+        return await self.transaction(lambda conn: conn.execute(query, params).rowcount, label=_query_label(query))
+
+    async def executemany(self, query, seq_of_params):
+        return await self.transaction(lambda conn: conn.executemany(query, seq_of_params).rowcount,
+                                      label=_query_label(query))
+
+    # --- БОТЫ ---
+
+    @staticmethod
+    @contextmanager
+    def bot_scope(bot_id):
+        """Все запросы внутри блока — от имени бота: with db.bot_scope(bot.id): ..."""
+        token = _current_bot.set(bot_id)
+        try:
+            yield
+        finally:
+            _current_bot.reset(token)
+
+    @staticmethod
+    def current_bot_id():
+        return _current_bot.get()
+
+    async def claim_legacy_rows(self, bot_id):
+        """
+        Данные, созданные до поддержки нескольких ботов (bot_id = 0), переходят к боту.
+        Права переезжают вместе с каналами (ON UPDATE CASCADE).
+        """
+        def _claim(conn):
+            claimed = conn.execute("UPDATE channels SET bot_id = ? WHERE bot_id = 0", (bot_id,)).rowcount
+            for table in ("scheduled_posts", "posts", "outbox"):
+                conn.execute(f"UPDATE {table} SET bot_id = ? WHERE bot_id = 0", (bot_id,))
+            return claimed
+
+        return await self.transaction(_claim)
+
+    def close(self):
+        """Остановка потоков и закрытие всех соединений"""
+        self._write_executor.shutdown(wait=True)
+        self._read_executor.shutdown(wait=True)
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers.clear()
+        self.conn.close()
+
+    # --- СХЕМА ---
+
+    def create_table(self):
+        """
+        Создание и обновление структуры базы данных (Many-to-Many).
+        Версия схемы хранится в PRAGMA user_version, каждая миграция из MIGRATIONS
+        применяется ровно один раз и в своей транзакции.
+        """
+        current = self.conn.execute("PRAGMA user_version").fetchone()[0]
+
+        for version, statements in MIGRATIONS:
+            if version <= current:
+                continue
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql in statements:
+                    self.conn.execute(sql)
+                # PRAGMA не поддерживает параметры, версия — наша константа
+                self.conn.execute(f"PRAGMA user_version = {version}")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    # --- КАНАЛЫ И ПРАВА ---
+
+    async def sync_channel_admins(self, channel_id, title, admins_list):
+        """
+        Синхронизация прав доступа для конкретного канала.
         admins_list: список словарей {'id': int, 'username': str, 'is_owner': bool}
+
+        Сравнивает сохраненных админов с актуальным списком и применяет только разницу
+        (новые, удаленные, смена роли) пакетными запросами в одной транзакции.
+        Возвращает сводку: {'added': [user_id], 'removed': [user_id], 'role_changed': [user_id]}
         """
-        # 1. Обновляем информацию о канале
-        self.cursor.execute(
-            "INSERT OR REPLACE INTO channels (channel_id, title) VALUES (?, ?)",
-            (str(channel_id), title)
-        )
+        cid = str(channel_id)
+        bot_id = _current_bot.get()
+        incoming = {
+            admin['id']: (admin.get('username', 'Unknown'), 1 if admin['is_owner'] else 0)
+            for admin in admins_list
+        }
 
-        # 2. Очищаем старые связи ТОЛЬКО для этого канала
-        self.cursor.execute("DELETE FROM permissions WHERE channel_id = ?", (str(channel_id),))
+        def _sync(conn):
+            # 1. Обновляем информацию о канале
+            # UPSERT, а не INSERT OR REPLACE: REPLACE удалил бы строку канала
+            # и через ON DELETE CASCADE — все его права
+            conn.execute("""
+                INSERT INTO channels (bot_id, channel_id, title) VALUES (?, ?, ?)
+                ON CONFLICT(bot_id, channel_id) DO UPDATE SET title=excluded.title
+                WHERE title IS NOT excluded.title
+            """, (bot_id, cid, title))
 
-        # 3. Добавляем админов и создаем новые связи
-        for admin in admins_list:
-            uid = admin['id']
-            username = admin.get('username', 'Unknown')
-            is_owner = 1 if admin['is_owner'] else 0
+            # 2. Текущее состояние прав в БД (читаем внутри той же транзакции)
+            stored = dict(conn.execute(
+                "SELECT user_id, is_owner FROM permissions WHERE bot_id = ? AND channel_id = ?", (bot_id, cid)
+            ).fetchall())
 
-            # Используем UPSERT (INSERT ... ON CONFLICT).
-            # Это предотвращает удаление юзера при обновлении (REPLACE = DELETE + INSERT).
-            # Благодаря этому ON DELETE CASCADE для этого юзера НЕ срабатывает,
-            # и его связи с ДРУГИМИ каналами остаются целыми.
-            self.cursor.execute("""
+            added = [uid for uid in incoming if uid not in stored]
+            removed = [uid for uid in stored if uid not in incoming]
+            role_changed = [uid for uid in incoming if uid in stored and stored[uid] != incoming[uid][1]]
+
+            # 3. Пользователи: UPSERT (а не REPLACE), чтобы ON DELETE CASCADE не снес
+            # связи юзера с ДРУГИМИ каналами. Имя переписываем, только если оно изменилось
+            conn.executemany("""
                 INSERT INTO users (user_id, username) VALUES (?, ?)
                 ON CONFLICT(user_id) DO UPDATE SET username=excluded.username
-            """, (uid, username))
+                WHERE username IS NOT excluded.username
+            """, [(uid, username) for uid, (username, _) in incoming.items()])
 
-            # Создаем связь между пользователем и текущим каналом
-            self.cursor.execute(
-                "INSERT INTO permissions (user_id, channel_id, is_owner) VALUES (?, ?, ?)",
-                (uid, str(channel_id), is_owner)
+            # 4. Применяем только разницу
+            conn.executemany(
+                "INSERT INTO permissions (bot_id, user_id, channel_id, is_owner) VALUES (?, ?, ?, ?)",
+                [(bot_id, uid, cid, incoming[uid][1]) for uid in added]
+            )
+            conn.executemany(
+                "UPDATE permissions SET is_owner = ? WHERE bot_id = ? AND user_id = ? AND channel_id = ?",
+                [(incoming[uid][1], bot_id, uid, cid) for uid in role_changed]
+            )
+            conn.executemany(
+                "DELETE FROM permissions WHERE bot_id = ? AND user_id = ? AND channel_id = ?",
+                [(bot_id, uid, cid) for uid in removed]
             )
 
-        self.conn.commit()
+            return {'added': added, 'removed': removed, 'role_changed': role_changed}
 
-    def get_user_channels(self, user_id, role="admin"):
+        return await self.transaction(_sync)
+
+    async def get_all_channels(self):
+        """Все каналы бота: список (channel_id, title)"""
+        return await self.fetchall("SELECT channel_id, title FROM channels WHERE bot_id = ?", (_current_bot.get(),))
+
+    async def get_user_channels(self, user_id, role="admin"):
         """
         Получение списка каналов пользователя по его роли.
         role="owner" -> каналы, где пользователь создатель (is_owner=1)
         role="admin" -> каналы, где пользователь наемный админ (is_owner=0)
         """
         query = """
-            SELECT c.title, c.channel_id 
+            SELECT c.title, c.channel_id
             FROM channels c
-            JOIN permissions p ON c.channel_id = p.channel_id
-            WHERE p.user_id = ?
+            JOIN permissions p ON c.bot_id = p.bot_id AND c.channel_id = p.channel_id
+            WHERE p.bot_id = ? AND p.user_id = ?
         """
 
         if role == "owner":
@@ -104,45 +583,505 @@ class Database:
         else:
             query += " AND p.is_owner = 0"
 
-        self.cursor.execute(query, (user_id,))
-        return self.cursor.fetchall()
+        return await self.fetchall(query, (_current_bot.get(), user_id))
 
-    def is_user_owner(self, user_id, channel_id):
+    async def get_user_channels_page(self, user_id, role="admin", after=None, limit=CHANNELS_PAGE_SIZE,
+                                     prefix=None):
+        """
+        Страница каналов пользователя по роли (keyset-пагинация по (title, channel_id)).
+        role=None — каналы с любой ролью (рассылка).
+        after: (title, channel_id) последнего канала предыдущей страницы или None для первой.
+        prefix: поиск по началу названия без учета регистра.
+        Возвращает (список (title, channel_id), есть_ли_следующая_страница).
+        """
+        query = """
+            SELECT c.title, c.channel_id
+            FROM permissions p
+            JOIN channels c ON c.bot_id = p.bot_id AND c.channel_id = p.channel_id
+            WHERE p.bot_id = ? AND p.user_id = ?
+        """
+        params = [_current_bot.get(), user_id]
+        if role:
+            query += " AND p.is_owner = ?"
+            params.append(1 if role == "owner" else 0)
+
+        if prefix:
+            prefix = prefix.casefold()
+            query += " AND substr(unicode_lower(c.title), 1, ?) = ?"
+            params += [len(prefix), prefix]
+
+        if after:
+            # Сравнение кортежей: строго после последней строки прошлой страницы
+            query += " AND (unicode_lower(c.title), c.channel_id) > (?, ?)"
+            params += [_unicode_lower(after[0]), str(after[1])]
+
+        # Сортировка по алфавиту без учета регистра.
+        # Берем на одну строку больше, чтобы понять, есть ли следующая страница
+        query += " ORDER BY unicode_lower(c.title), c.channel_id LIMIT ?"
+        params.append(limit + 1)
+
+        rows = await self.fetchall(query, params)
+        return rows[:limit], len(rows) > limit
+
+    async def get_user_channel_ids(self, user_id):
+        """id всех каналов пользователя с любой ролью (только индекс прав, без названий)"""
+        rows = await self.fetchall(
+            "SELECT channel_id FROM permissions WHERE bot_id = ? AND user_id = ?", (_current_bot.get(), user_id)
+        )
+        return [row[0] for row in rows]
+
+    async def is_user_owner(self, user_id, channel_id):
         """Проверка, является ли пользователь владельцем канала в БД"""
-        self.cursor.execute(
-            "SELECT is_owner FROM permissions WHERE user_id = ? AND channel_id = ?",
-            (user_id, str(channel_id))
+        res = await self.fetchone(
+            "SELECT is_owner FROM permissions WHERE bot_id = ? AND user_id = ? AND channel_id = ?",
+            (_current_bot.get(), user_id, str(channel_id))
         )
-        res = self.cursor.fetchone()
         return bool(res[0]) if res else False
 
-    def remove_user_permission(self, user_id, channel_id):
+    async def remove_user_permission(self, user_id, channel_id):
         """Лишение пользователя прав на конкретный канал в боте"""
-        self.cursor.execute(
-            "DELETE FROM permissions WHERE user_id = ? AND channel_id = ?",
-            (user_id, str(channel_id))
+        await self.execute(
+            "DELETE FROM permissions WHERE bot_id = ? AND user_id = ? AND channel_id = ?",
+            (_current_bot.get(), user_id, str(channel_id))
         )
-        self.conn.commit()
 
-    def delete_channel(self, channel_id):
+    async def delete_channel(self, channel_id):
         """Полное удаление канала и всех его связей из базы"""
-        self.cursor.execute("DELETE FROM channels WHERE channel_id = ?", (str(channel_id),))
-        self.conn.commit()
+        await self.execute("DELETE FROM channels WHERE bot_id = ? AND channel_id = ?",
+                           (_current_bot.get(), str(channel_id)))
 
-    def get_channel_title(self, channel_id):
+    async def get_channel_title(self, channel_id):
         """Получение названия канала по его ID"""
-        self.cursor.execute("SELECT title FROM channels WHERE channel_id = ?", (str(channel_id),))
-        result = self.cursor.fetchone()
+        result = await self.fetchone("SELECT title FROM channels WHERE bot_id = ? AND channel_id = ?",
+                                     (_current_bot.get(), str(channel_id)))
         return result[0] if result else "Неизвестный канал"
 
-    def get_channel_owner_id(self, channel_id):
+    async def get_channel_owner_id(self, channel_id):
         """Возвращает user_id владельца канала (где is_owner=1)"""
-        self.cursor.execute(
-            "SELECT user_id FROM permissions WHERE channel_id = ? AND is_owner = 1",
-            (str(channel_id),)
+        res = await self.fetchone(
+            "SELECT user_id FROM permissions WHERE bot_id = ? AND channel_id = ? AND is_owner = 1",
+            (_current_bot.get(), str(channel_id))
+        )
+        return res[0] if res else None
+
+
+    async def get_user_channel(self, user_id, channel_id):
+        """Название канала и роль пользователя в нем одним запросом: (title, is_owner)"""
+        res = await self.fetchone("""
+            SELECT c.title, p.is_owner
+            FROM channels c
+            LEFT JOIN permissions p ON p.bot_id = c.bot_id AND p.channel_id = c.channel_id AND p.user_id = ?
+            WHERE c.bot_id = ? AND c.channel_id = ?
+        """, (user_id, _current_bot.get(), str(channel_id)))
+        if not res:
+            return "Неизвестный канал", False
+        return res[0], bool(res[1])
+
+    async def has_permission(self, user_id, channel_id):
+        """Есть ли у пользователя хоть какая-то роль в канале"""
+        res = await self.fetchone(
+            "SELECT 1 FROM permissions WHERE bot_id = ? AND user_id = ? AND channel_id = ?",
+            (_current_bot.get(), user_id, str(channel_id))
+        )
+        return res is not None
+
+    # --- ОТЛОЖЕННЫЕ ПОСТЫ ---
+
+    async def add_scheduled_posts(self, user_id, channel_ids, post_text, is_html, media_list, publish_at):
+        """Создание отложенного поста для каждого канала. Возвращает список id"""
+
+        bot_id = _current_bot.get()
+
+        def _insert(conn):
+            ids = []
+            media_json = json.dumps(media_list or [])
+            for cid in channel_ids:
+                cur = conn.execute(
+                    "INSERT INTO scheduled_posts (bot_id, user_id, channel_id, post_text, is_html, media_list, "
+                    "publish_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (bot_id, user_id, str(cid), post_text, 1 if is_html else 0, media_json, publish_at)
+                )
+                ids.append(cur.lastrowid)
+            return ids
+
+        return await self.transaction(_insert)
+
+    async def add_imported_posts(self, rows):
+        """
+        Пакетная вставка постов из файла импорта (от имени текущего бота, без уведомлений автору).
+        rows: список (user_id, channel_id, post_text, is_html, media_list, publish_at)
+        """
+        bot_id = _current_bot.get()
+        await self.executemany(
+            "INSERT INTO scheduled_posts (bot_id, user_id, channel_id, post_text, is_html, media_list, "
+            "publish_at, notify) VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+            [(bot_id, user_id, str(cid), text, 1 if is_html else 0, json.dumps(media or []), publish_at)
+             for user_id, cid, text, is_html, media, publish_at in rows]
+        )
+
+    async def get_pending_scheduled_posts(self, after_id=0):
+        """Ожидающие посты с id больше after_id: список (publish_at, id) для очереди планировщика"""
+        return await self.fetchall(
+            "SELECT publish_at, id FROM scheduled_posts WHERE status = 'pending' AND id > ?", (after_id,)
+        )
+
+    async def get_scheduled_post(self, post_id):
+        """Полные данные отложенного поста (словарь) или None"""
+        row = await self.fetchone(
+            "SELECT id, user_id, channel_id, post_text, is_html, media_list, publish_at, status, bot_id, notify "
+            "FROM scheduled_posts WHERE id = ?",
+            (post_id,)
+        )
+        if not row:
+            return None
+        return {
+            'id': row[0],
+            'user_id': row[1],
+            'channel_id': row[2],
+            'post_text': row[3],
+            'is_html': bool(row[4]),
+            'media_list': json.loads(row[5] or "[]"),
+            'publish_at': row[6],
+            'status': row[7],
+            'bot_id': row[8],
+            'notify': bool(row[9]),
+        }
+
+    async def claim_scheduled_post(self, post_id):
+        """
+        Захват поста перед публикацией (pending -> sending).
+        Если планировщиков несколько (процессы кластера), пост достается только одному.
+        """
+        return await self.execute(
+            "UPDATE scheduled_posts SET status = 'sending', claimed_at = ? WHERE id = ? AND status = 'pending'",
+            (time.time(), post_id)
+        ) == 1
+
+    async def release_stale_claims(self, older_than):
+        """
+        Возврат в очередь постов, захваченных раньше older_than и так и не получивших итоговый статус
+        (процесс упал посреди публикации). Захваты без времени — из версий до миграции 11 — тоже старые.
+        Возвращает список (publish_at, id) возвращенных постов.
+        """
+
+        def _release(conn):
+            rows = conn.execute(
+                "SELECT publish_at, id FROM scheduled_posts "
+                "WHERE status = 'sending' AND (claimed_at IS NULL OR claimed_at < ?)", (older_than,)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE scheduled_posts SET status = 'pending', claimed_at = NULL WHERE id = ? AND status = 'sending'",
+                [(post_id,) for _, post_id in rows]
+            )
+            return rows
+
+        return await self.transaction(_release)
+
+    async def set_scheduled_post_status(self, post_id, status, error=None):
+        """Отметка результата публикации отложенного поста"""
+        await self.execute(
+            "UPDATE scheduled_posts SET status = ?, error = ? WHERE id = ?",
+            (status, error, post_id)
+        )
+
+    # --- ШАБЛОНЫ ---
+
+    async def save_template(self, user_id, name, body):
+        """Сохранение шаблона (с тем же именем — перезапись). Возвращает id"""
+
+        def _save(conn):
+            conn.execute("""
+                INSERT INTO templates (user_id, name, body, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id, name) DO UPDATE SET body=excluded.body, updated_at=excluded.updated_at
+            """, (user_id, name, body, time.time()))
+            return conn.execute(
+                "SELECT id FROM templates WHERE user_id = ? AND name = ?", (user_id, name)
+            ).fetchone()[0]
+
+        return await self.transaction(_save)
+
+    async def get_user_templates(self, user_id, limit=TEMPLATES_PER_USER):
+        """Шаблоны пользователя: список (id, name) по алфавиту"""
+        return await self.fetchall(
+            "SELECT id, name FROM templates WHERE user_id = ? ORDER BY unicode_lower(name), id LIMIT ?",
+            (user_id, limit)
+        )
+
+    async def count_user_templates(self, user_id):
+        """Сколько шаблонов в библиотеке пользователя (для лимита TEMPLATES_PER_USER)"""
+        res = await self.fetchone("SELECT COUNT(*) FROM templates WHERE user_id = ?", (user_id,))
+        return res[0]
+
+    async def get_template(self, user_id, template_id):
+        """(name, body) шаблона пользователя или None"""
+        return await self.fetchone(
+            "SELECT name, body FROM templates WHERE id = ? AND user_id = ?", (template_id, user_id)
+        )
+
+    async def delete_template(self, user_id, template_id):
+        return await self.execute(
+            "DELETE FROM templates WHERE id = ? AND user_id = ?", (template_id, user_id)
+        )
+
+    # --- МЕДИАТЕКА ---
+
+    async def save_media(self, user_id, items, limit=MEDIA_LIBRARY_PER_USER):
+        """
+        Запись файлов в медиатеку пользователя (от имени текущего бота).
+        items: список словарей {'uid', 'id', 'type', 'size', 'duration', 'title'}.
+        Файл, который уже есть (тот же file_unique_id), не дублируется — у него обновляются
+        file_id и время использования. Сверх limit удаляются давно не использованные.
+        Возвращает, сколько файлов уже было в медиатеке.
+        """
+        bot_id = _current_bot.get()
+
+        def _save(conn):
+            uids = [item['uid'] for item in items]
+            known = conn.execute(
+                "SELECT COUNT(*) FROM media_library WHERE bot_id = ? AND user_id = ? AND file_unique_id IN ({})"
+                .format(",".join("?" * len(uids))), (bot_id, user_id, *uids)
+            ).fetchone()[0]
+            now = time.time()
+            conn.executemany("""
+                INSERT INTO media_library (bot_id, user_id, file_unique_id, file_id, media_type, file_size,
+                                           duration, title, used_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(bot_id, user_id, file_unique_id) DO UPDATE SET
+                    file_id=excluded.file_id, used_at=excluded.used_at
+            """, [(bot_id, user_id, item['uid'], item['id'], item['type'], item.get('size'),
+                   item.get('duration'), item.get('title'), now) for item in items])
+            conn.execute("""
+                DELETE FROM media_library WHERE rowid IN (
+                    SELECT rowid FROM media_library WHERE bot_id = ? AND user_id = ?
+                    ORDER BY used_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (bot_id, user_id, limit))
+            return known
+
+        if not items:
+            return 0
+        return await self.transaction(_save)
+
+    async def get_user_media(self, user_id, media_types, limit=MEDIA_LIBRARY_PAGE_SIZE):
+        """Файлы медиатеки нужных типов, недавние первыми: список (file_unique_id, type, size, duration, title)"""
+        return await self.fetchall(
+            "SELECT file_unique_id, media_type, file_size, duration, title FROM media_library "
+            "WHERE bot_id = ? AND user_id = ? AND media_type IN ({}) ORDER BY used_at DESC LIMIT ?"
+            .format(",".join("?" * len(media_types))),
+            (_current_bot.get(), user_id, *media_types, limit)
+        )
+
+    async def get_media(self, user_id, file_unique_id):
+        """(file_id, type) файла из медиатеки или None"""
+        return await self.fetchone(
+            "SELECT file_id, media_type FROM media_library WHERE bot_id = ? AND user_id = ? AND file_unique_id = ?",
+            (_current_bot.get(), user_id, file_unique_id)
+        )
+
+    async def touch_media(self, user_id, file_unique_id):
+        """Файл снова взят в пост: поднимается в начало списка медиатеки"""
+        await self.execute(
+            "UPDATE media_library SET used_at = ? WHERE bot_id = ? AND user_id = ? AND file_unique_id = ?",
+            (time.time(), _current_bot.get(), user_id, file_unique_id)
+        )
+
+    async def delete_media(self, user_id, file_unique_id):
+        return await self.execute(
+            "DELETE FROM media_library WHERE bot_id = ? AND user_id = ? AND file_unique_id = ?",
+            (_current_bot.get(), user_id, file_unique_id)
+        )
+
+    # --- КЭШ ЗАГРУЗОК ---
+
+    async def get_uploaded_file(self, sha256, media_type):
+        """file_id уже загруженного файла с таким содержимым (от имени текущего бота) или None"""
+        res = await self.fetchone(
+            "SELECT file_id FROM upload_cache WHERE bot_id = ? AND sha256 = ? AND media_type = ?",
+            (_current_bot.get(), sha256, media_type)
         )
-        res = self.cursor.fetchone()
         return res[0] if res else None
 
+    async def save_uploaded_files(self, files):
+        """files: список (sha256, media_type, file_id, file_size) после успешной загрузки"""
+        bot_id, now = _current_bot.get(), time.time()
+        await self.executemany("""
+            INSERT OR REPLACE INTO upload_cache (bot_id, sha256, media_type, file_id, file_size, uploaded_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(bot_id, *file, now) for file in files])
+
+    # --- ИСТОРИЯ ПУБЛИКАЦИЙ И ПОИСК ---
+
+    async def add_posts(self, posts):
+        """
+        Пакетная запись опубликованных постов в архив (индекс поиска обновит триггер).
+        posts: список словарей {'bot_id', 'user_id', 'channel_id', 'message_ids', 'post_text',
+        'is_html', 'media_list', 'parse_mode', 'published_at', 'status'}
+        """
+        await self.executemany("""
+            INSERT OR IGNORE INTO posts (bot_id, user_id, channel_id, message_id, message_ids, post_text, is_html,
+                                         media_list, parse_mode, published_at, status)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (p.get('bot_id', 0), p['user_id'], str(p['channel_id']), p['message_ids'][0], json.dumps(p['message_ids']),
+             p['post_text'], 1 if p['is_html'] else 0, json.dumps(p['media_list'] or []), p['parse_mode'],
+             p['published_at'], p.get('status', "published"))
+            for p in posts
+        ])
+
+    async def get_post(self, channel_id, message_id):
+        """Пост из архива (словарь в формате add_posts + 'status') или None"""
+        row = await self.fetchone("""
+            SELECT user_id, channel_id, message_ids, post_text, is_html, media_list, parse_mode, published_at, status
+            FROM posts WHERE bot_id = ? AND channel_id = ? AND message_id = ?
+        """, (_current_bot.get(), str(channel_id), message_id))
+        if not row:
+            return None
+        return {
+            'user_id': row[0],
+            'channel_id': row[1],
+            'message_ids': json.loads(row[2] or "[]"),
+            'post_text': row[3],
+            'is_html': bool(row[4]),
+            'media_list': json.loads(row[5] or "[]"),
+            'parse_mode': row[6],
+            'published_at': row[7],
+            'status': row[8],
+        }
+
+    async def update_post(self, channel_id, message_id, **fields):
+        """Изменение полей поста в архиве (post_text, is_html, parse_mode, status)"""
+        if 'is_html' in fields:
+            fields['is_html'] = 1 if fields['is_html'] else 0
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        return await self.execute(
+            f"UPDATE posts SET {columns}, edited_at = ? WHERE bot_id = ? AND channel_id = ? AND message_id = ?",
+            (*fields.values(), time.time(), _current_bot.get(), str(channel_id), message_id)
+        )
+
+    async def search(self, user_id, text, offset=0, limit=SEARCH_PAGE_SIZE):
+        """
+        Поиск по своим шаблонам и по постам в каналах, где у пользователя есть права.
+        Возвращает (rows, has_more), rows: (kind, id, title, snippet, published_at, channel_id, message_id),
+        kind — 'template' или 'post'; в snippet совпадения обрамлены символами \x02 и \x03.
+        """
+        query = _fts_query(text)
+        if not query:
+            return [], False
+        words = [w.casefold() for w in re.findall(r"\w+", text)[:10]]
+        bot_id = _current_bot.get()
+
+        def _search(conn):
+            # Обе стадии в одной транзакции чтения: иначе шаблон или пост, удаленный
+            # между ранжированием и выборкой подписей, пропал бы из details
+            conn.execute("BEGIN")
+            try:
+                return _search_snapshot(conn)
+            finally:
+                conn.execute("COMMIT")
+
+        def _search_snapshot(conn):
+            # 1. Ранжирование: только id и bm25, без построения фрагментов
+            ranked = conn.execute("""
+                SELECT 'template' AS kind, t.id, bm25(templates_fts, 5.0, 1.0) AS rank
+                FROM templates_fts JOIN templates t ON t.id = templates_fts.rowid
+                WHERE templates_fts MATCH ? AND t.user_id = ?
+                UNION ALL
+                SELECT * FROM (
+                    -- Ранжируем только SEARCH_CANDIDATES самых свежих совпадений:
+                    -- FTS5 отдает строки по убыванию rowid потоком, так что частые слова
+                    -- не заставляют считать bm25 по всей истории
+                    SELECT 'post', p.id, bm25(posts_fts)
+                    FROM posts_fts
+                    JOIN posts p ON p.id = posts_fts.rowid
+                    JOIN permissions pr ON pr.bot_id = p.bot_id AND pr.channel_id = p.channel_id AND pr.user_id = ?
+                    WHERE posts_fts MATCH ? AND p.status = 'published' AND p.bot_id = ?
+                    ORDER BY posts_fts.rowid DESC
+                    LIMIT ?
+                )
+                ORDER BY rank
+                LIMIT ? OFFSET ?
+            """, (query, user_id, user_id, query, bot_id, SEARCH_CANDIDATES, limit + 1, offset)).fetchall()
+            page = ranked[:limit]
+
+            # 2. Подписи и фрагменты — только для строк текущей страницы.
+            # Обычный SELECT по id: повторный MATCH с rowid IN FTS5 выполняет заново для каждого id
+            details = {}
+            for kind, sql in (
+                ("template", "SELECT id, name, strip_html(body, 1), NULL, NULL, NULL FROM templates WHERE id IN ({})"),
+                ("post", """
+                    SELECT p.id, c.title, strip_html(p.post_text, p.is_html), p.published_at, p.channel_id, p.message_id
+                    FROM posts p LEFT JOIN channels c ON c.bot_id = p.bot_id AND c.channel_id = p.channel_id
+                    WHERE p.id IN ({})
+                """),
+            ):
+                ids = [row_id for row_kind, row_id, _ in page if row_kind == kind]
+                if ids:
+                    rows = conn.execute(sql.format(",".join("?" * len(ids))), ids).fetchall()
+                    details.update({(kind, row[0]): (row[1], _snippet(row[2], words), *row[3:]) for row in rows})
+
+            result = [(kind, row_id, *details[(kind, row_id)]) for kind, row_id, _ in page]
+            return result, len(ranked) > limit
+
+        return await self.read(_search)
+
+    # --- ИСХОДЯЩИЕ УВЕДОМЛЕНИЯ (OUTBOX) ---
+
+    async def enqueue_notifications(self, items, delay=0):
+        """
+        Постановка уведомлений в очередь: items — список (dedupe_key, user_id, text).
+        Если по ключу уже ждет уведомление, оно заменяется новым текстом (дедупликация).
+        """
+        now = time.time()
+        bot_id = _current_bot.get()
+        return await self.executemany("""
+            INSERT INTO outbox (bot_id, dedupe_key, user_id, text, queued_at, next_attempt_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(dedupe_key) WHERE status = 'pending' DO UPDATE SET
+                bot_id = excluded.bot_id, user_id = excluded.user_id, text = excluded.text,
+                queued_at = excluded.queued_at, next_attempt_at = excluded.next_attempt_at, attempts = 0, error = NULL
+        """, [(bot_id, key, user_id, text, now, now + delay) for key, user_id, text in items])
+
+    async def get_due_notifications(self, now, limit):
+        """Уведомления всех ботов, которые пора отправить: список (id, bot_id, user_id, text, attempts, queued_at)"""
+        return await self.fetchall("""
+            SELECT id, bot_id, user_id, text, attempts, queued_at FROM outbox
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY next_attempt_at LIMIT ?
+        """, (now, limit))
+
+    async def get_next_notification_time(self):
+        """Время ближайшей отправки или None, если очередь пуста"""
+        res = await self.fetchone("SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending'")
+        return res[0] if res else None
+
+    async def count_pending_notifications(self):
+        res = await self.fetchone("SELECT COUNT(*) FROM outbox WHERE status = 'pending'")
+        return res[0]
+
+    async def complete_notification(self, notification_id, queued_at):
+        """
+        Удаление отправленного уведомления.
+        Если пока шла отправка текст заменили (новое событие), строка остается и уйдет еще раз.
+        """
+        await self.execute("DELETE FROM outbox WHERE id = ? AND queued_at = ?", (notification_id, queued_at))
+
+    async def retry_notification(self, notification_id, queued_at, next_attempt_at, error):
+        """
+        Перенос неудачной отправки на next_attempt_at.
+        Замененный за время отправки текст не наследует ни попытку, ни задержку.
+        """
+        await self.execute(
+            "UPDATE outbox SET attempts = attempts + 1, next_attempt_at = ?, error = ? WHERE id = ? AND queued_at = ?",
+            (next_attempt_at, error, notification_id, queued_at)
+        )
+
+    async def fail_notification(self, notification_id, queued_at, error):
+        """Окончательная ошибка отправки; замененный за это время текст остается в очереди"""
+        await self.execute(
+            "UPDATE outbox SET status = 'failed', attempts = attempts + 1, error = ? "
+            "WHERE id = ? AND queued_at = ?",
+            (error, notification_id, queued_at)
+        )
+
 
-db = Database()
\ No newline at end of file
+db = Database()
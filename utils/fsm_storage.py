@@ -0,0 +1,200 @@
+import asyncio
+import copy
+import json
+import logging
+import time
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType, DefaultKeyBuilder
+
+from config import FSM_TTL, FSM_FLUSH_INTERVAL, FSM_STORAGE
+from utils.db import db
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище FSM в таблице fsm_sessions той же базы SQLite.
+
+    * Чтение — из кэша в памяти (сессия подгружается из БД при первом обращении).
+    * Запись — отложенная: изменения копятся в памяти и раз в flush_interval
+      секунд уходят в БД одной транзакцией (а не fsync на каждый update_data).
+    * Сессии, к которым не обращались дольше ttl секунд, удаляются и из памяти, и из БД.
+    """
+
+    def __init__(self, database=db, ttl=FSM_TTL, flush_interval=FSM_FLUSH_INTERVAL):
+        self.db = database
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+
+        # key -> {'state': str | None, 'data': dict, 'touched': float, 'saved': float}
+        # touched — последнее обращение, saved — время, записанное в БД (updated_at)
+        self._cache: Dict[str, Dict[str, Any]] = {}
+        self._dirty = set()
+        self._task = None
+
+    async def start(self):
+        """Запуск фоновой задачи сброса изменений и очистки старых сессий"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._background())
+
+    async def _background(self):
+        last_evict = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                # Очистка раз в минуту, этого с запасом хватает для TTL в часах
+                if time.monotonic() - last_evict >= 60:
+                    await self.evict_expired()
+                    last_evict = time.monotonic()
+            except Exception as e:
+                logging.exception(f"Ошибка сохранения FSM-сессий: {e}")
+
+    # --- КЭШ ---
+
+    async def _entry(self, key: StorageKey):
+        k = self.key_builder.build(key)
+        entry = self._cache.get(k)
+        if entry is None:
+            row = await self.db.fetchone("SELECT state, data, updated_at FROM fsm_sessions WHERE key = ?", (k,))
+            # Пока шел запрос, сессию мог создать параллельный хендлер
+            entry = self._cache.get(k)
+            if entry is None:
+                entry = {
+                    'state': row[0] if row else None,
+                    'data': json.loads(row[1]) if row and row[1] else {},
+                    'touched': time.time(),
+                    'saved': row[2] if row else 0.0,
+                }
+                self._cache[k] = entry
+        entry['touched'] = time.time()
+        return k, entry
+
+    # --- ИНТЕРФЕЙС BaseStorage ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k, entry = await self._entry(key)
+        entry['state'] = state.state if isinstance(state, State) else state
+        self._dirty.add(k)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        _, entry = await self._entry(key)
+        return entry['state']
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise TypeError(f"Data must be a dict, not {type(data).__name__}")
+        k, entry = await self._entry(key)
+        entry['data'] = copy.deepcopy(data)
+        self._dirty.add(k)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, entry = await self._entry(key)
+        return copy.deepcopy(entry['data'])
+
+    async def close(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    # --- СОХРАНЕНИЕ И ОЧИСТКА ---
+
+    async def flush(self):
+        """Сброс всех накопленных изменений в БД одной транзакцией"""
+        if not self._dirty:
+            return
+
+        keys, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for k in keys:
+            entry = self._cache.get(k)
+            if entry is None:
+                continue
+            if entry['state'] is None and not entry['data']:
+                # Пустая сессия (после state.clear()) — хранить нечего
+                deletes.append((k,))
+                self._cache.pop(k, None)
+            else:
+                entry['saved'] = entry['touched']
+                upserts.append((k, entry['state'], json.dumps(entry['data'], ensure_ascii=False), entry['saved']))
+
+        def _write(conn):
+            if upserts:
+                conn.executemany("""
+                    INSERT INTO fsm_sessions (key, state, data, updated_at) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET
+                        state=excluded.state, data=excluded.data, updated_at=excluded.updated_at
+                """, upserts)
+            if deletes:
+                conn.executemany("DELETE FROM fsm_sessions WHERE key = ?", deletes)
+
+        try:
+            await self.db.transaction(_write)
+        except Exception:
+            # Не теряем изменения: попробуем снова при следующем сбросе
+            self._dirty |= keys
+            raise
+
+    async def evict_expired(self):
+        """Удаление сессий, простаивающих дольше TTL. Возвращает количество удаленных из памяти"""
+        deadline = time.time() - self.ttl
+        expired = [k for k, entry in self._cache.items() if entry['touched'] < deadline]
+        for k in expired:
+            self._cache.pop(k, None)
+            self._dirty.discard(k)
+
+        # Живые сессии, которые только читались, в БД выглядят устаревшими —
+        # сначала обновляем их updated_at, чтобы не удалить вместе с мертвыми
+        for k, entry in self._cache.items():
+            if entry['saved'] < deadline and (entry['state'] is not None or entry['data']):
+                self._dirty.add(k)
+        await self.flush()
+
+        await self.db.execute("DELETE FROM fsm_sessions WHERE updated_at < ?", (deadline,))
+        return len(expired)
+
+    def session_count(self):
+        """Сессий в памяти — O(1), для метрик (stats() обходит и сериализует все сессии)"""
+        return len(self._cache)
+
+    def dirty_count(self):
+        """Сессий, ждущих записи на диск — O(1), для метрик"""
+        return len(self._dirty)
+
+    def stats(self):
+        """Количество сессий в памяти и примерный объем их данных (байт JSON) — для /stats"""
+        approx_bytes = 0
+        for k, entry in self._cache.items():
+            approx_bytes += len(k) + len(entry['state'] or "")
+            approx_bytes += len(json.dumps(entry['data'], ensure_ascii=False).encode())
+        return {
+            'backend': "sqlite",
+            'sessions': len(self._cache),
+            'dirty': len(self._dirty),
+            'approx_bytes': approx_bytes,
+        }
+
+
+def create_storage():
+    """
+    Хранилище FSM по настройке FSM_STORAGE.
+    sqlite — кэш в памяти процесса (достаточно, пока пользователь всегда попадает в один процесс),
+    redis — общее для всех процессов кластера (пакет redis подключается только в этом случае).
+    """
+    if FSM_STORAGE == "redis":
+        try:
+            from utils.redis_state import RedisFSMStorage, create_redis
+        except ImportError:
+            exit("Ошибка: для FSM_STORAGE=redis установите пакет redis (pip install redis)")
+        return RedisFSMStorage(create_redis())
+    return SQLiteStorage()
+
+
+storage = create_storage()
@@ -0,0 +1,326 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod, GetUpdates, SendMediaGroup
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import ChatFullInfo, Message
+
+from config import GOVERNOR_GLOBAL_RATE, GOVERNOR_CHANNEL_RATE, GOVERNOR_MAX_RETRIES
+
+# Приоритеты очереди (меньше — раньше)
+PRIORITY_HIGH = 0    # Ответы пользователю в личке (кнопки, подсказки)
+PRIORITY_NORMAL = 1  # Обычные публикации в каналы
+PRIORITY_BULK = 2    # Массовые операции (рассылки, фоновые задачи)
+
+# Приоритет, заданный вызывающим кодом (наследуется задачами asyncio)
+_priority_override = contextvars.ContextVar("governor_priority", default=None)
+
+# Методы, которые не проходят через лимиты (long polling должен работать всегда)
+EXEMPT_METHODS = (GetUpdates,)
+
+# Лимит Telegram на личный чат: ~1 сообщение в секунду с небольшим запасом на пачку
+PRIVATE_CHAT_RATE = 1.0
+PRIVATE_CHAT_BURST = 3
+
+
+class TokenBucket:
+    """Классическое ведро токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now):
+        if now <= self.updated:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now, cost=1):
+        """Через сколько секунд можно будет списать cost токенов (0 — уже можно)"""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        cost = min(cost, self.capacity)
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def consume(self, now, cost=1):
+        self._refill(now)
+        self.tokens -= min(cost, self.capacity)
+
+    def pause(self, seconds, now):
+        """Полная блокировка ведра (после 429 от Telegram): после паузы доступен ровно 1 запрос"""
+        self.blocked_until = max(self.blocked_until, now + seconds)
+        self.tokens = min(1, self.capacity)
+        self.updated = self.blocked_until
+
+    def is_idle(self, now):
+        return now >= self.blocked_until and self.wait_time(now, self.capacity) == 0
+
+
+class SendGovernor(BaseRequestMiddleware):
+    """
+    Централизованный регулятор исходящих запросов к Bot API.
+
+    * Глобальное ведро (~30 запросов/сек на бота).
+    * Ведро на каждый чат: ~20 сообщений/мин для каналов и групп, ~1/сек для личек.
+      Чат, указанный как "@name", "-100..." или числом, попадает в одно ведро.
+    * Очередь с приоритетами: ответы пользователям обгоняют массовые рассылки.
+    * TelegramRetryAfter (429) не пробрасывается сразу: ведро ставится на паузу,
+      запрос возвращается в очередь и повторяется с нарастающей задержкой.
+      Пауза ставится на ведро чата запроса; глобальное ведро — только для запросов без чата.
+    """
+
+    def __init__(self, global_rate=GOVERNOR_GLOBAL_RATE, channel_rate=GOVERNOR_CHANNEL_RATE,
+                 max_retries=GOVERNOR_MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.channel_rate = channel_rate  # сообщений в минуту
+        self.max_retries = max_retries
+        self.chat_buckets = {}
+        self.chat_aliases = {}  # "@name" -> числовой id, узнаем из ответов Telegram
+
+        self._queue = []
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._pump_task = None
+
+        self._in_flight = 0
+        self._sent = 0
+        self._delayed = 0
+        self._retries = 0
+        self._failed_429 = 0
+
+    # --- ПРИОРИТЕТЫ ---
+
+    @staticmethod
+    @contextmanager
+    def priority(value):
+        """Задать приоритет всем запросам внутри блока: with governor.priority(PRIORITY_BULK): ..."""
+        token = _priority_override.set(value)
+        try:
+            yield
+        finally:
+            _priority_override.reset(token)
+
+    @staticmethod
+    def _resolve_priority(chat_id):
+        override = _priority_override.get()
+        if override is not None:
+            return override
+        # Личка (положительный id) или запрос без чата (answer_callback_query и т.п.)
+        if chat_id is None or (isinstance(chat_id, int) and chat_id > 0):
+            return PRIORITY_HIGH
+        return PRIORITY_NORMAL
+
+    # --- ВЕДРА ---
+
+    @staticmethod
+    def _is_message_method(method):
+        """Методы, создающие сообщения в чате (на них действуют лимиты чата)"""
+        name = type(method).__name__
+        return name.startswith(("Send", "Copy", "Forward"))
+
+    @staticmethod
+    def _cost(method):
+        # Альбом — это несколько сообщений
+        if isinstance(method, SendMediaGroup):
+            return len(method.media)
+        return 1
+
+    @staticmethod
+    def _chat_key(chat_id):
+        """Единый ключ чата: "-100123" и -100123 — один чат, "@Name" и "@name" — тоже"""
+        if isinstance(chat_id, str):
+            chat_id = chat_id.strip()
+            if chat_id.lstrip("-").isdigit():
+                return int(chat_id)
+            return chat_id.lower()
+        return chat_id
+
+    def _learn_alias(self, alias, result):
+        """
+        Запрос шел на "@name": по ответу узнаем числовой id канала и дальше считаем
+        лимит в его ведре. Накопленное под "@name" переносится туда же
+        """
+        chats = [item.chat if isinstance(item, Message) else item
+                 for item in (result if isinstance(result, list) else [result])
+                 if isinstance(item, (Message, ChatFullInfo))]
+        if not chats:
+            return
+        chat_id = chats[0].id
+        self.chat_aliases[alias] = chat_id
+        alias_bucket = self.chat_buckets.pop(alias, None)
+        if alias_bucket is None:
+            return
+        bucket = self.chat_buckets.setdefault(chat_id, alias_bucket)
+        if bucket is not alias_bucket:
+            now = time.monotonic()
+            bucket._refill(now)
+            alias_bucket._refill(now)
+            bucket.tokens = min(bucket.tokens, alias_bucket.tokens)
+            bucket.blocked_until = max(bucket.blocked_until, alias_bucket.blocked_until)
+
+    def _chat_bucket(self, chat_id):
+        chat_id = self.chat_aliases.get(chat_id, chat_id)
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = TokenBucket(PRIVATE_CHAT_RATE, PRIVATE_CHAT_BURST)
+            else:
+                bucket = TokenBucket(self.channel_rate / 60, self.channel_rate)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _forget_idle_chats(self, now):
+        """Ведра, которые полностью восстановились, можно не хранить"""
+        if len(self.chat_buckets) < 10000:
+            return
+        waiting = {self.chat_aliases.get(entry[2], entry[2]) for entry in self._queue}
+        for chat_id in [c for c, b in self.chat_buckets.items() if c not in waiting and b.is_idle(now)]:
+            del self.chat_buckets[chat_id]
+
+    # --- ОЧЕРЕДЬ ---
+
+    async def acquire(self, chat_id, cost=1, priority=PRIORITY_NORMAL):
+        """
+        Дождаться своей очереди и разрешения обоих ведер (глобального и чата).
+        cost=0 — запрос не создает сообщений: ждет только паузы чата после 429
+        """
+        now = time.monotonic()
+        chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+
+        # Быстрый путь: очереди нет и лимиты свободны
+        if not self._queue and self.global_bucket.wait_time(now) == 0 and (
+                chat_bucket is None or chat_bucket.wait_time(now, cost) == 0):
+            self.global_bucket.consume(now)
+            if chat_bucket:
+                chat_bucket.consume(now, cost)
+            return
+
+        self._delayed += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._seq), chat_id, cost, future))
+        self._wakeup.set()
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        """Выдача разрешений ожидающим запросам в порядке приоритета"""
+        while self._queue:
+            now = time.monotonic()
+            self._forget_idle_chats(now)
+            next_wait = None
+            remaining = []
+
+            for entry in sorted(self._queue):
+                _, _, chat_id, cost, future = entry
+                if future.done():  # Запрос отменили, пока он ждал
+                    continue
+
+                global_wait = self.global_bucket.wait_time(now)
+                chat_bucket = self._chat_bucket(chat_id) if chat_id is not None else None
+                chat_wait = chat_bucket.wait_time(now, cost) if chat_bucket else 0.0
+                wait = max(global_wait, chat_wait)
+
+                if wait > 0:
+                    remaining.append(entry)
+                    next_wait = wait if next_wait is None else min(next_wait, wait)
+                    continue
+
+                self.global_bucket.consume(now)
+                if chat_bucket:
+                    chat_bucket.consume(now, cost)
+                future.set_result(None)
+
+            heapq.heapify(remaining)
+            self._queue = remaining
+            if not self._queue:
+                break
+
+            # Спим до освобождения ближайшего ведра или до прихода нового запроса
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=next_wait)
+            except asyncio.TimeoutError:
+                pass
+
+    # --- MIDDLEWARE ---
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        if isinstance(method, EXEMPT_METHODS):
+            return await make_request(bot, method)
+
+        # Запросы в чат без новых сообщений (getChatAdministrators, editMessageText...)
+        # не тратят лимит чата, но ждут его паузы после 429
+        chat_id = self._chat_key(getattr(method, "chat_id", None))
+        priority = self._resolve_priority(chat_id)
+        cost = self._cost(method) if self._is_message_method(method) else 0
+
+        attempt = 0
+        while True:
+            await self.acquire(chat_id, cost, priority)
+            self._in_flight += 1
+            try:
+                response = await make_request(bot, method)
+                self._sent += 1
+                if isinstance(chat_id, str) and chat_id not in self.chat_aliases:
+                    self._learn_alias(chat_id, response.result)
+                return response
+            except TelegramRetryAfter as e:
+                if attempt >= self.max_retries:
+                    self._failed_429 += 1
+                    raise
+                attempt += 1
+                self._retries += 1
+                # Ждем столько, сколько попросил Telegram, плюс нарастающий запас
+                delay = e.retry_after + 0.5 * (2 ** (attempt - 1))
+                bucket = self._chat_bucket(chat_id) if chat_id is not None else self.global_bucket
+                bucket.pause(delay, time.monotonic())
+                logging.warning(
+                    f"Flood control на {type(method).__name__} (чат {chat_id}): "
+                    f"пауза {delay:.1f} с, попытка {attempt}/{self.max_retries}"
+                )
+            finally:
+                self._in_flight -= 1
+
+    # --- СТАТИСТИКА ---
+
+    def stats(self):
+        """Снимок состояния очереди для мониторинга"""
+        by_priority = {PRIORITY_HIGH: 0, PRIORITY_NORMAL: 0, PRIORITY_BULK: 0}
+        for priority, *_ in self._queue:
+            by_priority[priority] = by_priority.get(priority, 0) + 1
+        return {
+            'queued': len(self._queue),
+            'queued_high': by_priority[PRIORITY_HIGH],
+            'queued_normal': by_priority[PRIORITY_NORMAL],
+            'queued_bulk': by_priority[PRIORITY_BULK],
+            'in_flight': self._in_flight,
+            'sent': self._sent,
+            'delayed': self._delayed,
+            'retries': self._retries,
+            'failed_429': self._failed_429,
+            'chats_tracked': len(self.chat_buckets),
+        }
+
+
+governor = SendGovernor()
@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager, nullcontext
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import LANE_MAX_QUEUE, LANE_CONCURRENCY
+
+
+class _Lane:
+    """Очередь одного пользователя: замок (asyncio.Lock будит ожидающих по порядку) и глубина"""
+    __slots__ = ("lock", "depth")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0  # Сколько обновлений в очереди, включая выполняющееся
+
+
+class UpdateLanes(BaseMiddleware):
+    """
+    Упорядоченная обработка обновлений по пользователям ("полосы").
+
+    aiogram обрабатывает обновления параллельно, и два быстрых нажатия одного
+    пользователя могут одновременно читать и перезаписывать одни и те же данные FSM.
+    Здесь обновления одного пользователя выполняются строго по очереди,
+    а разные пользователи — параллельно, но не больше concurrency хендлеров сразу.
+
+    * В очереди одного пользователя не больше max_queue обновлений,
+      лишние отбрасываются (обычно это залипшая кнопка или флуд).
+    * Обновления без пользователя (посты каналов) идут без очереди.
+    * remote_locks (например, RedisUserLocks) дополнительно блокирует пользователя
+      между процессами кластера — когда сессии FSM общие.
+    """
+
+    def __init__(self, max_queue=LANE_MAX_QUEUE, concurrency=LANE_CONCURRENCY, remote_locks=None):
+        self.max_queue = max(1, max_queue)
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._lanes = {}  # user_id -> _Lane
+        self.remote_locks = remote_locks
+
+        # Метрики
+        self.processed = 0
+        self.dropped = 0
+        self.in_flight = 0
+        self.max_depth = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        lane = self._lanes.get(user.id)
+        if lane is not None and lane.depth >= self.max_queue:
+            self.dropped += 1
+            logging.warning(f"Очередь пользователя {user.id} переполнена, обновление пропущено")
+            await self._reject(event)
+            return None
+
+        async with self.lane(user.id):
+            return await handler(event, data)
+
+    @asynccontextmanager
+    async def lane(self, user_id):
+        """
+        Выполнение блока в очереди пользователя.
+        Используется и вне диспетчера — например, при сборке альбома,
+        которая меняет черновик уже после ответа хендлера.
+        """
+        lane = self._lanes.get(user_id)
+        if lane is None:
+            lane = self._lanes[user_id] = _Lane()
+        lane.depth += 1
+        self.max_depth = max(self.max_depth, lane.depth)
+
+        queued_at = time.monotonic()
+        try:
+            async with lane.lock, self._remote_lock(user_id):
+                # Глобальный лимит берем уже в своей очереди, чтобы ожидающие не занимали слоты
+                async with self._semaphore:
+                    waited = time.monotonic() - queued_at
+                    self.wait_total += waited
+                    self.wait_max = max(self.wait_max, waited)
+                    self.in_flight += 1
+                    try:
+                        yield
+                    finally:
+                        self.in_flight -= 1
+                        self.processed += 1
+        finally:
+            lane.depth -= 1
+            if lane.depth == 0:
+                self._lanes.pop(user_id, None)
+
+    def _remote_lock(self, user_id):
+        return self.remote_locks(user_id) if self.remote_locks else nullcontext()
+
+    @staticmethod
+    async def _reject(event):
+        # Убираем "часики" с кнопки, чтобы пользователь не жал ее снова
+        if isinstance(event, Update) and event.callback_query:
+            try:
+                await event.callback_query.answer("⏳ Слишком много действий, подождите...")
+            except Exception:
+                pass
+
+    def stats(self):
+        depths = [lane.depth for lane in self._lanes.values()]
+        return {
+            'lanes': len(depths),
+            'queued': max(0, sum(depths) - self.in_flight),
+            'deepest': max(depths, default=0),
+            'in_flight': self.in_flight,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'max_depth': self.max_depth,
+            'wait_avg': self.wait_total / self.processed if self.processed else 0.0,
+            'wait_max': self.wait_max,
+        }
+
+
+update_lanes = UpdateLanes()
@@ -0,0 +1,237 @@
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Awaitable, Callable, Dict
+
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.exceptions import TelegramRetryAfter, TelegramAPIError
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import TelegramObject
+
+from config import METRICS_HOST, METRICS_PORT
+
+# Границы корзин гистограмм (секунды): от долей миллисекунды (SQLite) до десятков секунд (long polling)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, le=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if le is not None:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Счетчик с метками: inc(значения меток...)"""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}  # (значения меток) -> число
+
+    def inc(self, *label_values, amount=1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for values, total in sorted(self._values.items()):
+            lines.append(f"{self.name}_total{_format_labels(self.labels, values)} {total}")
+        return lines
+
+
+class Histogram:
+    """
+    Гистограмма с метками в формате Prometheus.
+
+    observe() — это поиск корзины (bisect) и три сложения, без блокировок:
+    все замеры делаются в потоке event loop.
+    """
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._series = {}  # (значения меток) -> [счетчики корзин..., сумма, количество]
+
+    def observe(self, value, *label_values):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+        # Счетчики храним по корзинам, накопительные суммы считаем только при выгрузке
+        index = bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            series[index] += 1
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for values, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, bound)} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labels, values, '+Inf')} {series[-1]}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, values)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, values)} {series[-1]}")
+        return lines
+
+
+class Registry:
+    """Набор метрик и выгрузка в текстовом формате Prometheus (/metrics)"""
+
+    def __init__(self):
+        self._metrics = []
+        self._gauges = []  # (имя, описание, функция) — значение считывается в момент выгрузки
+
+    def counter(self, name, documentation, labels=()):
+        metric = Counter(name, documentation, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name, documentation, func):
+        """Текущее значение из чужой статистики (например, governor.stats()['queued'])"""
+        self._gauges.append((name, documentation, func))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for name, documentation, func in self._gauges:
+            try:
+                value = func()
+            except Exception as e:
+                logging.warning(f"Метрика {name} недоступна: {e}")
+                continue
+            lines += [f"# HELP {name} {documentation}", f"# TYPE {name} gauge", f"{name} {value}"]
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+UPDATE_DURATION = registry.histogram(
+    "bot_update_duration_seconds", "Полное время обработки обновления (с ожиданием в очереди пользователя)",
+    ("type", "status"))
+HANDLER_DURATION = registry.histogram(
+    "bot_handler_duration_seconds", "Время работы хендлера", ("handler", "status"))
+API_DURATION = registry.histogram(
+    "bot_api_request_duration_seconds", "Время одного HTTP-запроса к Bot API", ("method", "status"))
+API_RETRY_AFTER = registry.counter(
+    "bot_api_retry_after", "Ответы 429 (Flood control) от Bot API", ("method",))
+DB_DURATION = registry.histogram(
+    "bot_db_query_duration_seconds", "Время выполнения запроса SQLite в потоке", ("mode", "query"))
+DB_WAIT = registry.histogram(
+    "bot_db_wait_seconds", "Ожидание свободного потока SQLite", ("mode",))
+
+
+# --- ХЕНДЛЕРЫ ---
+
+class UpdateMetrics(BaseMiddleware):
+    """
+    Замеры диспетчера.
+
+    * Как внешний middleware обновлений (dp.update.outer_middleware) — полное время
+      обновления по типу (message, callback_query, ...).
+    * Как внутренний middleware событий (dp.message.middleware и т.п.) — время
+      конкретного хендлера: там aiogram уже знает, какой хендлер выбран.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        handler_object = data.get("handler")
+        status = "error"
+        started = time.perf_counter()
+        try:
+            result = await handler(event, data)
+            status = "unhandled" if result is UNHANDLED else "ok"
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            if handler_object is not None:
+                HANDLER_DURATION.observe(elapsed, handler_object.callback.__name__, status)
+            else:
+                UPDATE_DURATION.observe(elapsed, getattr(event, "event_type", type(event).__name__), status)
+
+    def setup(self, dp):
+        """Подключение к диспетчеру: обновления целиком и каждый тип событий"""
+        dp.update.outer_middleware(self)
+        for name, observer in dp.observers.items():
+            if name not in ("update", "error"):
+                observer.middleware(self)
+
+
+update_metrics = UpdateMetrics()
+
+
+# --- ЗАПРОСЫ К TELEGRAM ---
+
+class ApiMetrics(BaseRequestMiddleware):
+    """
+    Время каждого запроса к Bot API.
+    Подключается после регулятора лимитов, поэтому замеряется сам HTTP-запрос
+    (каждая попытка отдельно), а не ожидание в очереди регулятора.
+    """
+
+    async def __call__(
+        self,
+        make_request: NextRequestMiddlewareType[TelegramType],
+        bot: Bot,
+        method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        name = type(method).__name__
+        status = "error"
+        started = time.perf_counter()
+        try:
+            response = await make_request(bot, method)
+            status = "ok"
+            return response
+        except TelegramRetryAfter:
+            status = "retry_after"
+            API_RETRY_AFTER.inc(name)
+            raise
+        except TelegramAPIError as e:
+            status = type(e).__name__
+            raise
+        finally:
+            API_DURATION.observe(time.perf_counter() - started, name, status)
+
+
+api_metrics = ApiMetrics()
+
+
+# --- HTTP ---
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Эндпоинт /metrics для Prometheus. Возвращает runner (для cleanup) или None, если порт не задан"""
+    if not port:
+        return None
+
+    async def handle(request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logging.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,67 @@
+from typing import Any, Awaitable, Callable, Dict, List
+
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.enums import ParseMode
+from aiogram.types import TelegramObject
+
+from config import BOT_API_URL
+from utils.db import db
+from utils.governor import governor, SendGovernor
+from utils.metrics import api_metrics
+
+# bot_id -> регулятор лимитов этого бота (лимиты Telegram считаются на каждый токен отдельно)
+_governors = {}
+
+
+class BotScope(BaseMiddleware):
+    """
+    Несколько ботов в одном процессе: каждое обновление обрабатывается
+    от имени бота, который его получил (db.bot_scope).
+    Каналы, права, посты и уведомления одного бота не видны другим,
+    а сессии FSM и так разделены по bot_id (DefaultKeyBuilder(with_bot_id=True)).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        with db.bot_scope(data["bot"].id):
+            return await handler(event, data)
+
+
+bot_scope = BotScope()
+
+
+def create_bots(tokens) -> List[Bot]:
+    """
+    Боты по списку токенов (BOT_TOKENS).
+    Первый работает через общий регулятор governor (его показывает /stats),
+    остальные получают свой: лимиты Telegram у каждого токена отдельные.
+    """
+    bots = []
+    for index, token in enumerate(tokens):
+        # Свой сервер Bot API (BOT_API_URL) — через отдельную сессию, иначе стандартная
+        session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL)) if BOT_API_URL else None
+        # DefaultBotProperties: все сообщения бота по умолчанию поддерживают HTML-разметку
+        bot = Bot(token=token, session=session, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+        bot_governor = governor if index == 0 else SendGovernor()
+        # Все запросы к Telegram проходят через регулятор лимитов (очередь + 429)
+        bot.session.middleware(bot_governor)
+        # Замер каждого HTTP-запроса к Bot API (после регулятора — без ожидания в его очереди)
+        bot.session.middleware(api_metrics)
+        _governors[bot.id] = bot_governor
+        bots.append(bot)
+    return bots
+
+
+def governor_for(bot: Bot) -> SendGovernor:
+    return _governors.get(bot.id, governor)
+
+
+def all_governors() -> List[SendGovernor]:
+    return list(_governors.values()) or [governor]
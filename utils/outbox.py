@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import random
+import time
+from typing import List
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
+
+from config import OUTBOX_CONCURRENCY, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_DELAY, OUTBOX_DEDUPE_WINDOW
+from utils.db import db
+from utils.governor import governor, PRIORITY_BULK
+
+# Сколько уведомлений забирать из таблицы за один проход
+FETCH_LIMIT = 100
+# Потолок паузы между повторами (секунды)
+MAX_RETRY_DELAY = 600
+
+
+class Outbox:
+    """
+    Очередь исходящих уведомлений (таблица outbox).
+
+    Хендлеры событий канала только записывают уведомления и сразу возвращаются,
+    а фоновая задача отправляет их:
+    * параллельно (не больше concurrency), через регулятор лимитов с низким приоритетом;
+    * с повтором при временных ошибках (пауза растет вдвое, со случайным разбросом);
+    * с дедупликацией: уведомление ждет dedupe_window секунд, и повторное событие
+      того же канала за это время заменяет текст, а не добавляет второе сообщение.
+    Очередь в БД переживает перезапуск бота. Уведомление отправляет тот бот,
+    от имени которого оно поставлено (db.bot_scope).
+    """
+
+    def __init__(self, database=db, concurrency=OUTBOX_CONCURRENCY, max_attempts=OUTBOX_MAX_ATTEMPTS,
+                 retry_delay=OUTBOX_RETRY_DELAY, dedupe_window=OUTBOX_DEDUPE_WINDOW, poll_interval=None):
+        self.db = database
+        # Проверять таблицу не реже раза в poll_interval секунд: нужно, когда уведомления
+        # ставят другие процессы кластера и _wakeup этого процесса о них не знает
+        self.poll_interval = poll_interval
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        self.dedupe_window = dedupe_window
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._inflight = {}  # id уведомления -> задача отправки
+        self.bots = {}  # bot_id -> Bot
+
+        self.enqueued = 0
+        self.sent = 0
+        self.retries = 0
+        self.failed = 0
+
+    async def notify(self, items):
+        """Постановка уведомлений от имени текущего бота: items — список (dedupe_key, user_id, text)"""
+        if not items:
+            return
+        await self.db.enqueue_notifications(items, delay=self.dedupe_window)
+        self.enqueued += len(items)
+        self._wakeup.set()
+
+    # --- ФОНОВАЯ ОТПРАВКА ---
+
+    async def start(self, bots: List[Bot]):
+        self.bots = {bot.id: bot for bot in bots}
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Начатые отправки доводим до конца, остальное дождется следующего запуска в БД
+        if self._inflight:
+            await asyncio.gather(*self._inflight.values(), return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await self._dispatch_due()
+                delay = await self._next_delay()
+            except Exception as e:
+                logging.exception(f"Ошибка очереди уведомлений: {e}")
+                delay = self.retry_delay
+            if self.poll_interval:
+                delay = self.poll_interval if delay is None else min(delay, self.poll_interval)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch_due(self):
+        rows = await self.db.get_due_notifications(time.time(), FETCH_LIMIT + len(self._inflight))
+        for row in rows:
+            if row[0] in self._inflight:
+                continue
+            task = asyncio.create_task(self._send(*row))
+            self._inflight[row[0]] = task
+            task.add_done_callback(lambda done, nid=row[0]: self._on_done(nid, done))
+
+    def _on_done(self, notification_id, task):
+        self._inflight.pop(notification_id, None)
+        if not task.cancelled() and task.exception():
+            # Ошибка БД при отметке результата: строка осталась pending и будет отправлена снова
+            logging.error(f"Ошибка обработки уведомления {notification_id}", exc_info=task.exception())
+        # Освободилось место: возможно, в таблице ждут еще уведомления
+        self._wakeup.set()
+
+    async def _next_delay(self):
+        """Сколько спать до ближайшего уведомления (None — до нового события)"""
+        next_at = await self.db.get_next_notification_time()
+        if next_at is None:
+            return None
+        delay = next_at - time.time()
+        # Все созревшие уведомления уже отправляются: проснемся, когда освободится место
+        if delay <= 0:
+            return None if self._inflight else 0.05
+        return delay
+
+    async def _send(self, notification_id, bot_id, user_id, text, attempts, queued_at):
+        bot = self.bots.get(bot_id)
+        if bot is None:
+            # Токен бота убрали из BOT_TOKENS: отправить уведомление некому
+            self.failed += 1
+            await self.db.fail_notification(notification_id, queued_at, f"бот {bot_id} не запущен")
+            return
+
+        async with self._semaphore:
+            try:
+                with governor.priority(PRIORITY_BULK):
+                    await bot.send_message(user_id, text, disable_web_page_preview=True)
+            except (TelegramForbiddenError, TelegramBadRequest) as e:
+                # Пользователь не запускал бота или заблокировал его — повтор не поможет
+                self.failed += 1
+                await self.db.fail_notification(notification_id, queued_at, str(e))
+                logging.info(f"Уведомление {notification_id} для {user_id} не доставлено: {e}")
+                return
+            except Exception as e:
+                if attempts + 1 >= self.max_attempts:
+                    self.failed += 1
+                    await self.db.fail_notification(notification_id, queued_at, str(e))
+                    logging.warning(f"Уведомление {notification_id} для {user_id} не доставлено "
+                                    f"после {attempts + 1} попыток: {e}")
+                    return
+                delay = min(MAX_RETRY_DELAY, self.retry_delay * 2 ** attempts) * random.uniform(0.8, 1.2)
+                self.retries += 1
+                await self.db.retry_notification(notification_id, queued_at, time.time() + delay, str(e))
+                return
+
+            self.sent += 1
+            await self.db.complete_notification(notification_id, queued_at)
+
+    def stats(self):
+        return {
+            'in_flight': len(self._inflight),
+            'enqueued': self.enqueued,
+            'sent': self.sent,
+            'retries': self.retries,
+            'failed': self.failed,
+        }
+
+
+outbox = Outbox()
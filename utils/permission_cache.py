@@ -0,0 +1,80 @@
+import time
+
+from config import PERMISSION_CACHE_TTL, PERMISSION_CACHE_NEGATIVE_TTL
+from utils.db import db
+
+# Сколько записей держать, прежде чем вычищать просроченные
+MAX_ENTRIES = 50000
+
+
+class PermissionCache:
+    """
+    Кэш результатов живой проверки прав (get_chat_member) по ключу (user_id, channel_id).
+    У каждого бота свои записи (бот берется из db.current_bot_id()): проверка через
+    одного бота ничего не говорит о канале, куда добавлен другой.
+
+    * Положительный ответ ("allowed") живет ttl секунд.
+    * Отрицательный ("revoked") — negative_ttl секунд: повторные нажатия
+      на канал без прав не дергают API каждый раз.
+    * Записи канала сбрасываются целиком при my_chat_member и "Обновить админов".
+    """
+
+    def __init__(self, ttl=PERMISSION_CACHE_TTL, negative_ttl=PERMISSION_CACHE_NEGATIVE_TTL):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = {}     # (bot_id, user_id, channel_id) -> (verdict, expires_at)
+        self._by_channel = {}  # (bot_id, channel_id) -> {user_id, ...} (для быстрой инвалидации канала)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id, channel_id):
+        """Закэшированный вердикт или None (нет записи / истекла)"""
+        key = (db.current_bot_id(), user_id, str(channel_id))
+        entry = self._entries.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def set(self, user_id, channel_id, verdict):
+        ttl = self.ttl if verdict == "allowed" else self.negative_ttl
+        if ttl <= 0:
+            return
+        if len(self._entries) >= MAX_ENTRIES:
+            self._purge_expired()
+
+        bot_id, channel_id = db.current_bot_id(), str(channel_id)
+        self._entries[(bot_id, user_id, channel_id)] = (verdict, time.monotonic() + ttl)
+        self._by_channel.setdefault((bot_id, channel_id), set()).add(user_id)
+
+    def invalidate(self, user_id, channel_id, bot_id=None):
+        bot_id = db.current_bot_id() if bot_id is None else bot_id
+        channel_id = str(channel_id)
+        self._entries.pop((bot_id, user_id, channel_id), None)
+        users = self._by_channel.get((bot_id, channel_id))
+        if users:
+            users.discard(user_id)
+
+    def invalidate_channel(self, channel_id):
+        """Сброс всех записей канала (состав админов мог измениться)"""
+        bot_id, channel_id = db.current_bot_id(), str(channel_id)
+        for user_id in self._by_channel.pop((bot_id, channel_id), ()):
+            self._entries.pop((bot_id, user_id, channel_id), None)
+
+    def _purge_expired(self):
+        now = time.monotonic()
+        for bot_id, user_id, channel_id in [k for k, (_, expires) in self._entries.items() if expires < now]:
+            self.invalidate(user_id, channel_id, bot_id)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+permission_cache = PermissionCache()
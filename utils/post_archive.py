@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import time
+
+from config import ARCHIVE_FLUSH_INTERVAL, ARCHIVE_BATCH_SIZE
+from utils.db import db
+
+
+class PostArchive:
+    """
+    Архив опубликованных постов (таблица posts) с отложенной записью.
+
+    Публикация только кладет запись в буфер и сразу возвращается — на диск посты
+    уходят пачкой раз в flush_interval секунд (или сразу, если набралось batch_size).
+    Пока запись в буфере, она уже видна через get(), поэтому кнопки
+    "Изменить"/"Удалить" работают сразу после публикации.
+    """
+
+    def __init__(self, database=db, flush_interval=ARCHIVE_FLUSH_INTERVAL, batch_size=ARCHIVE_BATCH_SIZE):
+        self.db = database
+        self.flush_interval = flush_interval
+        self.batch_size = max(1, batch_size)
+        self._pending = {}  # (bot_id, channel_id, message_id) -> запись
+        self._lock = asyncio.Lock()  # Правка ждет, пока идущая пачка не окажется в БД
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+        self.flushed = 0
+        self.batches = 0
+
+    def add(self, user_id, channel_id, message_ids, post_text, is_html, media_list, parse_mode):
+        """Запись о публикации (без ожидания диска), от имени текущего бота"""
+        if not message_ids:
+            return
+        bot_id = self.db.current_bot_id()
+        self._pending[(bot_id, str(channel_id), message_ids[0])] = {
+            'bot_id': bot_id,
+            'user_id': user_id,
+            'channel_id': str(channel_id),
+            'message_ids': list(message_ids),
+            'post_text': post_text,
+            'is_html': bool(is_html),
+            'media_list': media_list or [],
+            'parse_mode': parse_mode,
+            'published_at': time.time(),
+            'status': "published",
+        }
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def get(self, channel_id, message_id):
+        key = (self.db.current_bot_id(), str(channel_id), message_id)
+        if key in self._pending:
+            return self._pending[key]
+        async with self._lock:
+            return await self.db.get_post(channel_id, message_id)
+
+    async def update(self, channel_id, message_id, **fields):
+        """Изменение поста (текст после правки, статус после удаления)"""
+        key = (self.db.current_bot_id(), str(channel_id), message_id)
+        if key in self._pending:
+            self._pending[key].update(fields)
+            return
+        async with self._lock:
+            await self.db.update_post(channel_id, message_id, **fields)
+
+    # --- ФОНОВАЯ ЗАПИСЬ ---
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._background())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _background(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.exception(f"Ошибка записи архива постов: {e}")
+
+    async def flush(self):
+        """Запись накопленных постов одной транзакцией"""
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            try:
+                await self.db.add_posts(list(batch.values()))
+            except BaseException:
+                # Не теряем посты: вернем их в буфер (новые записи важнее старых)
+                self._pending = {**batch, **self._pending}
+                raise
+            self.flushed += len(batch)
+            self.batches += 1
+
+    def stats(self):
+        return {
+            'pending': len(self._pending),
+            'flushed': self.flushed,
+            'batches': self.batches,
+        }
+
+
+post_archive = PostArchive()
@@ -0,0 +1,211 @@
+import html
+import re
+import time
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+# Лимиты Telegram (в UTF-16 символах видимого текста)
+TEXT_LIMIT = 4096
+CAPTION_LIMIT = 1024
+
+# Разрешенные теги Telegram HTML и их обязательные атрибуты
+ALLOWED_TAGS = {
+    "b", "strong", "i", "em", "u", "ins", "s", "strike", "del",
+    "span", "tg-spoiler", "a", "tg-emoji", "code", "pre", "blockquote",
+}
+REQUIRED_ATTRS = {"a": "href", "tg-emoji": "emoji-id"}
+
+# Именованные сущности, которые понимает Telegram (плюс любые числовые)
+NAMED_ENTITIES = {"lt": "<", "gt": ">", "amp": "&", "quot": '"'}
+
+# Сколько помнить, что канал не принимает кастомные эмодзи (нет буста)
+NO_CUSTOM_EMOJI_TTL = 24 * 3600
+
+TAG_RE = re.compile(r"<(/?)([a-zA-Z][a-zA-Z0-9-]*)((?:\s+[^<>]*?)?)\s*/?>")
+ATTR_RE = re.compile(r"""([a-zA-Z-]+)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""")
+CUSTOM_EMOJI_RE = re.compile(r"<tg-emoji[^>]*>(.*?)</tg-emoji>", re.IGNORECASE | re.DOTALL)
+ENTITY_RE = re.compile(r"&(#[0-9]+|#[xX][0-9a-fA-F]+|[a-zA-Z][a-zA-Z0-9]*);")
+
+
+class HtmlCheck(NamedTuple):
+    """Результат локальной проверки текста"""
+    valid: bool                # Telegram примет разметку
+    error: Optional[str]       # Причина, если не примет
+    length: int                # Длина видимого текста в UTF-16
+    has_custom_emoji: bool     # Есть ли <tg-emoji>
+
+
+def utf16_len(text):
+    """Длина строки так, как ее считает Telegram (UTF-16 code units)"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+@lru_cache(maxsize=2048)
+def check_html(text):
+    """
+    Разбор текста по правилам Telegram HTML без обращения к API.
+    Результат кэшируется по самому тексту: повторные публикации того же
+    черновика (рассылка, отложенный пост) не разбирают его заново.
+    """
+    visible = []
+    stack = []
+    has_custom_emoji = False
+    pos = 0
+
+    def _fail(reason):
+        # Если разметка сломана, Telegram покажет текст как есть
+        return HtmlCheck(False, reason, utf16_len(text), has_custom_emoji)
+
+    while True:
+        lt = text.find("<", pos)
+        chunk = text[pos:] if lt == -1 else text[pos:lt]
+
+        # Сущности (&...;) в тексте между тегами
+        for m in ENTITY_RE.finditer(chunk):
+            name = m.group(1)
+            if not name.startswith("#") and name not in NAMED_ENTITIES:
+                return _fail(f"неподдерживаемая сущность &{name};")
+        visible.append(html.unescape(chunk))
+
+        if lt == -1:
+            break
+
+        m = TAG_RE.match(text, lt)
+        if not m:
+            return _fail("символ < вне тега")
+
+        closing, tag, attrs = m.group(1), m.group(2).lower(), m.group(3)
+        if tag not in ALLOWED_TAGS:
+            return _fail(f"неподдерживаемый тег <{tag}>")
+
+        if closing:
+            if not stack or stack[-1] != tag:
+                return _fail(f"лишний или неверно вложенный </{tag}>")
+            stack.pop()
+        else:
+            attr_map = {a.lower(): v1 or v2 or v3 for a, v1, v2, v3 in ATTR_RE.findall(attrs)}
+            required = REQUIRED_ATTRS.get(tag)
+            if required and not attr_map.get(required):
+                return _fail(f"у <{tag}> нет атрибута {required}")
+            if tag == "span" and attr_map.get("class") != "tg-spoiler":
+                return _fail("<span> допустим только с class=\"tg-spoiler\"")
+            if tag == "tg-emoji":
+                has_custom_emoji = True
+            stack.append(tag)
+
+        pos = m.end()
+
+    if stack:
+        return _fail(f"не закрыт тег <{stack[-1]}>")
+
+    return HtmlCheck(True, None, utf16_len("".join(visible)), has_custom_emoji)
+
+
+def strip_custom_emoji(text):
+    """Замена <tg-emoji ...>😀</tg-emoji> на обычный эмодзи внутри тега"""
+    return CUSTOM_EMOJI_RE.sub(r"\1", text)
+
+
+# Так Telegram отклоняет кастомный эмодзи (канал без буста, эмодзи недоступен боту)
+CUSTOM_EMOJI_ERRORS = ("custom emoji", "custom_emoji", "document_invalid")
+
+
+def is_custom_emoji_error(error) -> bool:
+    """Telegram отклонил именно кастомный эмодзи, а не разметку вообще"""
+    err_str = str(error).lower()
+    return any(marker in err_str for marker in CUSTOM_EMOJI_ERRORS)
+
+
+def is_markup_error(error) -> bool:
+    """Ошибка Telegram связана с разметкой/эмодзи (имеет смысл пробовать другой вариант)"""
+    err_str = str(error).lower()
+    return "entities" in err_str or "can't parse" in err_str or is_custom_emoji_error(error)
+
+
+# --- КАНАЛЫ БЕЗ ПОДДЕРЖКИ КАСТОМНЫХ ЭМОДЗИ ---
+
+_no_custom_emoji = {}  # channel_id -> до какого времени не пробовать кастомные эмодзи
+
+
+def custom_emoji_allowed(channel_id):
+    until = _no_custom_emoji.get(str(channel_id))
+    return until is None or until < time.time()
+
+
+def mark_no_custom_emoji(channel_id):
+    """Канал отклонил кастомный эмодзи — сутки сразу шлем обычный футер"""
+    _no_custom_emoji[str(channel_id)] = time.time() + NO_CUSTOM_EMOJI_TTL
+
+
+# --- ПЛАН ОТПРАВКИ ---
+
+def plan_send(text, is_html, footer_rich, footer_plain, has_media, rich_allowed=True):
+    """
+    Выбор варианта отправки до первого запроса к Telegram.
+    Возвращает (attempts, error):
+    * attempts — список вариантов {'caption', 'parse_mode', 'status', 'note', 'rich'}
+      в порядке попыток. Первый почти всегда срабатывает; следующие — страховка
+      на случай, который нельзя проверить локально (канал без буста для эмодзи).
+    * error — текст ошибки, если пост нельзя отправить вовсе (превышен лимит длины).
+    """
+    limit = CAPTION_LIMIT if has_media else TEXT_LIMIT
+    check = check_html(text)
+    attempts = []
+
+    if is_html:
+        # СЦЕНАРИЙ: ШАБЛОН (без футера)
+        if check.valid:
+            if check.has_custom_emoji and rich_allowed:
+                attempts.append({'caption': text, 'parse_mode': "HTML", 'status': "ok",
+                                 'note': "🚀 <b>Опубликовано!</b> (Шаблон)", 'rich': True})
+            if check.has_custom_emoji:
+                # Канал без буста: оформление сохраняем, кастомные эмодзи меняем на обычные
+                attempts.append({'caption': strip_custom_emoji(text), 'parse_mode': "HTML",
+                                 'status': "fallback" if rich_allowed else "ok",
+                                 'note': "🚀 <b>Опубликовано!</b> (Шаблон, заменены эмодзи)", 'rich': False})
+            else:
+                attempts.append({'caption': text, 'parse_mode': "HTML", 'status': "ok",
+                                 'note': "🚀 <b>Опубликовано!</b> (Шаблон)", 'rich': False})
+            length = check.length
+        else:
+            length = utf16_len(text)
+        # Голый текст: если в шаблоне ошибка тегов
+        attempts.append({'caption': text, 'parse_mode': None, 'status': "fallback",
+                         'note': "⚠️ <b>Опубликовано без оформления</b> (ошибка в тегах).", 'rich': False})
+    else:
+        # СЦЕНАРИЙ: ОБЫЧНЫЙ ТЕКСТ (с футером)
+        body = text if check.valid else html.escape(text)
+        length = check.length if check.valid else utf16_len(text)
+        use_rich = rich_allowed and footer_rich != footer_plain
+
+        if check.valid:
+            if use_rich:
+                attempts.append({'caption': f"{body}{footer_rich}", 'parse_mode': "HTML", 'status': "ok",
+                                 'note': "🚀 <b>Опубликовано с футером!</b>", 'rich': True})
+            attempts.append({'caption': f"{body}{footer_plain}", 'parse_mode': "HTML",
+                             'status': "fallback" if use_rich else "ok",
+                             'note': "🚀 <b>Опубликовано!</b> (Заменен эмодзи)" if use_rich
+                             else "🚀 <b>Опубликовано с футером!</b>", 'rich': False})
+            escaped = html.escape(text)
+            if escaped != text and utf16_len(text) + check_html(footer_plain).length <= limit:
+                # Последняя страховка: Telegram отклонил разметку, которую локальная проверка
+                # не моделирует (вложенность, правила сущностей) — текст экранируем, ссылку оставляем
+                attempts.append({'caption': f"{escaped}{footer_plain}", 'parse_mode': "HTML", 'status': "fallback",
+                                 'note': "⚠️ <b>Опубликовано</b> (Текст экранирован, ссылка сохранена).",
+                                 'rich': False})
+        else:
+            # Сломанный HTML сразу экранируем, а ссылку в футере оставляем кликабельной
+            note = "⚠️ <b>Опубликовано</b> (Текст экранирован, ссылка сохранена)."
+            if use_rich:
+                attempts.append({'caption': f"{body}{footer_rich}", 'parse_mode': "HTML", 'status': "fallback",
+                                 'note': note, 'rich': True})
+            attempts.append({'caption': f"{body}{footer_plain}", 'parse_mode': "HTML", 'status': "fallback",
+                             'note': note, 'rich': False})
+
+        length += check_html(footer_plain).length
+
+    if length > limit:
+        kind = "подписи к медиа" if has_media else "текста"
+        return [], f"Превышен лимит {kind}: {length}/{limit} символов"
+
+    return attempts, None
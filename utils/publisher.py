@@ -0,0 +1,210 @@
+import asyncio
+import html
+
+from aiogram import Bot
+from aiogram.utils.media_group import MediaGroupBuilder
+
+from config import TG_EMOJI, BROADCAST_CONCURRENCY
+from utils.db import db
+from utils.governor import governor, PRIORITY_BULK
+from utils.reconciler import reconciler
+from utils.post_archive import post_archive
+from utils.uploads import upload_cache
+from utils.preflight import (plan_send, is_markup_error, is_custom_emoji_error, custom_emoji_allowed,
+                             mark_no_custom_emoji)
+
+# Статусы результата публикации
+STATUS_OK = "ok"              # Опубликовано как задумано
+STATUS_FALLBACK = "fallback"  # Опубликовано, но через запасной вариант оформления
+STATUS_FAILED = "failed"      # Не опубликовано
+
+
+def get_post_link(channel_id) -> str:
+    """Ссылка на канал для футера (публичный @username или приватный -100...)"""
+    if str(channel_id).startswith("@"):
+        return f"https://t.me/{str(channel_id)[1:]}"
+    clean_id = str(channel_id).replace("-100", "")
+    return f"https://t.me/c/{clean_id}/1"
+
+
+async def send_to_tg(bot: Bot, cid, media_list, caption, parse_mode="HTML"):
+    """Отправка поста в канал (с поддержкой альбомов и parse_mode). Возвращает список отправленных сообщений"""
+    if not media_list:
+        return [await bot.send_message(cid, text=caption, parse_mode=parse_mode)]
+
+    # Файлы с сервера (путь или URL) уходят по file_id из кэша загрузок или загружаются потоком
+    async with upload_cache.prepare(media_list) as batch:
+        messages = await send_media(bot, cid, batch.media, caption, parse_mode)
+        await upload_cache.remember(batch, messages)
+        return messages
+
+
+async def send_media(bot: Bot, cid, media_list, caption, parse_mode):
+    """Пост с файлами: одиночный файл или альбом. В 'id' — file_id или InputFile"""
+    if len(media_list) == 1:
+        m = media_list[0]
+        if m['type'] == "photo":
+            return [await bot.send_photo(cid, m['id'], caption=caption, parse_mode=parse_mode)]
+        elif m['type'] == "video":
+            return [await bot.send_video(cid, m['id'], caption=caption, parse_mode=parse_mode)]
+        elif m['type'] == "audio":
+            return [await bot.send_audio(cid, m['id'], caption=caption, parse_mode=parse_mode)]
+        return []
+    else:
+        album_builder = MediaGroupBuilder(caption=caption)
+        for m in media_list:
+            if m['type'] == "photo":
+                album_builder.add_photo(media=m['id'])
+            elif m['type'] == "video":
+                album_builder.add_video(media=m['id'])
+            elif m['type'] == "audio":
+                album_builder.add_audio(media=m['id'])
+
+        media_group = album_builder.build()
+        if media_group:
+            # Принудительно ставим режим парсинга первому элементу альбома
+            # (модели aiogram неизменяемые, поэтому через копию)
+            media_group[0] = media_group[0].model_copy(update={"parse_mode": parse_mode})
+
+        return await bot.send_media_group(cid, media=media_group)
+
+
+async def build_footers(cid):
+    """Варианты футера поста: с кастомным эмодзи и с обычным"""
+    # Экранируем название канала, чтобы знаки вроде & или < в названии не ломали HTML-ссылку
+    title = html.escape(await db.get_channel_title(cid))
+    link = get_post_link(cid)
+
+    footer_rich = f"\n\n{TG_EMOJI} <a href='{link}'>{title}</a>"
+    footer_plain = f"\n\n⛺️ <a href='{link}'>{title}</a>"
+    return footer_rich, footer_plain
+
+
+async def publish_post(bot: Bot, cid, text, is_html, media_list, user_id=None):
+    """
+    Публикация поста в один канал.
+    Вариант оформления выбирается заранее локальной проверкой (utils/preflight.py),
+    поэтому обычно хватает одного запроса. Следующие варианты пробуются,
+    только если Telegram отклонил разметку.
+    Возвращает словарь {'channel_id', 'message_id', 'status', 'note', 'error'},
+    message_id — первое сообщение поста в канале (ключ в архиве для правки/удаления).
+    Исключения наружу не пробрасываются — ошибка попадает в 'error'.
+    Успешные публикации попадают в архив (post_archive), user_id — автор.
+    """
+    result = {'channel_id': cid, 'message_id': None, 'status': STATUS_OK, 'note': "", 'error': None}
+    reconciler.touch(cid)
+
+    footer_rich, footer_plain = await build_footers(cid)
+    attempts, error = plan_send(text, is_html, footer_rich, footer_plain,
+                                has_media=bool(media_list), rich_allowed=custom_emoji_allowed(cid))
+    if error:
+        result['status'] = STATUS_FAILED
+        result['error'] = error
+        return result
+
+    for i, attempt in enumerate(attempts):
+        try:
+            messages = await send_to_tg(bot, cid, media_list, attempt['caption'], parse_mode=attempt['parse_mode'])
+            result['status'] = attempt['status']
+            result['note'] = attempt['note']
+            if messages:
+                message_ids = [m.message_id for m in messages]
+                result['message_id'] = message_ids[0]
+                # Без ожидания диска: архив пишется пачками в фоне
+                post_archive.add(user_id, cid, message_ids, text, is_html, media_list, attempt['parse_mode'])
+            return result
+        except Exception as e:
+            # Следующий вариант имеет смысл, только если проблема в разметке
+            if not is_markup_error(e) or i == len(attempts) - 1:
+                result['status'] = STATUS_FAILED
+                result['error'] = str(e)
+                return result
+            if attempt['rich'] and is_custom_emoji_error(e):
+                # Канал не принимает кастомные эмодзи — сутки сразу шлем обычный футер.
+                # Прочие ошибки разметки вердикт о канале не меняют
+                mark_no_custom_emoji(cid)
+
+    return result
+
+
+async def edit_post(bot: Bot, post, text, is_html):
+    """
+    Замена текста уже опубликованного поста (без повторной отправки).
+    post — запись архива. Текст проходит ту же проверку и те же варианты оформления,
+    что и при публикации; у постов с медиа меняется подпись первого сообщения.
+    Возвращает словарь в формате publish_post.
+    """
+    cid = post['channel_id']
+    message_id = post['message_ids'][0]
+    has_media = bool(post['media_list'])
+    result = {'channel_id': cid, 'message_id': message_id, 'status': STATUS_OK, 'note': "", 'error': None}
+
+    footer_rich, footer_plain = await build_footers(cid)
+    attempts, error = plan_send(text, is_html, footer_rich, footer_plain,
+                                has_media=has_media, rich_allowed=custom_emoji_allowed(cid))
+    if error:
+        result['status'] = STATUS_FAILED
+        result['error'] = error
+        return result
+
+    for i, attempt in enumerate(attempts):
+        try:
+            if has_media:
+                await bot.edit_message_caption(chat_id=cid, message_id=message_id,
+                                               caption=attempt['caption'], parse_mode=attempt['parse_mode'])
+            else:
+                await bot.edit_message_text(chat_id=cid, message_id=message_id, text=attempt['caption'],
+                                            parse_mode=attempt['parse_mode'])
+        except Exception as e:
+            if "message is not modified" in str(e).lower():
+                # Текст совпал с текущим — правка не нужна
+                pass
+            elif not is_markup_error(e) or i == len(attempts) - 1:
+                result['status'] = STATUS_FAILED
+                result['error'] = str(e)
+                return result
+            else:
+                if attempt['rich'] and is_custom_emoji_error(e):
+                    mark_no_custom_emoji(cid)
+                continue
+
+        result['status'] = attempt['status']
+        result['note'] = ("✏️ <b>Пост изменен!</b>" if attempt['status'] == STATUS_OK
+                          else "✏️ <b>Пост изменен</b> (запасное оформление).")
+        await post_archive.update(cid, message_id, post_text=text, is_html=is_html,
+                                  parse_mode=attempt['parse_mode'])
+        return result
+
+    return result
+
+
+async def delete_post(bot: Bot, post):
+    """Удаление всех сообщений поста из канала одним запросом deleteMessages. Возвращает ошибку или None"""
+    cid = post['channel_id']
+    message_ids = post['message_ids']
+    try:
+        # deleteMessages принимает до 100 id за раз (в альбоме их не больше 10)
+        for start in range(0, len(message_ids), 100):
+            await bot.delete_messages(chat_id=cid, message_ids=message_ids[start:start + 100])
+    except Exception as e:
+        return str(e)
+    await post_archive.update(cid, message_ids[0], status="deleted")
+    return None
+
+
+async def broadcast_post(bot: Bot, channel_ids, text, is_html, media_list, concurrency=BROADCAST_CONCURRENCY,
+                         user_id=None):
+    """
+    Публикация одного поста сразу в несколько каналов.
+    Одновременно отправляется не больше concurrency постов.
+    Возвращает список результатов publish_post в порядке channel_ids.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def _publish_one(cid):
+        async with semaphore:
+            return await publish_post(bot, cid, text, is_html, media_list, user_id)
+
+    # Рассылка не должна тормозить ответы другим пользователям
+    with governor.priority(PRIORITY_BULK):
+        return await asyncio.gather(*(_publish_one(cid) for cid in channel_ids))
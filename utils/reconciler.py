@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import time
+from typing import List
+
+from aiogram import Bot
+
+from config import RECONCILE_INTERVAL, RECONCILE_CONCURRENCY
+from utils.admins import fetch_channel_admins, is_chat_gone_error
+from utils.db import db
+from utils.governor import governor, PRIORITY_BULK
+from utils.permission_cache import permission_cache
+
+
+class PermissionReconciler:
+    """
+    Фоновая сверка прав для всех каналов из таблицы channels (всех запущенных ботов).
+
+    Раз в interval секунд обходит все каналы и повторяет синхронизацию админов
+    (get_chat_administrators -> db.sync_channel_admins). Запуски равномерно
+    растянуты на весь интервал, одновременно идет не больше concurrency запросов,
+    а каналы, с которыми недавно работали, проверяются первыми.
+    Удаленные каналы (chat not found / forbidden) вычищаются из базы.
+    """
+
+    def __init__(self, interval=RECONCILE_INTERVAL, concurrency=RECONCILE_CONCURRENCY):
+        self.interval = interval
+        self.concurrency = max(1, concurrency)
+        self._last_active = {}  # (bot_id, channel_id) -> время последней работы с каналом
+        self._task = None
+        self.bots = {}  # bot_id -> Bot
+
+        self.checked = 0
+        self.changed = 0
+        self.pruned = 0
+        self.failed = 0
+
+    def touch(self, channel_id):
+        """Отметка активности канала (выбор в меню, публикация) у текущего бота"""
+        self._last_active[(db.current_bot_id(), str(channel_id))] = time.time()
+
+    async def start(self, bots: List[Bot]):
+        self.bots = {bot.id: bot for bot in bots}
+        if self.interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                await self.reconcile_all()
+            except Exception as e:
+                logging.exception(f"Ошибка фоновой сверки прав: {e}")
+            # Если обход прошел быстрее интервала (мало каналов), ждем остаток
+            await asyncio.sleep(max(1.0, self.interval - (time.monotonic() - started)))
+
+    async def reconcile_all(self):
+        """Один полный обход всех каналов всех ботов"""
+        channels = []
+        for bot_id in self.bots:
+            with db.bot_scope(bot_id):
+                channels += [(bot_id, channel_id, title) for channel_id, title in await db.get_all_channels()]
+        # Отметки активности каналов, которых больше нет в базе, не копятся
+        tracked = {row[:2] for row in channels}
+        self._last_active = {key: at for key, at in self._last_active.items() if key in tracked}
+        if not channels:
+            return
+
+        # Недавно активные — первыми, остальные в порядке из БД
+        channels.sort(key=lambda row: self._last_active.get(row[:2], 0), reverse=True)
+        spacing = self.interval / len(channels)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        tasks = []
+
+        async def _one(bot_id, channel_id, title):
+            try:
+                with db.bot_scope(bot_id):
+                    await self.reconcile_channel(channel_id, title)
+            finally:
+                semaphore.release()
+
+        for bot_id, channel_id, title in channels:
+            await semaphore.acquire()
+            tasks.append(asyncio.create_task(_one(bot_id, channel_id, title)))
+            await asyncio.sleep(spacing)
+
+        failed_before = self.failed
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for (bot_id, channel_id, _), result in zip(channels, results):
+            if isinstance(result, Exception):
+                self.failed += 1
+                logging.error(f"Сверка прав: ошибка в канале {channel_id} (бот {bot_id})", exc_info=result)
+        logging.info(f"Сверка прав: обход завершен, каналов: {len(channels)}, "
+                     f"ошибок: {self.failed - failed_before}")
+
+    async def reconcile_channel(self, channel_id, title):
+        """Сверка одного канала текущего бота (db.bot_scope). Возвращает сводку изменений или None"""
+        self.checked += 1
+        try:
+            with governor.priority(PRIORITY_BULK):
+                admins = await fetch_channel_admins(self.bots[db.current_bot_id()], channel_id)
+        except Exception as e:
+            if is_chat_gone_error(e):
+                await db.delete_channel(channel_id)
+                permission_cache.invalidate_channel(channel_id)
+                self._last_active.pop((db.current_bot_id(), str(channel_id)), None)
+                self.pruned += 1
+                logging.info(f"Сверка прав: канал {channel_id} недоступен и удален из базы")
+            else:
+                self.failed += 1
+                logging.warning(f"Сверка прав: не удалось получить админов {channel_id}: {e}")
+            return None
+
+        summary = await db.sync_channel_admins(channel_id, title, admins)
+        if summary['added'] or summary['removed'] or summary['role_changed']:
+            permission_cache.invalidate_channel(channel_id)
+            self.changed += 1
+        return summary
+
+    def stats(self):
+        return {
+            'checked': self.checked,
+            'changed': self.changed,
+            'pruned': self.pruned,
+            'failed': self.failed,
+        }
+
+
+reconciler = PermissionReconciler()
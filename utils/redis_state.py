@@ -0,0 +1,108 @@
+import asyncio
+import logging
+import uuid
+from contextlib import asynccontextmanager
+
+# Пакет redis нужен только при FSM_STORAGE=redis: модуль импортируется лениво (utils/fsm_storage.py)
+from redis.asyncio import Redis
+from redis.exceptions import WatchError
+from aiogram.fsm.storage.base import DefaultKeyBuilder
+from aiogram.fsm.storage.redis import RedisStorage
+
+from config import REDIS_URL, FSM_TTL, USER_LOCK_TTL
+
+# Префикс ключей блокировок пользователей
+LOCK_PREFIX = "lock:user:"
+# Пауза между попытками взять занятую блокировку: от 5 мс, удваивается до 50 мс
+LOCK_RETRY_MIN = 0.005
+LOCK_RETRY_MAX = 0.05
+
+
+class RedisFSMStorage(RedisStorage):
+    """
+    Сессии FSM в Redis — общие для всех процессов-обработчиков.
+    Те же ключи, что у SQLiteStorage (бот + чат + пользователь), и тот же срок жизни FSM_TTL,
+    но считает его сам Redis (EXPIRE), без фоновой очистки.
+    """
+
+    def __init__(self, redis: Redis, ttl=FSM_TTL):
+        super().__init__(redis, key_builder=DefaultKeyBuilder(with_bot_id=True, with_destiny=True),
+                         state_ttl=ttl or None, data_ttl=ttl or None)
+
+    async def start(self):
+        """Совместимость с SQLiteStorage: фоновых задач нет"""
+
+    def session_count(self):
+        return 0
+
+    def dirty_count(self):
+        return 0
+
+    def stats(self):
+        # Сессии живут в Redis, локально ничего не копится
+        return {'backend': "redis", 'sessions': None, 'dirty': 0, 'approx_bytes': 0}
+
+
+class RedisUserLocks:
+    """
+    Блокировка пользователя между процессами: async with user_locks(user_id): ...
+
+    Вход кластера отправляет обновления одного пользователя в один и тот же процесс,
+    так что блокировка почти всегда свободна и стоит два-три запроса к Redis.
+    Она нужна на переходные случаи: перезапуск обработчика, смена числа WORKERS.
+    Если процесс упал, не сняв блокировку, она истекает через ttl секунд.
+
+    Только SET NX PX и WATCH/MULTI, без Lua-скриптов: работает с любым сервером
+    по протоколу Redis (KeyDB, Dragonfly, fakeredis).
+    """
+
+    def __init__(self, redis: Redis, ttl=USER_LOCK_TTL):
+        self.redis = redis
+        self.ttl_ms = max(1, int(ttl * 1000))
+        self.acquired = 0
+        self.contended = 0
+        self.expired = 0
+
+    @asynccontextmanager
+    async def __call__(self, user_id):
+        key = f"{LOCK_PREFIX}{user_id}"
+        token = uuid.uuid4().hex
+        # 1. Захват: ключ с токеном этого владельца, пока его нет
+        delay = LOCK_RETRY_MIN
+        if not await self.redis.set(key, token, nx=True, px=self.ttl_ms):
+            self.contended += 1
+            while not await self.redis.set(key, token, nx=True, px=self.ttl_ms):
+                await asyncio.sleep(delay)
+                delay = min(LOCK_RETRY_MAX, delay * 2)
+        self.acquired += 1
+        try:
+            yield
+        finally:
+            # 2. Снятие: удаляем, только если блокировка все еще наша
+            if not await self._release(key, token):
+                # Хендлер работал дольше ttl, и блокировка уже истекла (или ее взял другой процесс)
+                self.expired += 1
+                logging.warning(f"Блокировка пользователя {user_id} истекла раньше конца обработки")
+
+    async def _release(self, key, token):
+        async with self.redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    if (await pipe.get(key) or b"").decode() != token:
+                        await pipe.unwatch()
+                        return False
+                    pipe.multi()
+                    pipe.delete(key)
+                    await pipe.execute()
+                    return True
+                except WatchError:
+                    # Ключ изменился между GET и DEL (истек и захвачен заново) — проверяем снова
+                    continue
+
+    def stats(self):
+        return {'acquired': self.acquired, 'contended': self.contended, 'expired': self.expired}
+
+
+def create_redis(url=REDIS_URL) -> Redis:
+    return Redis.from_url(url)
@@ -0,0 +1,259 @@
+import asyncio
+import heapq
+import html
+import logging
+import math
+import time
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+from aiogram import Bot
+
+from config import TIMEZONE_OFFSET, BROADCAST_CONCURRENCY, SCHEDULER_POLL_INTERVAL, SCHEDULER_CLAIM_TIMEOUT
+from utils.db import db
+from utils.governor import governor, PRIORITY_BULK
+from utils.publisher import publish_post, STATUS_FAILED
+
+# Часовой пояс, в котором пользователи вводят время публикации
+LOCAL_TZ = timezone(timedelta(hours=TIMEZONE_OFFSET))
+
+
+def parse_publish_time(text, now=None):
+    """
+    Разбор времени публикации, введенного пользователем (в LOCAL_TZ).
+    Форматы: "ДД.ММ.ГГГГ ЧЧ:ММ", "ДД.ММ ЧЧ:ММ" (в этом году, а если дата уже прошла — в следующем)
+    или просто "ЧЧ:ММ" (сегодня, а если это время уже прошло — завтра).
+    Возвращает Unix-время или None, если формат не распознан.
+    """
+    now = now or datetime.now(LOCAL_TZ)
+    text = " ".join(text.split())
+
+    for fmt in ("%d.%m.%Y %H:%M", "%d.%m %H:%M", "%H:%M"):
+        if fmt == "%d.%m %H:%M":
+            # Год подставляется до разбора: без него strptime берет 1900 и отвергает 29.02
+            date, _, clock = text.partition(" ")
+            for year in (now.year, now.year + 1):
+                try:
+                    moment = datetime.strptime(f"{date}.{year} {clock}", "%d.%m.%Y %H:%M").replace(tzinfo=LOCAL_TZ)
+                except ValueError:
+                    continue
+                if moment > now:
+                    return moment.timestamp()
+            continue
+
+        try:
+            parsed = datetime.strptime(text, fmt)
+        except ValueError:
+            continue
+
+        if fmt == "%H:%M":
+            moment = now.replace(hour=parsed.hour, minute=parsed.minute, second=0, microsecond=0)
+            if moment <= now:
+                moment += timedelta(days=1)
+        else:
+            moment = parsed.replace(tzinfo=LOCAL_TZ)
+        return moment.timestamp()
+
+    return None
+
+
+def format_publish_time(timestamp):
+    """Unix-время -> строка "ДД.ММ.ГГГГ ЧЧ:ММ" в LOCAL_TZ"""
+    return datetime.fromtimestamp(timestamp, LOCAL_TZ).strftime("%d.%m.%Y %H:%M")
+
+
+class PostScheduler:
+    """
+    Планировщик отложенных постов.
+
+    Ожидающие посты лежат в таблице scheduled_posts, а в памяти — только куча
+    (publish_at, id). Одна задача asyncio спит ровно до ближайшего поста
+    (поиск следующего — O(1), добавление/извлечение — O(log n)) и просыпается
+    раньше, если появился пост с более ранним временем.
+    Посты, пропущенные во время простоя бота, публикуются сразу после старта.
+    Очередь общая для всех ботов процесса: пост публикует тот бот, через которого его создали.
+
+    Раз в poll_interval секунд в кучу подгружаются новые посты, которые записали в БД
+    другие процессы (импорт из командной строки, обработчики кластера). Публикаций
+    одновременно — не больше concurrency, и задачи создаются по мере освобождения мест,
+    поэтому тысячи созревших постов (импорт) не превращаются в тысячи задач сразу.
+
+    Пост, захваченный процессом, который упал до записи итогового статуса, через claim_timeout
+    секунд возвращается в очередь (при старте и при каждой подгрузке) — он не теряется.
+    """
+
+    def __init__(self, concurrency=BROADCAST_CONCURRENCY, poll_interval=SCHEDULER_POLL_INTERVAL,
+                 claim_timeout=SCHEDULER_CLAIM_TIMEOUT):
+        self.poll_interval = poll_interval
+        self.claim_timeout = claim_timeout
+        self._heap = []
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(max(1, concurrency))
+        self._task = None
+        self._inflight = set()
+        self._synced_id = 0     # Посты с id до этого уже подгружены из БД
+        self._added = set()     # id, добавленные через add() после последней подгрузки
+        self._next_sync = math.inf
+        self.bots = {}  # bot_id -> Bot
+
+    async def start(self, bots: List[Bot]):
+        """Загрузка ожидающих постов из БД и запуск фоновой задачи"""
+        self.bots = {bot.id: bot for bot in bots}
+        # Посты, брошенные упавшим процессом, загрузятся вместе с остальными ожидающими
+        await self._release_stale()
+        self._heap = [tuple(row) for row in await db.get_pending_scheduled_posts()]
+        heapq.heapify(self._heap)
+        self._synced_id = max((post_id for _, post_id in self._heap), default=0)
+        self._next_sync = self._sync_deadline()
+
+        missed = sum(1 for publish_at, _ in self._heap if publish_at <= time.time())
+        logging.info(f"Планировщик: в очереди {len(self._heap)} пост(ов), пропущено во время простоя: {missed}")
+
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Даем уже начатым публикациям завершиться
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    def add(self, post_id, publish_at):
+        """Постановка уже сохраненного в БД поста в очередь"""
+        heapq.heappush(self._heap, (publish_at, post_id))
+        if self.poll_interval:
+            # Подгрузка из БД увидит этот пост еще раз — второй раз его в кучу не кладем
+            self._added.add(post_id)
+        # Будим задачу: новый пост может оказаться раньше текущего ближайшего
+        self._wakeup.set()
+
+    def refresh(self):
+        """Подгрузить новые посты из БД сейчас, не дожидаясь poll_interval (после импорта)"""
+        self._next_sync = 0.0
+        self._wakeup.set()
+
+    def pending_count(self):
+        return len(self._heap)
+
+    async def _run(self):
+        while True:
+            if time.monotonic() >= self._next_sync:
+                await self._sync()
+
+            delay = None
+            if self._heap:
+                delay = self._heap[0][0] - time.time()
+                if delay <= 0:
+                    # Место под публикацию занимаем до создания задачи
+                    await self._semaphore.acquire()
+                    _, post_id = heapq.heappop(self._heap)
+                    task = asyncio.create_task(self._publish(post_id))
+                    self._inflight.add(task)
+                    task.add_done_callback(self._inflight.discard)
+                    continue
+            if self._next_sync != math.inf:
+                until_sync = max(0.0, self._next_sync - time.monotonic())
+                delay = until_sync if delay is None else min(delay, until_sync)
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+
+    def _sync_deadline(self):
+        return time.monotonic() + self.poll_interval if self.poll_interval else math.inf
+
+    async def _sync(self):
+        """Подгрузка постов, появившихся в БД после прошлой подгрузки"""
+        self._next_sync = self._sync_deadline()
+        # Возвращенные посты с id больше _synced_id придут с подгрузкой ниже, остальные она не увидит
+        for publish_at, post_id in await self._release_stale():
+            if post_id <= self._synced_id:
+                heapq.heappush(self._heap, (publish_at, post_id))
+        try:
+            rows = await db.get_pending_scheduled_posts(self._synced_id)
+        except Exception as e:
+            logging.exception(f"Планировщик: ошибка подгрузки постов: {e}")
+            return
+        added, self._added = self._added, set()
+        for publish_at, post_id in rows:
+            self._synced_id = max(self._synced_id, post_id)
+            if post_id not in added:
+                heapq.heappush(self._heap, (publish_at, post_id))
+        if len(rows) > len(added):
+            logging.info(f"Планировщик: подгружено из БД {len(rows) - len(added)} пост(ов)")
+
+    async def _release_stale(self):
+        """Возврат в очередь постов, застрявших в 'sending' дольше claim_timeout. Возвращает (publish_at, id)"""
+        try:
+            rows = [tuple(row) for row in await db.release_stale_claims(time.time() - self.claim_timeout)]
+        except Exception as e:
+            logging.exception(f"Планировщик: ошибка проверки зависших публикаций: {e}")
+            return []
+        if rows:
+            ids = ", ".join(str(post_id) for _, post_id in rows)
+            logging.warning(f"Планировщик: {len(rows)} пост(ов) не получили итоговый статус после захвата "
+                            f"(процесс остановился посреди публикации) и возвращены в очередь: {ids}. "
+                            f"Если публикация успела пройти, пост выйдет повторно")
+        return rows
+
+    async def _publish(self, post_id):
+        try:
+            post = await db.get_scheduled_post(post_id)
+            if not post or post['status'] != "pending":
+                return
+
+            bot = self.bots.get(post['bot_id'])
+            if bot is None:
+                # Токен бота убрали из BOT_TOKENS: пост дождется его следующего запуска
+                logging.warning(f"Отложенный пост {post_id} пропущен: бот {post['bot_id']} не запущен")
+                return
+            # В кластере тот же пост ждут планировщики всех процессов — публикует захвативший
+            if not await db.claim_scheduled_post(post_id):
+                return
+
+            with db.bot_scope(bot.id):
+                await self._publish_scoped(bot, post)
+        except Exception as e:
+            logging.exception(f"Ошибка публикации отложенного поста {post_id}: {e}")
+        finally:
+            # Место освобождено — _run может взять следующий созревший пост
+            self._semaphore.release()
+
+    async def _publish_scoped(self, bot: Bot, post):
+        post_id, cid = post['id'], post['channel_id']
+        # Права могли отозвать, пока пост ждал своей очереди
+        if not await db.has_permission(post['user_id'], cid):
+            await db.set_scheduled_post_status(post_id, "failed", "нет прав на публикацию")
+            await self._notify(bot, post, "❌ Отложенный пост не опубликован: у вас больше нет прав в канале")
+            return
+
+        with governor.priority(PRIORITY_BULK):
+            result = await publish_post(bot, cid, post['post_text'], post['is_html'], post['media_list'],
+                                        post['user_id'])
+
+        if result['status'] == STATUS_FAILED:
+            await db.set_scheduled_post_status(post_id, "failed", result['error'])
+            await self._notify(bot, post, f"❌ Отложенный пост не опубликован: {html.escape(result['error'])}")
+        else:
+            await db.set_scheduled_post_status(post_id, "sent")
+            await self._notify(bot, post, f"⏰ Отложенный пост опубликован.\n{result['note']}")
+
+    async def _notify(self, bot: Bot, post, text):
+        """Уведомление автора поста (ошибки доставки не критичны). Посты из импорта — без уведомлений"""
+        if not post['notify']:
+            return
+        title = html.escape(await db.get_channel_title(post['channel_id']))
+        try:
+            await bot.send_message(post['user_id'], f"{text}\nКанал: <b>{title}</b>", parse_mode="HTML")
+        except Exception:
+            pass
+
+
+scheduler = PostScheduler()
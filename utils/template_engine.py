@@ -0,0 +1,69 @@
+import re
+import time
+from functools import lru_cache
+from typing import Callable, NamedTuple, Tuple
+
+from config import TEMPLATE_CACHE_SIZE
+
+# Поле шаблона: {{имя}} (буквы любого алфавита, цифры, _)
+PLACEHOLDER_RE = re.compile(r"\{\{\s*(\w+)\s*\}\}")
+
+
+class CompiledTemplate(NamedTuple):
+    fields: Tuple[str, ...]              # Имена полей в порядке первого появления
+    render: Callable[[dict], str]        # render({'поле': 'значение'}) -> готовый HTML
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def compile_template(source):
+    """
+    Разбор шаблона один раз: текст режется на куски, а рендер только
+    подставляет значения в готовый список и склеивает его.
+    Кэш LRU по тексту шаблона: измененный шаблон просто компилируется заново.
+    """
+    # re.split с группой: [текст, поле, текст, поле, ..., текст]
+    parts = PLACEHOLDER_RE.split(source)
+    if len(parts) == 1:
+        return CompiledTemplate((), lambda values: source)
+
+    names = parts[1::2]
+    slots = range(1, len(parts), 2)
+
+    def render(values):
+        out = parts.copy()
+        for i in slots:
+            out[i] = values.get(out[i], "")
+        return "".join(out)
+
+    return CompiledTemplate(tuple(dict.fromkeys(names)), render)
+
+
+# --- СТАТИСТИКА РЕНДЕРА ---
+
+_renders = 0
+_render_time = 0.0
+
+
+def render_template(source, values):
+    """Рендер шаблона с учетом времени (для /stats)"""
+    global _renders, _render_time
+    started = time.perf_counter()
+    text = compile_template(source).render(values)
+    _render_time += time.perf_counter() - started
+    _renders += 1
+    return text
+
+
+def template_fields(source):
+    return compile_template(source).fields
+
+
+def render_stats():
+    info = compile_template.cache_info()
+    return {
+        'renders': _renders,
+        'avg_us': _render_time / _renders * 1e6 if _renders else 0.0,
+        'compiled': info.currsize,
+        'cache_hits': info.hits,
+        'cache_misses': info.misses,
+    }
@@ -0,0 +1,215 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from functools import lru_cache
+
+import aiohttp
+from aiogram.types import FSInputFile, Message
+
+from config import UPLOAD_DIR, UPLOAD_CHUNK_SIZE, UPLOAD_URL_TIMEOUT
+from utils.db import db
+
+
+class UploadError(Exception):
+    """Файл с сервера нельзя отправить: нет файла, путь вне UPLOAD_DIR, URL недоступен"""
+
+
+def is_upload(item):
+    """Элемент media_list с файлом на сервере ({'type', 'path'} или {'type', 'url'}), а не file_id"""
+    return 'id' not in item and ('path' in item or 'url' in item)
+
+
+def resolve_path(path, root=UPLOAD_DIR):
+    """Абсолютный путь файла внутри root; выход за пределы папки (../, симлинки) — UploadError"""
+    root = os.path.realpath(root)
+    full = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, full]) != root:
+        raise UploadError(f"Файл {path} вне папки загрузок")
+    if not os.path.isfile(full):
+        raise UploadError(f"Файл {path} не найден")
+    return full
+
+
+@lru_cache(maxsize=1024)
+def _file_digest(path, size, mtime_ns, chunk_size):
+    """
+    sha256 файла, прочитанного кусками (файл целиком в память не попадает).
+    Размер и время изменения входят в ключ кэша: измененный файл считается заново
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def sent_file(message: Message):
+    """(file_id, file_size) файла в отправленном сообщении или None"""
+    if message.photo:
+        file = message.photo[-1]
+    else:
+        file = message.video or message.animation or message.audio or message.document
+    return (file.file_id, file.file_size) if file else None
+
+
+class _Batch:
+    """Файлы одной отправки: media — media_list, где файлы с сервера заменены на file_id или FSInputFile"""
+
+    def __init__(self, media, pending):
+        self.media = media
+        self._pending = pending  # номер в media -> (sha256, тип)
+
+    def uploaded_files(self, messages):
+        """Загруженные файлы: (sha256, тип, file_id, размер) из ответа Telegram (сообщения в порядке media)"""
+        files = []
+        for index, (digest, media_type) in self._pending.items():
+            sent = sent_file(messages[index]) if index < len(messages) else None
+            if sent:
+                files.append((digest, media_type, *sent))
+        return files
+
+
+class UploadCache:
+    """
+    Публикация файлов с сервера: элемент media_list вида {'type': 'photo', 'path': 'promo/1.jpg'}
+    или {'type': 'video', 'url': 'http://cdn.local/v.mp4'} вместо file_id.
+
+    * Файл с диска хэшируется (sha256) кусками и отправляется потоком через FSInputFile —
+      в памяти никогда не лежит целиком. Файл по URL так же кусками скачивается
+      во временный файл с подсчетом хэша.
+    * После первой успешной отправки file_id из ответа Telegram записывается по хэшу
+      содержимого (таблица upload_cache), и следующие отправки того же файла —
+      с любым путем или URL — идут по file_id, без загрузки.
+    * Пока файл загружается, другие отправки того же содержимого (рассылка в несколько
+      каналов) ждут и берут готовый file_id, а не загружают его параллельно.
+    """
+
+    def __init__(self, database=db, root=UPLOAD_DIR, chunk_size=UPLOAD_CHUNK_SIZE, url_timeout=UPLOAD_URL_TIMEOUT):
+        self.db = database
+        self.root = root
+        self.chunk_size = chunk_size
+        self.url_timeout = url_timeout
+        self._session = None
+        self._locks = {}  # (bot_id, sha256) -> [asyncio.Lock, сколько отправок его ждут]
+
+        self.uploaded = 0
+        self.cached = 0
+        self.uploaded_bytes = 0
+
+    @asynccontextmanager
+    async def prepare(self, media_list):
+        """
+        async with upload_cache.prepare(media_list) as batch:
+            messages = await send(batch.media)
+            await upload_cache.remember(batch, messages)
+        """
+        if not any(is_upload(m) for m in media_list):
+            # Обычный пост из file_id: ни хэшей, ни блокировок
+            yield _Batch(media_list, {})
+            return
+
+        temp_files = []
+        keys = []
+        try:
+            # 1. Хэш содержимого каждого файла с сервера
+            sources = {}  # номер -> (путь на диске, sha256)
+            for index, item in enumerate(media_list):
+                if is_upload(item):
+                    sources[index] = await self._fetch(item, temp_files)
+
+            # 2. Блокировки по содержимому — в одном порядке, чтобы альбомы не ждали друг друга по кругу
+            bot_id = self.db.current_bot_id()
+            for key in sorted({(bot_id, digest) for _, digest in sources.values()}):
+                entry = self._locks.setdefault(key, [asyncio.Lock(), 0])
+                entry[1] += 1
+                try:
+                    await entry[0].acquire()
+                except BaseException:
+                    entry[1] -= 1
+                    if not entry[1]:
+                        del self._locks[key]
+                    raise
+                keys.append(key)
+
+            # 3. Уже загруженное — по file_id, остальное — потоком с диска
+            media, pending = [], {}
+            for index, item in enumerate(media_list):
+                if index not in sources:
+                    media.append(item)
+                    continue
+                path, digest = sources[index]
+                file_id = await self.db.get_uploaded_file(digest, item['type'])
+                if file_id:
+                    self.cached += 1
+                    media.append({**item, 'id': file_id})
+                else:
+                    pending[index] = (digest, item['type'])
+                    media.append({**item, 'id': FSInputFile(path, chunk_size=self.chunk_size)})
+            yield _Batch(media, pending)
+        finally:
+            for key in keys:
+                entry = self._locks[key]
+                entry[0].release()
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._locks[key]
+            for path in temp_files:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    async def remember(self, batch: _Batch, messages):
+        """Запись file_id загруженных файлов (вызывать до выхода из prepare, пока держатся блокировки)"""
+        files = batch.uploaded_files(messages)
+        if not files:
+            return
+        await self.db.save_uploaded_files(files)
+        self.uploaded += len(files)
+        self.uploaded_bytes += sum(size or 0 for *_, size in files)
+
+    async def _fetch(self, item, temp_files):
+        """(путь на диске, sha256) файла из элемента media_list"""
+        if 'path' in item:
+            path = resolve_path(item['path'], self.root)
+            stat = os.stat(path)
+            digest = await asyncio.to_thread(_file_digest, path, stat.st_size, stat.st_mtime_ns, self.chunk_size)
+            return path, digest
+        return await self._download(item['url'], temp_files)
+
+    async def _download(self, url, temp_files):
+        """Скачивание по URL кусками во временный файл с подсчетом sha256"""
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.url_timeout))
+        fd, path = tempfile.mkstemp(prefix="upload_")
+        temp_files.append(path)
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                async with self._session.get(url) as response:
+                    if response.status != 200:
+                        raise UploadError(f"{url}: HTTP {response.status}")
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        digest.update(chunk)
+                        f.write(chunk)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise UploadError(f"{url}: {e or type(e).__name__}") from e
+        return path, digest.hexdigest()
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    def stats(self):
+        return {
+            'uploaded': self.uploaded,
+            'cached': self.cached,
+            'uploaded_bytes': self.uploaded_bytes,
+            'uploading': len(self._locks),
+        }
+
+
+upload_cache = UploadCache()
@@ -0,0 +1,70 @@
+import asyncio
+import logging
+from typing import List
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+
+from config import WEBHOOK_BASE_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET
+
+
+def webhook_path(bot: Bot, bots: List[Bot]) -> str:
+    """Путь вебхука: WEBHOOK_PATH для одного бота, WEBHOOK_PATH/<bot_id> — когда ботов несколько"""
+    return WEBHOOK_PATH if len(bots) == 1 else f"{WEBHOOK_PATH.rstrip('/')}/{bot.id}"
+
+
+def create_webhook_app(dp: Dispatcher, bots: List[Bot]) -> web.Application:
+    """
+    aiohttp-приложение, принимающее обновления от Telegram.
+
+    * Заголовок X-Telegram-Bot-Api-Secret-Token сверяется с WEBHOOK_SECRET (иначе 401).
+    * Обновление передается в dp.feed_update фоновой задачей, а Telegram сразу
+      получает ответ 200 — медленный хендлер не задерживает следующие обновления.
+    * У каждого бота свой путь (webhook_path), сервер и диспетчер общие.
+    """
+    app = web.Application()
+    for bot in bots:
+        SimpleRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            handle_in_background=True,
+            secret_token=WEBHOOK_SECRET or None,
+        ).register(app, path=webhook_path(bot, bots))
+
+    # Запуск/остановка диспетчера вместе с приложением (закрытие FSM-хранилища и т.п.)
+    setup_application(app, dp, bots=bots)
+    return app
+
+
+async def register_webhooks(bots: List[Bot], allowed_updates):
+    """Регистрация вебхука каждого бота в Telegram"""
+    if not WEBHOOK_BASE_URL:
+        # Без публичного адреса сервер все равно поднимается —
+        # так его можно проверить локально, отправляя JSON обновлений через curl
+        logging.warning("WEBHOOK_BASE_URL не задан: вебхук в Telegram не зарегистрирован")
+        return
+    for bot in bots:
+        await bot.set_webhook(
+            url=f"{WEBHOOK_BASE_URL.rstrip('/')}{webhook_path(bot, bots)}",
+            secret_token=WEBHOOK_SECRET or None,
+            allowed_updates=allowed_updates,
+        )
+
+
+async def run_webhook(dp: Dispatcher, bots: List[Bot], allowed_updates):
+    """Регистрация вебхуков в Telegram и запуск встроенного HTTP-сервера"""
+    await register_webhooks(bots, allowed_updates)
+
+    runner = web.AppRunner(create_webhook_app(dp, bots))
+    await runner.setup()
+    site = web.TCPSite(runner, host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    await site.start()
+    for bot in bots:
+        logging.info(f"Вебхук слушает http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{webhook_path(bot, bots)}")
+
+    try:
+        # Сервер работает до отмены задачи (Ctrl+C / остановка контейнера)
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()